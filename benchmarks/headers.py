@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the header translation of a proxied request and its response.
+
+Compares the compiled pipelines of roxy.headers with the loops the view used to run on every message:
+
+    python benchmarks/headers.py [--headers 20] [--number 20000]
+"""
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from httplib2 import Response
+
+from roxy.headers import RequestHeaders, ResponseHeaders
+
+_hop_headers = {
+    'connection':1, 'keep-alive':1, 'proxy-authenticate':1,
+    'proxy-authorization':1, 'te':1, 'trailers':1, 'transfer-encoding':1,
+    'upgrade':1
+}
+
+
+def legacy_request_headers(meta):
+    """
+    Request headers the way get_page built them before the pipelines
+    """
+    headers = {}
+    for header, value in meta.items():
+        if header.startswith('HTTP_') or header in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            name = header.replace('HTTP_', '').replace('_', '-').title()
+            if name.lower() == 'content-length' and value == '':
+                continue
+            if name.lower() not in _hop_headers.keys():
+                headers[name] = value
+    return headers
+
+
+def legacy_response_headers(httplib2_response):
+    """
+    Response headers the way update_response_headers filtered them before the pipelines
+    """
+    headers = {}
+    ignored_keys = ['status', 'content-location'] + _hop_headers.keys()
+    for key, value in httplib2_response.items():
+        if key.lower() not in ignored_keys:
+            headers[key] = value
+    return headers
+
+
+def sample_messages(header_count):
+    """
+    A WSGI environ and an origin response with header_count headers each, besides the usual CGI variables
+    """
+    meta = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/some/path', 'QUERY_STRING': 'some=data', 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1', 'SCRIPT_NAME': '',
+        'CONTENT_TYPE': 'text/plain', 'CONTENT_LENGTH': '', 'wsgi.url_scheme': 'http', 'wsgi.multithread': True,
+        'HTTP_CONNECTION': 'keep-alive',
+    }
+    response = Response({'status': 200, 'content-location': 'http://origin/some/path', 'connection': 'keep-alive'})
+    for i in range(header_count):
+        meta['HTTP_X_CUSTOM_HEADER_%d' % i] = 'value %d' % i
+        response['x-custom-header-%d' % i] = 'value %d' % i
+    return meta, response
+
+
+def main():
+    """
+    Time both implementations on the same messages and print the time each takes per message
+    """
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1].strip())
+    parser.add_option('--headers', type='int', default=20, help='headers per message besides the usual ones')
+    parser.add_option('--number', type='int', default=20000, help='messages translated per measure')
+    options, _ = parser.parse_args()
+
+    meta, response = sample_messages(options.headers)
+    request_pipeline, response_pipeline = RequestHeaders(), ResponseHeaders()
+    assert request_pipeline.translate(meta) == legacy_request_headers(meta)
+    assert response_pipeline.translate(response) == legacy_response_headers(response)
+
+    for direction, legacy, compiled, message in (
+            ('request', legacy_request_headers, request_pipeline.translate, meta),
+            ('response', legacy_response_headers, response_pipeline.translate, response)):
+        timings = [min(timeit.repeat(lambda: translate(message), number=options.number, repeat=5)) / options.number
+                   for translate in (legacy, compiled)]
+        print '%-8s legacy %6.2f us  compiled %6.2f us  saved %6.2f us (%.0f%%)' % (
+            direction, timings[0] * 1e6, timings[1] * 1e6, (timings[0] - timings[1]) * 1e6,
+            100 * (1 - timings[1] / timings[0]))
+
+
+if __name__ == '__main__':
+    main()
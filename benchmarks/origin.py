@@ -0,0 +1,86 @@
+"""
+Stand-in origin server for the benchmarks, answering every request from memory:
+
+    python benchmarks/origin.py [--port 8901]
+
+The query of a request sets its response: ``size`` bytes of body and ``headers`` extra headers. The request body
+is read and thrown away.
+"""
+import BaseHTTPServer
+import optparse
+import socket
+import SocketServer
+import urlparse
+
+_bodies = {}
+
+
+class OriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Keep-alive handler answering any method with the response its query asks for
+    """
+    protocol_version = 'HTTP/1.1'
+    # Buffer the response so that its head goes out in one write
+    wbufsize = -1
+
+    def setup(self):
+        """
+        Turn Nagle's algorithm off, it would hold small writes back until the client acknowledges the previous ones
+        """
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def handle_any(self):
+        """
+        Read the request body, then send the response
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 64 * 1024)))
+        query = dict(urlparse.parse_qsl(urlparse.urlsplit(self.path).query))
+        size = int(query.get('size', 0))
+        body = _bodies.get(size)
+        if body is None:
+            body = _bodies[size] = 'x' * size
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        for i in range(int(query.get('headers', 0))):
+            self.send_header('X-Origin-Header-%d' % i, 'value %d' % i)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_PATCH = handle_any
+
+    def log_message(self, *args):
+        """
+        Keep quiet, logging would dominate the measures
+        """
+
+
+class OriginServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded origin server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+def main():
+    """
+    Serve until interrupted
+    """
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--port', type='int', default=8901)
+    options, _ = parser.parse_args()
+    server = OriginServer(('127.0.0.1', options.port), OriginHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Django project of a single proxied view for the benchmarks, served by a threaded WSGI server:
+
+    python benchmarks/proxy_server.py [--port 8900] [--origin http://127.0.0.1:8901] [--options '{"stream": true}']
+
+--options are the proxy() options, in JSON. GET /_benchmark/rss answers the peak resident set size of the process,
+in KiB.
+"""
+import json
+import optparse
+import os
+import resource
+import socket
+import SocketServer
+import sys
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from django.conf import settings
+
+urlpatterns = []
+
+
+def peak_rss(request):
+    """
+    Peak resident set size of the process, in KiB
+    """
+    from django.http import HttpResponse
+    return HttpResponse(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss), content_type='text/plain')
+
+
+class ThreadedWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    """
+    WSGI server handling each connection in its own thread
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+    """
+    Request handler that sends small writes right away and does not log, logging would dominate the measures
+    """
+
+    def setup(self):
+        """
+        Turn Nagle's algorithm off, it would hold small writes back until the client acknowledges the previous ones
+        """
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        WSGIRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        """
+        Keep quiet
+        """
+
+
+def main():
+    """
+    Serve the proxied view until interrupted
+    """
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--port', type='int', default=8900)
+    parser.add_option('--origin', default='http://127.0.0.1:8901')
+    parser.add_option('--options', default='{}', help='proxy() options, in JSON')
+    options, _ = parser.parse_args()
+
+    settings.configure(DEBUG=False, ROOT_URLCONF='__main__', ALLOWED_HOSTS=['*'], MIDDLEWARE_CLASSES=())
+    from django.conf.urls.defaults import url
+    from django.core.handlers.wsgi import WSGIHandler
+    from roxy.views import proxy
+    urlpatterns.append(url(r'^_benchmark/rss$', peak_rss))
+    urlpatterns.append(url(r'', proxy(options.origin, **json.loads(options.options))))
+
+    server = make_server('127.0.0.1', options.port, WSGIHandler(),
+                         server_class=ThreadedWSGIServer, handler_class=QuietHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Throughput and latency of proxied views against a local stand-in origin:
+
+    python benchmarks/run.py [--concurrency 1,16] [--body-size 0,65536] [--method GET,POST] [--headers 10]
+                             [--requests 2000] [--options '{"stream": true}'] [--output results.json]
+                             [--compare previous.json]
+
+Every combination of concurrency, body size, method and header count is a scenario. For each of them a fresh origin
+(benchmarks/origin.py) and proxy (benchmarks/proxy_server.py) are started, warmed up, then sent a fixed number of
+requests by as many client threads as the concurrency, each request with that many extra headers. Body size is the
+size of the response, and of the request for methods that have a body.
+
+Reported for each scenario are requests per second, the 50th, 99th and 99.9th percentiles of latency and the peak
+resident set size of the proxy process. --output saves them as JSON and --compare prints how they changed from a
+previous run.
+"""
+import httplib
+import itertools
+import json
+import optparse
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_METHODS_WITH_BODY = frozenset(['POST', 'PUT', 'PATCH'])
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest rank percentile of a sorted list
+    """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def start(script, port, *args):
+    """
+    Start one of the benchmark servers and wait until it accepts connections
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(_HERE, script), '--port', str(port)] + list(args))
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return process
+        except socket.error:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('%s did not start listening on port %d' % (script, port))
+
+
+def send_requests(port, scenario, count, latencies, errors):
+    """
+    Send count requests of scenario to the proxy, appending their latencies and errors
+    """
+    path = '/bench?size=%d&headers=%d' % (scenario['body_size'], scenario['headers'])
+    body = 'x' * scenario['body_size'] if scenario['method'] in _METHODS_WITH_BODY else None
+    headers = dict(('X-Client-Header-%d' % i, 'value %d' % i) for i in range(scenario['headers']))
+    for _ in range(count):
+        started = time.time()
+        try:
+            # The WSGI server of the proxy closes the connection after each response
+            connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request(scenario['method'], path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                raise httplib.HTTPException('status %d' % response.status)
+        except (socket.error, httplib.HTTPException) as error:
+            errors.append(str(error))
+            continue
+        latencies.append(time.time() - started)
+
+
+def run_load(port, scenario, count):
+    """
+    Send count requests of scenario over as many threads as its concurrency, return (latencies, errors, seconds)
+    """
+    latencies, errors = [], []
+    concurrency = scenario['concurrency']
+    shares = [count // concurrency + (1 if i < count % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=send_requests, args=(port, scenario, share, latencies, errors))
+               for share in shares]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.time() - started
+
+
+def run_scenario(scenario, options):
+    """
+    Measures of one scenario against fresh servers
+    """
+    origin = start('origin.py', options.origin_port)
+    proxy = start('proxy_server.py', options.proxy_port, '--origin', 'http://127.0.0.1:%d' % options.origin_port,
+                  '--options', options.options)
+    try:
+        run_load(options.proxy_port, scenario, options.warmup)
+        latencies, errors, seconds = run_load(options.proxy_port, scenario, options.requests)
+        connection = httplib.HTTPConnection('127.0.0.1', options.proxy_port)
+        connection.request('GET', '/_benchmark/rss')
+        peak_rss_kib = int(connection.getresponse().read())
+    finally:
+        for process in (proxy, origin):
+            process.terminate()
+            process.wait()
+    latencies.sort()
+    result = dict(scenario)
+    result.update(
+        requests=len(latencies),
+        errors=len(errors),
+        seconds=round(seconds, 3),
+        requests_per_second=round(len(latencies) / seconds, 1),
+        p50_ms=round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        p999_ms=round(percentile(latencies, 0.999) * 1000, 3) if latencies else None,
+        peak_rss_kib=peak_rss_kib,
+    )
+    return result
+
+
+def scenario_name(scenario):
+    """
+    Short name identifying a scenario across runs
+    """
+    return '%(method)s c=%(concurrency)d body=%(body_size)d headers=%(headers)d' % scenario
+
+
+def compare(results, previous):
+    """
+    Print how the measures of results changed from those of previous
+    """
+    previous = dict((scenario_name(result), result) for result in previous['scenarios'])
+    for result in results['scenarios']:
+        before = previous.get(scenario_name(result))
+        if before is None:
+            continue
+        changes = []
+        for measure in ('requests_per_second', 'p50_ms', 'p99_ms', 'p999_ms', 'peak_rss_kib'):
+            if before[measure] and result[measure] is not None:
+                changes.append('%s %+.1f%%' % (measure, 100.0 * (result[measure] - before[measure]) / before[measure]))
+        print '%-40s %s' % (scenario_name(result), '  '.join(changes))
+
+
+def main():
+    """
+    Run every scenario, print and save the results
+    """
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--concurrency', default='1,16', help='comma separated client thread counts')
+    parser.add_option('--body-size', default='0,65536', help='comma separated body sizes in bytes')
+    parser.add_option('--method', default='GET,POST', help='comma separated methods')
+    parser.add_option('--headers', default='10', help='comma separated counts of extra headers')
+    parser.add_option('--requests', type='int', default=2000, help='measured requests per scenario')
+    parser.add_option('--warmup', type='int', default=200, help='requests sent before measuring')
+    parser.add_option('--options', default='{}', help='proxy() options, in JSON')
+    parser.add_option('--proxy-port', type='int', default=8900)
+    parser.add_option('--origin-port', type='int', default=8901)
+    parser.add_option('--output', help='file to save the results to, as JSON')
+    parser.add_option('--compare', help='results of a previous run to compare with')
+    options, _ = parser.parse_args()
+
+    scenarios = [dict(method=method, concurrency=int(concurrency), body_size=int(body_size), headers=int(headers))
+                 for method, concurrency, body_size, headers in itertools.product(
+                     options.method.split(','), options.concurrency.split(','), options.body_size.split(','),
+                     options.headers.split(','))]
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'proxy_options': json.loads(options.options),
+        'requests': options.requests,
+        'scenarios': [],
+    }
+    print '%-40s %10s %9s %9s %9s %10s %7s' % ('scenario', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms', 'RSS KiB', 'errors')
+    for scenario in scenarios:
+        result = run_scenario(scenario, options)
+        results['scenarios'].append(result)
+        print '%-40s %10.1f %9.3f %9.3f %9.3f %10d %7d' % (
+            scenario_name(result), result['requests_per_second'], result['p50_ms'] or 0, result['p99_ms'] or 0,
+            result['p999_ms'] or 0, result['peak_rss_kib'], result['errors'])
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
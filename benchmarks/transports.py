@@ -0,0 +1,74 @@
+"""
+Throughput and latency of each upstream transport against a local stand-in origin:
+
+    python benchmarks/transports.py [--transports httplib2,httplib] [--concurrency 1,16] [--body-size 0,65536]
+                                    [--method GET] [--requests 2000] [--options '{"stream": true}']
+                                    [--output results.json]
+
+Runs the scenarios of benchmarks/run.py once per transport, the proxy() transport option set to it on top of
+--options, and prints them side by side. The stand-in origin speaks HTTP/1.1 only, so the http2 transport cannot be
+measured against it.
+"""
+import itertools
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import run_scenario, scenario_name
+
+
+def main():
+    """
+    Run every scenario with every transport, print and save the results
+    """
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--transports', default='httplib2,httplib', help='comma separated transports to compare')
+    parser.add_option('--concurrency', default='1,16', help='comma separated client thread counts')
+    parser.add_option('--body-size', default='0,65536', help='comma separated body sizes in bytes')
+    parser.add_option('--method', default='GET', help='comma separated methods')
+    parser.add_option('--headers', default='10', help='comma separated counts of extra headers')
+    parser.add_option('--requests', type='int', default=2000, help='measured requests per scenario')
+    parser.add_option('--warmup', type='int', default=200, help='requests sent before measuring')
+    parser.add_option('--options', default='{}', help='other proxy() options, in JSON')
+    parser.add_option('--proxy-port', type='int', default=8900)
+    parser.add_option('--origin-port', type='int', default=8901)
+    parser.add_option('--output', help='file to save the results to, as JSON')
+    options, _ = parser.parse_args()
+
+    transports = options.transports.split(',')
+    proxy_options = json.loads(options.options)
+    scenarios = [dict(method=method, concurrency=int(concurrency), body_size=int(body_size), headers=int(headers))
+                 for method, concurrency, body_size, headers in itertools.product(
+                     options.method.split(','), options.concurrency.split(','), options.body_size.split(','),
+                     options.headers.split(','))]
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'proxy_options': proxy_options,
+        'requests': options.requests,
+        'transports': dict((transport, []) for transport in transports),
+    }
+    print '%-40s %-10s %10s %9s %9s %9s %7s' % ('scenario', 'transport', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms',
+                                                'errors')
+    for scenario in scenarios:
+        for transport in transports:
+            options.options = json.dumps(dict(proxy_options, transport=transport))
+            result = run_scenario(scenario, options)
+            results['transports'][transport].append(result)
+            print '%-40s %-10s %10.1f %9.3f %9.3f %9.3f %7d' % (
+                scenario_name(result), transport, result['requests_per_second'], result['p50_ms'] or 0,
+                result['p99_ms'] or 0, result['p999_ms'] or 0, result['errors'])
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,36 @@
 """
 Reverse proxy app
 """
-from django.http import HttpRequest
-from httplib2 import Http as httplib2_Http
+import httplib
+import math
+import socket
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from httplib2 import Http as httplib2_Http, HttpLib2Error
+
+
+class OriginUnavailable(HttpLib2Error):
+    """
+    Raised instead of sending a request to an origin that cannot take it now
+    """
+
+    def __init__(self, message, retry_after=None):
+        HttpLib2Error.__init__(self, message)
+        self.retry_after = retry_after
+
+    def response(self):
+        """
+        503 response for the request that could not be sent, telling the client when to try again if known
+        """
+        response = HttpResponse(str(self), status=503, content_type='text/plain')
+        if self.retry_after is not None:
+            response['Retry-After'] = str(int(math.ceil(self.retry_after)))
+        return response
+
+
+# Errors raised when the origin cannot be reached or does not answer properly
+UPSTREAM_ERRORS = (socket.error, httplib.HTTPException, HttpLib2Error)
 
 
 HttpRequest._orig_load_post_and_files = HttpRequest._load_post_and_files    # pylint: disable=W0212
@@ -18,7 +46,11 @@ def _load_post_and_files(self):
     else:
         self.raw_post_data
     return self._orig_load_post_and_files()    # pylint: disable=W0212
-HttpRequest._load_post_and_files = _load_post_and_files
+
+# Proxied views do not need the body loaded in memory, they stream it to the origin. This is only needed when
+# something reads request.POST of a multipart request before the proxied view, e.g. CsrfViewMiddleware.
+if getattr(settings, 'ROXY_LOAD_BODY_BEFORE_POST', True):
+    HttpRequest._load_post_and_files = _load_post_and_files
 
 
 class Http(httplib2_Http):
@@ -0,0 +1,234 @@
+"""
+Spread the requests of a proxied view over several origin servers
+"""
+import math
+import random
+import threading
+import time
+from urlparse import urlsplit
+
+from roxy.hashring import HashRing
+from roxy.health import CircuitOpen
+
+
+class Origin(object):
+    """
+    One origin server of a proxied view, with its own connection pool, and optionally its circuit breaker and
+    concurrency limiter
+    """
+
+    def __init__(self, server, weight=1, pool=None, breaker=None, limiter=None):    # pylint: disable=R0913
+        self.server = server
+        # if origin server is not a url then assume it's netloc? to make it compat with previous version
+        if '://' in server:
+            url = urlsplit(server)
+            self.scheme, self.host = url.scheme, url.netloc
+        else:
+            self.scheme, self.host = None, server
+        self.weight = weight
+        self.pool = pool
+        self.breaker = breaker
+        self.limiter = limiter
+        self.requests = 0
+        self.ewma = 0.0
+        self.ewma_at = None
+        self.current_weight = 0
+
+    def target_url(self, scheme, full_path):
+        """
+        URL of the request for full_path on this origin, sent with scheme unless the origin has its own
+        """
+        return '%s://%s%s' % (self.scheme or scheme, self.host, full_path)
+
+    @property
+    def outstanding(self):
+        """
+        Requests being sent to, or read from, the origin
+        """
+        return self.pool.stats()['in_use']
+
+    def stats(self):
+        """
+        Snapshot of the origin counters
+        """
+        stats = {
+            'server': self.server,
+            'weight': self.weight,
+            'requests': self.requests,
+            'outstanding': self.outstanding,
+            'ewma': self.ewma,
+        }
+        if self.breaker is not None:
+            stats['breaker'] = self.breaker.stats()
+        if self.limiter is not None:
+            stats['limiter'] = self.limiter.stats()
+        return stats
+
+
+class Balancer(object):
+    """
+    Choose the origin each request is sent to.
+
+    Strategies are 'round_robin', weighted; 'least_outstanding', the origin with the fewest requests in flight for
+    its weight; and 'ewma', the better of two random origins given their recent latency, an exponentially weighted
+    moving average decaying over ewma_decay_time seconds, and requests in flight; and 'consistent_hash', the origin
+    the key of the request goes to on a ``HashRing`` of hash_virtual_nodes per unit of weight and hash_load_factor.
+    """
+
+    def __init__(self, origins, strategy='round_robin', ewma_decay_time=10, hash_virtual_nodes=160,
+                 hash_load_factor=1.25):    # pylint: disable=R0913
+        if strategy not in _STRATEGIES:
+            raise ValueError('Unknown balancing strategy %r, use one of %s' % (strategy, ', '.join(_STRATEGIES)))
+        self.origins = origins
+        self.strategy = strategy
+        self.ewma_decay_time = ewma_decay_time
+        self.ring = HashRing(origins, hash_virtual_nodes, hash_load_factor) if strategy == 'consistent_hash' else None
+        self._choose = None if self.ring is not None else getattr(self, _STRATEGIES[strategy])
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def choose(self, key=None):
+        """
+        Origin to send the next request to, among those whose circuit breaker lets requests through. key is the hash
+        key of the request for the 'consistent_hash' strategy.
+        """
+        candidates = [origin for origin in self.origins if origin.breaker is None or origin.breaker.available()]
+        while candidates:
+            with self._lock:
+                if len(candidates) == 1:
+                    origin = candidates[0]
+                elif self.ring is not None:
+                    origin = self.ring.choose(key, candidates)
+                else:
+                    origin = self._choose(candidates)
+            if origin.breaker is None or origin.breaker.acquire():
+                with self._lock:
+                    origin.requests += 1
+                return origin
+            # Another request took the probe of a half open circuit in between
+            candidates.remove(origin)
+        raise CircuitOpen('The circuit breakers of all origins are open',
+                          retry_after=min(origin.breaker.retry_after() for origin in self.origins))
+
+    def cancel(self, origin):
+        """
+        Account for a request that was not sent to the origin choose() returned after all
+        """
+        if origin.breaker is not None:
+            origin.breaker.cancel()
+
+    def record(self, origin, elapsed, failed=False):
+        """
+        Account for a request to origin that took elapsed seconds to answer, or to fail
+        """
+        if origin.breaker is not None:
+            if failed:
+                origin.breaker.failure()
+            else:
+                origin.breaker.success()
+        if failed:
+            return
+        now = time.time()
+        with self._lock:
+            if origin.ewma_at is None:
+                origin.ewma = elapsed
+            else:
+                decay = math.exp(-(now - origin.ewma_at) / self.ewma_decay_time)
+                origin.ewma = origin.ewma * decay + elapsed * (1 - decay)
+            origin.ewma_at = now
+
+    def stats(self):
+        """
+        Snapshot of the counters of every origin
+        """
+        with self._lock:
+            return {'strategy': self.strategy, 'origins': [origin.stats() for origin in self.origins]}
+
+    def close(self):
+        """
+        Close the idle connections to every origin
+        """
+        for origin in self.origins:
+            if origin.pool is not None:
+                origin.pool.close()
+
+    def _round_robin(self, candidates):
+        """
+        Smooth weighted round robin, as nginx does it
+        """
+        total = 0
+        chosen = None
+        for origin in candidates:
+            origin.current_weight += origin.weight
+            total += origin.weight
+            if chosen is None or origin.current_weight > chosen.current_weight:
+                chosen = origin
+        chosen.current_weight -= total
+        return chosen
+
+    def _least_outstanding(self, candidates):
+        """
+        Origin with the fewest requests in flight for its weight, ties broken at random
+        """
+        loads = [(float(origin.outstanding) / origin.weight, self._random.random(), origin) for origin in candidates]
+        return min(loads)[2]
+
+    def _ewma(self, candidates):
+        """
+        Power of two choices on the expected latency of the origins
+        """
+        first, second = self._pick_two(candidates)
+        return min((first, second), key=self._cost)
+
+    def _cost(self, origin):
+        """
+        Expected latency of a new request to origin
+        """
+        return origin.ewma * (origin.outstanding + 1) / origin.weight
+
+    def _pick_two(self, candidates):
+        """
+        Two different origins drawn at random in proportion to their weights
+        """
+        first = self._weighted_pick(candidates)
+        rest = [origin for origin in candidates if origin is not first]
+        return first, self._weighted_pick(rest)
+
+    def _weighted_pick(self, candidates):
+        """
+        Origin drawn at random in proportion to its weight
+        """
+        point = self._random.uniform(0, sum(origin.weight for origin in candidates))
+        for origin in candidates:
+            point -= origin.weight
+            if point <= 0:
+                return origin
+        return candidates[-1]
+
+
+_STRATEGIES = {
+    'round_robin': '_round_robin',
+    'least_outstanding': '_least_outstanding',
+    'ewma': '_ewma',
+    # Chosen by the hash ring of the balancer
+    'consistent_hash': None,
+}
+
+
+def parse_origins(origin_servers):
+    """
+    (server, weight) pairs for the origin_servers given to proxy(), a server or a list of servers or (server, weight)
+    """
+    if isinstance(origin_servers, basestring):
+        origin_servers = [origin_servers]
+    origins = []
+    for origin_server in origin_servers:
+        if isinstance(origin_server, basestring):
+            origin_server = (origin_server, 1)
+        server, weight = origin_server
+        if weight <= 0:
+            raise ValueError('Weight of origin %s must be positive' % server)
+        origins.append((server, weight))
+    if not origins:
+        raise ValueError('proxy() needs at least one origin server')
+    return origins
@@ -0,0 +1,256 @@
+"""
+Batches of proxied requests, fanned out to their origins at the same time and answered together
+"""
+import base64
+import json
+import threading
+import time
+from Queue import Queue
+from StringIO import StringIO
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+
+from roxy.options import option, check_no_options_left
+from roxy.router import Router
+
+# Headers of the batch request that do not apply to its sub-requests
+_BATCH_ONLY_META = ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_CONTENT_ENCODING', 'HTTP_TRANSFER_ENCODING',
+                    'HTTP_CONTENT_MD5')
+
+
+def batch(routes, **options):
+    """
+    Builder for a Django view answering a batch of requests to the origins of routes. Use this in your urls.py.
+
+    routes is a route table as for ``Router``, or a Router. The view takes a POST of a JSON list of sub-requests,
+    each an object with a path, and optionally a method, default 'GET', headers and a body. Sub-requests carry the
+    headers and cookies of the batch request, with their own headers on top, and go through the proxied view of their
+    route. The answer is a JSON list of the responses in the same order, each an object with a status, headers and a
+    body, base64 encoded with ``"body_encoding": "base64"`` when it is not UTF-8 text.
+
+    Options, each of which falls back to the ``ROXY_<OPTION>`` setting when not given:
+
+    batch_workers
+        Sub-requests of all the batches of the view run at the same time, default 8.
+    batch_max_items
+        Larger batches are refused with a 400 Bad Request, default 20.
+    batch_deadline
+        Seconds the view waits for the sub-requests of a batch, default 10. Those that are not done by then are
+        answered 504 Gateway Timeout in the batch.
+
+    The pool running the sub-requests is available as ``view.fan_out``, see ``FanOut.stats()``, and the router as
+    ``view.router``.
+    """
+    router = routes if isinstance(routes, Router) else Router(routes)
+    fan_out = FanOut(option(options, 'batch_workers', 8))
+    max_items = option(options, 'batch_max_items', 20)
+    deadline = option(options, 'batch_deadline', 10)
+    check_no_options_left(options)
+
+    def batch_view(request):
+        """
+        Responses of the origins to a batch of requests
+        """
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        try:
+            items = parse_batch(request.body if hasattr(request, 'body') else request.raw_post_data)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error), content_type='text/plain')
+        if len(items) > max_items:
+            return HttpResponseBadRequest('Batch of more than %d requests' % max_items, content_type='text/plain')
+
+        def send(item):
+            """
+            Response to a sub-request, as its entry in the batch response
+            """
+            sub_request = _sub_request(request, item)
+            path = sub_request.path_info
+            view = router.resolve(request.get_host(), path)
+            if view is None:
+                return _error_entry(404, 'No route for %s' % path)
+            return _entry(view(sub_request))
+        results = fan_out.map(send, items, time.time() + deadline)
+        entries = [_error_entry(504, 'Deadline exceeded') if result is None else result for result in results]
+        return HttpResponse(json.dumps(entries), content_type='application/json')
+    batch_view.fan_out = fan_out
+    batch_view.router = router
+    return batch_view
+
+
+def parse_batch(body):
+    """
+    Sub-requests of the body of a batch request, with their method and path checked
+    """
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise ValueError('Batch body is not JSON')
+    if not isinstance(items, list):
+        raise ValueError('Batch body is not a list of requests')
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('path'), basestring) or \
+                not item['path'].startswith('/'):
+            raise ValueError('Batch request without an absolute path')
+        if not isinstance(item.get('headers', {}), dict) or not isinstance(item.get('body', ''), basestring):
+            raise ValueError('Batch request with headers that are not an object or a body that is not a string')
+        item['method'] = str(item.get('method', 'GET')).upper()
+    return items
+
+
+class FanOut(object):
+    """
+    Pool of worker threads running the sub-requests of batches, workers of them at most at the same time.
+
+    Sub-requests queue for a worker when all are busy. A sub-request whose batch is past its deadline by the time a
+    worker takes it is not run.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._tasks = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('submitted', 'completed', 'failed', 'expired'), 0)
+
+    def map(self, function, items, deadline):
+        """
+        [function(item) for item in items] run by the workers, None for those not done by deadline, a time.time().
+        Items raising an exception get a 502 Bad Gateway batch entry.
+        """
+        self._start()
+        results = _Results(len(items), deadline)
+        for index, item in enumerate(items):
+            self._tasks.put((results, index, function, item))
+        self._count('submitted', len(items))
+        return results.wait()
+
+    def stats(self):
+        """
+        Snapshot of the fan out counters
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(workers=self.workers, queued=self._tasks.qsize())
+        return stats
+
+    def _start(self):
+        """
+        Start the workers, the first time there is work for them
+        """
+        if len(self._threads) < self.workers:
+            with self._lock:
+                while len(self._threads) < self.workers:
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self):
+        """
+        Run tasks as they come
+        """
+        while True:
+            results, index, function, item = self._tasks.get()
+            if results.expired():
+                self._count('expired')
+                continue
+            try:
+                result = function(item)
+            except Exception as error:    # pylint: disable=W0703
+                # The batch answers the others, this one fails on its own as the proxied view would
+                self._count('failed')
+                result = _error_entry(502, '%s: %s' % (error.__class__.__name__, error))
+            else:
+                self._count('completed')
+            results.set(index, result)
+
+    def _count(self, name, increment=1):
+        """
+        Increment a counter
+        """
+        with self._lock:
+            self._counters[name] += increment
+
+
+class _Results(object):
+    """
+    Results of the items of a batch, filled in by the workers
+    """
+
+    def __init__(self, count, deadline):
+        self.deadline = deadline
+        self._results = [None] * count
+        self._pending = count
+        self._condition = threading.Condition()
+
+    def set(self, index, result):
+        """
+        Result of an item
+        """
+        with self._condition:
+            self._results[index] = result
+            self._pending -= 1
+            if not self._pending:
+                self._condition.notify()
+
+    def expired(self):
+        """
+        Whether the deadline has passed
+        """
+        return time.time() >= self.deadline
+
+    def wait(self):
+        """
+        Results once all are set or the deadline has passed
+        """
+        with self._condition:
+            while self._pending and not self.expired():
+                self._condition.wait(self.deadline - time.time())
+            return list(self._results)
+
+
+def _sub_request(request, item):
+    """
+    Request for a sub-request of a batch, with the headers and cookies of the batch request
+    """
+    environ = dict((key, value) for key, value in request.META.items() if key not in _BATCH_ONLY_META)
+    path, _, query = item['path'].partition('?')
+    body = item.get('body', '')
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    environ.update({'REQUEST_METHOD': item['method'], 'PATH_INFO': path, 'QUERY_STRING': query,
+                    'CONTENT_LENGTH': str(len(body)), 'wsgi.input': StringIO(body)})
+    for name, value in item.get('headers', {}).items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        environ[key] = str(value)
+    return WSGIRequest(environ)
+
+def _entry(response):
+    """
+    Batch response entry of the response of a proxied view
+    """
+    try:
+        if getattr(response, 'streaming', False):
+            body = ''.join(response.streaming_content)
+        else:
+            body = response.content
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    entry = {'status': response.status_code, 'headers': dict(response.items())}
+    try:
+        entry['body'] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        entry['body'] = base64.b64encode(body)
+        entry['body_encoding'] = 'base64'
+    return entry
+
+def _error_entry(status, message):
+    """
+    Batch response entry of a sub-request that got no response
+    """
+    return {'status': status, 'headers': {'Content-Type': 'text/plain'}, 'body': message}
@@ -0,0 +1,634 @@
+"""
+Shared HTTP cache (RFC 7234) for proxied responses
+"""
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+import httplib2
+from django.utils.http import parse_etags, parse_http_date_safe
+
+from roxy import UPSTREAM_ERRORS
+from roxy.disk import DiskBody, TeeBody
+
+# Statuses that may be cached without explicit freshness information, RFC 7231 section 6.1
+_HEURISTIC_STATUSES = frozenset([200, 203, 204, 300, 301, 404, 405, 410, 414, 501])
+_EXPLICIT_STATUSES = _HEURISTIC_STATUSES | frozenset([302, 307, 308])
+# Heuristic freshness is a tenth of the time since Last-Modified, but no more than a day
+_HEURISTIC_FRACTION = 0.1
+_HEURISTIC_MAX = 24 * 60 * 60
+# Headers a 304 response carries, RFC 7232 section 4.1
+_NOT_MODIFIED_HEADERS = ('cache-control', 'content-location', 'date', 'etag', 'expires', 'vary')
+# Headers of a 304 response from the origin that do not describe the stored body, RFC 7234 section 4.3.4
+_NOT_REFRESHED_HEADERS = frozenset(['status', 'content-length', 'content-encoding', 'transfer-encoding'])
+# Directives forbidding a shared cache to serve a stale response, RFC 7234 section 5.2.2
+_NO_STALE_DIRECTIVES = frozenset(['must-revalidate', 'proxy-revalidate', 'no-cache', 's-maxage'])
+# Seconds a stale response with a validator is kept so that it can be revalidated instead of fetched again
+_REVALIDATION_RETENTION = 24 * 60 * 60
+_STALE_WARNING = '110 - "Response is Stale"'
+_REVALIDATION_FAILED_WARNING = '111 - "Revalidation Failed"'
+
+
+class ResponseCache(object):
+    """
+    Cache of the GET responses of one proxied origin.
+
+    Entries are kept in an in-process LRU bounded to max_size bytes. When backend, a Django cache, is given it is
+    used as a second tier so that workers share what they have fetched. Responses larger than max_entry_size, streamed
+    or not, go to disk, a DiskStore, when it is given.
+
+    Keys are prefixed with key_prefix, which tells apart the responses of views sharing backend or disk.
+
+    Stale entries are revalidated with the origin. For stale_while_revalidate seconds after they have become stale
+    they are served while being revalidated in the background, and for stale_if_error seconds they are served when
+    the origin fails. The origin can extend these with the directives of the same names (RFC 5861).
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, max_entry_size=1024 * 1024, backend=None,
+                 stale_while_revalidate=0, stale_if_error=0, disk=None, key_prefix=''):    # pylint: disable=R0913
+        self.max_entry_size = max_entry_size
+        self.key_prefix = key_prefix
+        self.disk = disk
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._local = _LRU(max_size)
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        self._counters = dict.fromkeys(('hits', 'misses', 'revalidations', 'stale', 'stores', 'bypasses'), 0)
+
+    def fetch(self, method, url, headers, send):
+        """
+        Response for a request, from the cache when possible.
+
+        send(headers) sends the request to the origin and returns (httplib2 response, content).
+        """
+        request_directives = parse_cache_control(headers.get('Cache-Control'))
+        if method not in ('GET', 'HEAD') or 'Authorization' in headers or 'no-store' in request_directives:
+            self._count('bypasses')
+            response, content = send(headers)
+            if method not in ('GET', 'HEAD') and response.status < 400:
+                # Unsafe methods invalidate what is stored for the URL, RFC 7234 section 4.4
+                self.invalidate(url)
+            return response, content
+
+        now = time.time()
+        entry = self._lookup(url, headers)
+        if entry is not None and not _wants_origin(request_directives, headers):
+            if entry.is_fresh(now):
+                self._count('hits')
+                return entry.respond(method, headers, now)
+            if entry.may_serve_stale(now, self.stale_while_revalidate, 'stale-while-revalidate'):
+                self._count('stale')
+                self._revalidate_in_background(method, url, headers, entry, send)
+                return entry.respond(method, headers, now, _STALE_WARNING)
+        self._count('misses')
+        return self._fetch_from_origin(method, url, headers, send, entry)
+
+    def store(self, url, headers, response, content, request_time):
+        """
+        Store a GET response if it may be cached and served to other clients
+        """
+        entry = CacheEntry.from_response(response, content, headers, request_time)
+        if entry is not None and self._fits(entry.size) and entry.storable():
+            self._put(url, headers, entry)
+
+    def invalidate(self, url):
+        """
+        Forget the responses stored for url
+        """
+        # Responses stored for other variants of url may still be in the cache, remember to ignore them
+        self._set(_variants_key(self.key_prefix, url), ((), time.time()), 1, _HEURISTIC_MAX)
+
+    def stats(self):
+        """
+        Snapshot of the cache counters
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(self._local.stats())
+        if self.disk is not None:
+            stats.update(self.disk.stats())
+        return stats
+
+    def _lookup(self, url, headers):
+        """
+        Stored response matching the request headers the response varies on, if any
+        """
+        variants = self._get(_variants_key(self.key_prefix, url))
+        if variants is None:
+            return None
+        vary_names, invalidated_at = variants
+        entry = self._get(_entry_key(self.key_prefix, url, vary_names, headers))
+        if entry is not None and entry.response_time > invalidated_at and entry.matches(headers):
+            return entry
+        return None
+
+    def _fetch_from_origin(self, method, url, headers, send, entry):
+        """
+        Response from the origin, revalidating entry with it when there is one
+        """
+        request_time = time.time()
+        validating = entry is not None and entry.has_validators()
+        try:
+            response, content = send(entry.conditional_headers(headers) if validating else headers)
+        except UPSTREAM_ERRORS:
+            if entry is not None and entry.may_serve_stale(time.time(), self.stale_if_error, 'stale-if-error'):
+                self._count('stale')
+                return entry.respond(method, headers, time.time(), _REVALIDATION_FAILED_WARNING)
+            raise
+        if validating and response.status == 304:
+            _close(content)
+            self._count('revalidations')
+            entry = entry.refreshed(response, request_time)
+            self._put(url, headers, entry)
+            return entry.respond(method, headers, time.time())
+        if (response.status >= 500 and entry is not None and
+                entry.may_serve_stale(time.time(), self.stale_if_error, 'stale-if-error')):
+            _close(content)
+            self._count('stale')
+            return entry.respond(method, headers, time.time(), _REVALIDATION_FAILED_WARNING)
+        if method == 'GET' and isinstance(content, basestring):
+            self.store(url, headers, response, content, request_time)
+        elif method == 'GET' and self.disk is not None:
+            content = self._store_stream(url, headers, response, content, request_time)
+        return response, content
+
+    def _store_stream(self, url, headers, response, content, request_time):
+        """
+        Streamed content, written to disk as it is relayed to be stored once it has been relayed whole
+        """
+        entry = CacheEntry.from_response(response, '', headers, request_time)
+        if entry is None or not entry.storable() or _to_int(response.get('content-length')) > self.disk.max_entry_size:
+            return content
+
+        def store(partial):
+            """
+            Store the entry with the body written to disk, unless the origin closed the connection before the end of
+            the body, which httplib does not tell from the end of the body
+            """
+            length = response.get('content-length')
+            if length is not None and _to_int(length) != partial.size:
+                partial.discard()
+                return
+            self._put(url, headers, CacheEntry(entry.headers, partial, entry.vary, request_time, entry.response_time))
+        return TeeBody(content, self.disk.partial(), store)
+
+    def _revalidate_in_background(self, method, url, headers, entry, send):    # pylint: disable=R0913
+        """
+        Revalidate entry in a thread of its own, unless that is already being done. send sends the request with
+        method, so a full response to a HEAD request only refreshes the entry when it is a 304.
+        """
+        key = _entry_key(self.key_prefix, url, entry.vary_names, headers)
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def revalidate():
+            """
+            Refresh the entry, it stays stale for the next request to try again if the origin fails
+            """
+            try:
+                content = self._fetch_from_origin(method, url, headers, send, entry)[1]
+                if isinstance(content, TeeBody):
+                    # Read to its end for the refreshed body to be stored on disk
+                    for _ in content:
+                        pass
+                # The body of the entry, as served when the origin answers 304, is being sent to another client
+                if not isinstance(content, DiskBody):
+                    _close(content)
+            except UPSTREAM_ERRORS:
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+        thread = threading.Thread(target=revalidate)
+        thread.daemon = True
+        thread.start()
+
+    def _put(self, url, headers, entry):
+        """
+        Store entry for as long as it is worth keeping
+        """
+        timeout = entry.freshness_lifetime() - entry.current_age(entry.response_time)
+        if entry.allows_stale():
+            timeout += max(self.stale_while_revalidate, self.stale_if_error,
+                           _to_int(entry.directives.get('stale-while-revalidate')),
+                           _to_int(entry.directives.get('stale-if-error')))
+        if entry.has_validators():
+            timeout += _REVALIDATION_RETENTION
+        if timeout <= 0:
+            return
+        invalidated_at = (self._get(_variants_key(self.key_prefix, url)) or ((), 0))[1]
+        self._set(_variants_key(self.key_prefix, url), (entry.vary_names, invalidated_at), 1, timeout)
+        self._set(_entry_key(self.key_prefix, url, entry.vary_names, headers), entry, entry.size, timeout)
+        self._count('stores')
+
+    def _fits(self, size):
+        """
+        Whether an entry of size bytes may be stored
+        """
+        return size <= self.max_entry_size or (self.disk is not None and size <= self.disk.max_entry_size)
+
+    def _get(self, key):
+        """
+        Value of key from the local tier, then from disk, then from the shared one
+        """
+        value = self._local.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key, CacheEntry)
+        if value is None and self._backend is not None:
+            value = self._backend.get(key)
+            if value is not None:
+                self._local.set(key, value, getattr(value, 'size', 1))
+        return value
+
+    def _set(self, key, value, size, timeout):
+        """
+        Store key in both tiers, or on disk when it is too large for them
+        """
+        if isinstance(value, CacheEntry) and (size > self.max_entry_size or
+                                              not isinstance(value.content, basestring)):
+            self.disk.set(key, value, timeout)
+            return
+        self._local.set(key, value, size)
+        if self._backend is not None:
+            self._backend.set(key, value, max(int(timeout), 1))
+
+    def _count(self, counter):
+        """
+        Increment one of the counters
+        """
+        with self._lock:
+            self._counters[counter] += 1
+
+
+class CacheEntry(object):
+    """
+    Stored response, with what is needed to tell its freshness and the requests it can be served to
+    """
+
+    def __init__(self, headers, content, vary, request_time, response_time):
+        self.headers = headers
+        self.content = content
+        self.vary = vary
+        self.request_time = request_time
+        self.response_time = response_time
+        self.directives = parse_cache_control(headers.get('cache-control'))
+        self.size = len(content) + sum(len(key) + len(str(value)) for key, value in headers.items())
+
+    @classmethod
+    def from_response(cls, response, content, request_headers, request_time):
+        """
+        Entry for an origin response, None if the response must not be stored by a shared cache
+        """
+        headers = dict(response)
+        directives = parse_cache_control(headers.get('cache-control'))
+        if 'no-store' in directives or 'private' in directives or 'set-cookie' in headers:
+            return None
+        vary_names = tuple(sorted(name.strip().lower() for name in headers.get('vary', '').split(',') if name.strip()))
+        if '*' in vary_names:
+            return None
+        lowered = _lower_keys(request_headers)
+        return cls(headers, content, dict((name, lowered.get(name)) for name in vary_names), request_time, time.time())
+
+    @property
+    def status(self):
+        """
+        Status code of the stored response
+        """
+        return int(self.headers.get('status', 200))
+
+    @property
+    def vary_names(self):
+        """
+        Request headers the stored response varies on, in order
+        """
+        return tuple(sorted(self.vary))
+
+    def matches(self, request_headers):
+        """
+        Whether the request sends the same values for the headers the response varies on
+        """
+        lowered = _lower_keys(request_headers)
+        return all(lowered.get(name) == value for name, value in self.vary.items())
+
+    def freshness_lifetime(self):
+        """
+        Seconds the response stays fresh for, RFC 7234 section 4.2.1
+        """
+        for directive in ('s-maxage', 'max-age'):
+            if directive in self.directives:
+                return _to_int(self.directives[directive])
+        if 'expires' in self.headers:
+            expires = parse_http_date_safe(self.headers['expires'])
+            if expires is None:
+                return 0
+            return expires - (self._date() or self.response_time)
+        if self.status in _HEURISTIC_STATUSES and 'last-modified' in self.headers:
+            last_modified = parse_http_date_safe(self.headers['last-modified'])
+            if last_modified is not None:
+                return min(((self._date() or self.response_time) - last_modified) * _HEURISTIC_FRACTION,
+                           _HEURISTIC_MAX)
+        return 0
+
+    def storable(self):
+        """
+        Whether the response may be stored, RFC 7234 section 3
+        """
+        if self.status not in _EXPLICIT_STATUSES:
+            return False
+        if self.status not in _HEURISTIC_STATUSES and not self._has_explicit_freshness():
+            return False
+        return 'no-cache' not in self.directives or self.has_validators()
+
+    def has_validators(self):
+        """
+        Whether the response can be revalidated with a conditional request
+        """
+        return 'etag' in self.headers or 'last-modified' in self.headers
+
+    def allows_stale(self):
+        """
+        Whether the origin lets a shared cache serve the response once it is stale
+        """
+        return not _NO_STALE_DIRECTIVES.intersection(self.directives)
+
+    def current_age(self, now):
+        """
+        Age of the response, RFC 7234 section 4.2.3
+        """
+        apparent_age = max(0, self.response_time - (self._date() or self.response_time))
+        corrected_age_value = _to_int(self.headers.get('age', 0)) + self.response_time - self.request_time
+        return max(apparent_age, corrected_age_value) + now - self.response_time
+
+    def is_fresh(self, now):
+        """
+        Whether the response can be served without asking the origin
+        """
+        return 'no-cache' not in self.directives and self.freshness_lifetime() > self.current_age(now)
+
+    def may_serve_stale(self, now, window, directive):
+        """
+        Whether the response is stale by no more than window seconds, or than the origin allows with directive
+        """
+        if not self.allows_stale():
+            return False
+        window = max(window, _to_int(self.directives.get(directive)))
+        return self.current_age(now) - self.freshness_lifetime() <= window
+
+    def conditional_headers(self, request_headers):
+        """
+        Request headers asking the origin whether the response is still valid, RFC 7234 section 4.3.1
+        """
+        headers = dict(request_headers)
+        headers.pop('If-None-Match', None)
+        headers.pop('If-Modified-Since', None)
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def refreshed(self, response, request_time):
+        """
+        Entry updated with the headers of a 304 response to a conditional request, RFC 7234 section 4.3.4
+        """
+        headers = dict((key, value) for key, value in self.headers.items() if key not in ('age', 'warning'))
+        headers.update((key, value) for key, value in response.items() if key not in _NOT_REFRESHED_HEADERS)
+        return CacheEntry(headers, self.content, self.vary, request_time, time.time())
+
+    def respond(self, method, request_headers, now, warning=None):
+        """
+        (httplib2 response, content) to serve the entry with, a 304 if the client already has it
+        """
+        headers = dict(self.headers)
+        headers['age'] = str(int(self.current_age(now)))
+        headers['content-length'] = str(len(self.content))
+        if warning:
+            headers['warning'] = warning
+        if self._not_modified_for(request_headers):
+            headers = dict((key, headers[key]) for key in _NOT_MODIFIED_HEADERS + ('age', 'warning') if key in headers)
+            headers['status'] = '304'
+            return httplib2.Response(headers), ''
+        byte_range = self._byte_range_for(method, request_headers)
+        if byte_range is False:
+            headers.update(status='416', **{'content-range': 'bytes */%d' % len(self.content), 'content-length': '0'})
+            return httplib2.Response(headers), ''
+        if byte_range is not None:
+            start, end = byte_range
+            headers.update(status='206', **{'content-range': 'bytes %d-%d/%d' % (start, end, len(self.content)),
+                                            'content-length': str(end - start + 1)})
+            if isinstance(self.content, DiskBody):
+                return httplib2.Response(headers), self.content.slice(start, end)
+            return httplib2.Response(headers), self.content[start:end + 1]
+        return httplib2.Response(headers), '' if method == 'HEAD' else self.content
+
+    def _byte_range_for(self, method, request_headers):
+        """
+        (first, last) byte the request asks for with its Range header, None for the whole body, False when the range
+        cannot be satisfied, RFC 7233
+        """
+        lowered = _lower_keys(request_headers)
+        if method != 'GET' or self.status != 200 or 'range' not in lowered:
+            return None
+        if_range = lowered.get('if-range')
+        if if_range is not None and if_range not in (self.headers.get('etag'), self.headers.get('last-modified')):
+            return None
+        return parse_byte_range(lowered['range'], len(self.content))
+
+    def _not_modified_for(self, request_headers):
+        """
+        Whether the conditional headers of the request match the entry, RFC 7232 section 6
+        """
+        if self.status != 200:
+            return False
+        lowered = _lower_keys(request_headers)
+        if 'if-none-match' in lowered:
+            etag = self.headers.get('etag')
+            if_none_match = lowered['if-none-match'].strip()
+            return etag is not None and (if_none_match == '*' or _weak(etag) in
+                                         [_weak(tag) for tag in parse_etags(if_none_match)])
+        if 'if-modified-since' in lowered and 'last-modified' in self.headers:
+            since = parse_http_date_safe(lowered['if-modified-since'])
+            last_modified = parse_http_date_safe(self.headers['last-modified'])
+            return since is not None and last_modified is not None and last_modified <= since
+        return False
+
+    def _has_explicit_freshness(self):
+        """
+        Whether the origin said how long the response stays fresh for
+        """
+        return 's-maxage' in self.directives or 'max-age' in self.directives or 'expires' in self.headers
+
+    def _date(self):
+        """
+        Date the origin generated the response at
+        """
+        return parse_http_date_safe(self.headers.get('date', ''))
+
+
+class _LRU(object):
+    """
+    Thread-safe least recently used mapping bounded by the total size of its values
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._size = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Value of key, which becomes the most recently used one
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, value, size):
+        """
+        Store value under key, evicting the least recently used values to make room for it
+        """
+        with self._lock:
+            self._discard(key)
+            self._items[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size and self._items:
+                self._discard(next(iter(self._items)))
+                self._evictions += 1
+
+    def delete(self, key):
+        """
+        Forget key
+        """
+        with self._lock:
+            self._discard(key)
+
+    def stats(self):
+        """
+        Size counters
+        """
+        with self._lock:
+            return {'entries': len(self._items), 'size': self._size, 'evictions': self._evictions}
+
+    def _discard(self, key):
+        """
+        Remove key, must be called with the lock held
+        """
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._size -= item[1]
+
+
+def parse_cache_control(value):
+    """
+    Cache-Control directives as a dict, directives without an argument map to None
+    """
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"') or None
+    return directives
+
+
+def parse_byte_range(value, size):
+    """
+    (first, last) byte of a single byte range of a Range header for a body of size bytes, None when the header is not
+    one, False when the range cannot be satisfied
+    """
+    unit, _, ranges = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, dash, last = ranges.strip().partition('-')
+    try:
+        if not dash:
+            return None
+        if not first:
+            first, last = max(size - int(last), 0), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        return False
+    return first, last
+
+def _wants_origin(directives, headers):
+    """
+    Whether the client asks for a response validated by the origin, RFC 7234 section 5.2.1
+    """
+    return ('no-cache' in directives or _to_int(directives.get('max-age', 1)) <= 0 or
+            'no-cache' in headers.get('Pragma', ''))
+
+
+def _close(content):
+    """
+    Let go of a response body that is not used, streamed bodies hold an upstream connection
+    """
+    if hasattr(content, 'close'):
+        content.close()
+
+
+def _variants_key(prefix, url):
+    """
+    Key of the names of the headers the responses stored for url vary on
+    """
+    return 'roxy:v:%s' % md5(('%s\n%s' % (prefix, url)).encode('utf-8')).hexdigest()
+
+
+def _entry_key(prefix, url, vary_names, request_headers):
+    """
+    Key of the response stored for url and the values the request has for vary_names
+    """
+    lowered = _lower_keys(request_headers)
+    variant = '\n'.join([prefix, url] + ['%s:%s' % (name, lowered.get(name)) for name in vary_names])
+    return 'roxy:e:%s' % md5(variant.encode('utf-8')).hexdigest()
+
+
+def _lower_keys(headers):
+    """
+    Copy of headers with lowercase names
+    """
+    return dict((key.lower(), value) for key, value in headers.items())
+
+
+def _weak(etag):
+    """
+    Opaque part of an entity tag, for weak comparison
+    """
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def _to_int(value):
+    """
+    Integer value of a header or directive argument, 0 if it is not one
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def django_cache(alias):
+    """
+    Django cache backend configured as alias in the CACHES setting
+    """
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        # Django < 1.7
+        from django.core.cache import get_cache
+        return get_cache(alias)
+    return caches[alias]
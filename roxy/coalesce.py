@@ -0,0 +1,138 @@
+"""
+Single flight of identical concurrent requests to the origin
+"""
+import copy
+import socket
+import threading
+
+from roxy.cache import parse_cache_control
+
+# Request headers that change what the origin answers, requests must agree on them to share a response
+_CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Range', 'Range')
+
+
+class CoalescingTimeout(socket.timeout):
+    """
+    Raised when the request a client was waiting on takes longer than the coalescing timeout
+    """
+
+
+class Coalescer(object):
+    """
+    Collapse concurrent GET and HEAD requests for the same URL into one request to the origin.
+
+    Requests share a flight when they have the same method, URL and values for key_headers, which should name the
+    headers that identify a user. The first request goes to the origin and the others wait up to timeout seconds for
+    its response. A waiter whose headers differ from the first one's on a header the response varies on sends its
+    own request, and so does a waiter when the response is streamed, as a streamed body cannot be shared, or meant
+    for one client only: setting a cookie, private or not to be stored.
+    """
+
+    def __init__(self, timeout=30, key_headers=('Authorization', 'Cookie')):
+        self.timeout = timeout
+        self.key_headers = tuple(key_headers)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('flights', 'collapsed', 'uncollapsed', 'timeouts', 'errors'), 0)
+
+    def fetch(self, method, url, headers, send):
+        """
+        Response for a request, shared with identical requests in flight at the same time.
+
+        send(headers) sends the request to the origin and returns (httplib2 response, content).
+        """
+        if method not in ('GET', 'HEAD'):
+            return send(headers)
+        key = (method, url) + tuple(headers.get(name) for name in _CONDITIONAL_HEADERS + self.key_headers)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(headers)
+                self._counters['flights'] += 1
+                leading = True
+            else:
+                leading = False
+        if leading:
+            return self._lead(key, flight, send)
+        return self._wait(flight, headers, send)
+
+    def stats(self):
+        """
+        Snapshot of the coalescing counters
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._flights)
+        return stats
+
+    def _lead(self, key, flight, send):
+        """
+        Send the request of a flight and hand its outcome to the requests waiting on it
+        """
+        try:
+            flight.result = send(flight.headers)
+            return flight.result
+        except Exception as error:    # pylint: disable=W0703
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _wait(self, flight, headers, send):
+        """
+        Wait for the outcome of a flight led by another request
+        """
+        if not flight.done.wait(self.timeout):
+            self._count('timeouts')
+            raise CoalescingTimeout('timed out waiting for an identical request to the origin')
+        if flight.error is not None:
+            self._count('errors')
+            raise flight.error
+        response, content = flight.result
+        if not isinstance(content, basestring) or not _shareable(response) or \
+                not _same_variant(response, flight.headers, headers):
+            self._count('uncollapsed')
+            return send(headers)
+        self._count('collapsed')
+        return copy.copy(response), content
+
+    def _count(self, counter):
+        """
+        Increment one of the counters
+        """
+        with self._lock:
+            self._counters[counter] += 1
+
+
+class _Flight(object):
+    """
+    A request to the origin, and the requests waiting on its outcome
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _shareable(response):
+    """
+    Whether a response may be handed to other clients than the one it was sent to
+    """
+    directives = parse_cache_control(response.get('cache-control'))
+    return 'set-cookie' not in response and 'private' not in directives and 'no-store' not in directives
+
+
+def _same_variant(response, leader_headers, headers):
+    """
+    Whether two requests get the same response, given the headers it varies on
+    """
+    vary = [name.strip().lower() for name in response.get('vary', '').split(',') if name.strip()]
+    if '*' in vary:
+        return False
+    leader_headers = dict((key.lower(), value) for key, value in leader_headers.items())
+    headers = dict((key.lower(), value) for key, value in headers.items())
+    return all(leader_headers.get(name) == headers.get(name) for name in vary)
@@ -0,0 +1,377 @@
+"""
+Disk tier of the response cache, for bodies too large to be kept in memory
+"""
+import cPickle as pickle
+import errno
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import md5
+
+_META = '.meta'
+_BODY = '.body'
+_PART = '.part'
+# Files that are not indexed are only deleted when a store is created once they have been left alone for this long,
+# younger ones may be being written by another process sharing the directory
+_LEFTOVER_AGE = 60 * 60
+# Size of the slices of a memory mapped body handed to the WSGI server when it cannot send the file itself
+_SLICE_SIZE = 256 * 1024
+
+
+class DiskStore(object):
+    """
+    Cache entries kept as files in directory, each a body file and a small metadata file, up to max_size bytes of
+    bodies, least recently used first out.
+
+    The index of the entries, their size and expiry time, is kept in memory and rebuilt from the metadata files when
+    the store is created, so entries survive restarts. Bounds are kept by each process: processes sharing a directory
+    see each other's entries once they restart, and entries another process has evicted as misses.
+    """
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024, max_entry_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self._index = OrderedDict()
+        self._size = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, key, entry_class):
+        """
+        Entry stored under key, built with entry_class and its body opened as a DiskBody, None when there is none
+        """
+        with self._lock:
+            item = self._index.pop(key, None)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                self._remove(key, item)
+                return None
+            self._index[key] = item
+        try:
+            with open(self._path(key, _META), 'rb') as meta_file:
+                meta = pickle.load(meta_file)
+            body = DiskBody(open(meta['body'], 'rb'), meta['body'])
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            # Evicted by another process sharing the directory
+            self.delete(key)
+            return None
+        return entry_class(meta['headers'], body, meta['vary'], meta['request_time'], meta['response_time'])
+
+    def set(self, key, entry, timeout):
+        """
+        Store entry under key for timeout seconds. Its content is a string, a DiskBody of this store, or a
+        PartialBody written to completion. Nothing is stored when the files cannot be written.
+        """
+        size = len(entry.content)
+        expires_at = time.time() + timeout
+        try:
+            body_path = self._write(key, entry, expires_at)
+        except (IOError, OSError):
+            # The directory is gone or the disk is full, the response is served all the same
+            return
+        with self._lock:
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._size -= previous[0]
+                if previous[2] != body_path:
+                    _unlink(previous[2])
+            self._index[key] = (size, expires_at, body_path)
+            self._size += size
+            while self._size > self.max_size and self._index:
+                oldest = next(iter(self._index))
+                self._remove(oldest, self._index.pop(oldest))
+                self._evictions += 1
+
+    def delete(self, key):
+        """
+        Forget key
+        """
+        with self._lock:
+            item = self._index.pop(key, None)
+            if item is not None:
+                self._remove(key, item)
+
+    def partial(self):
+        """
+        New body file to be written, then stored with set() or discarded. It is abandoned from the start when the
+        file cannot be created.
+        """
+        try:
+            descriptor, path = tempfile.mkstemp(suffix=_PART, dir=self.directory)
+        except (IOError, OSError):
+            partial = PartialBody(None, None, self.max_entry_size)
+            partial.abandoned = True
+            return partial
+        return PartialBody(os.fdopen(descriptor, 'wb'), path, self.max_entry_size)
+
+    def stats(self):
+        """
+        Size counters of the store
+        """
+        with self._lock:
+            return {'disk_entries': len(self._index), 'disk_size': self._size, 'disk_evictions': self._evictions}
+
+    def _write(self, key, entry, expires_at):
+        """
+        Write the body and metadata files of entry, return the path of its body
+        """
+        content = entry.content
+        if isinstance(content, PartialBody):
+            body_path = self._new_body_path()
+            os.rename(content.path, body_path)
+        elif isinstance(content, DiskBody):
+            # Refreshed entry, the body on disk is the same
+            body_path = content.path
+        else:
+            descriptor, part_path = tempfile.mkstemp(suffix=_PART, dir=self.directory)
+            with os.fdopen(descriptor, 'wb') as body_file:
+                body_file.write(content)
+            body_path = self._new_body_path()
+            os.rename(part_path, body_path)
+        meta = {'key': key, 'body': body_path, 'size': len(content), 'expires_at': expires_at,
+                'headers': entry.headers, 'vary': entry.vary, 'request_time': entry.request_time,
+                'response_time': entry.response_time}
+        meta_part = self._path(key, '.%s%s' % (uuid.uuid4().hex, _PART))
+        with open(meta_part, 'wb') as meta_file:
+            pickle.dump(meta, meta_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(meta_part, self._path(key, _META))
+        return body_path
+
+    def _load(self):
+        """
+        Rebuild the index from the metadata files, least recently written first, and clean what has been left over
+        for long enough
+        """
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        now = time.time()
+        metas = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(_PART):
+                _unlink_leftover(path, now)
+            elif name.endswith(_META):
+                try:
+                    with open(path, 'rb') as meta_file:
+                        meta = pickle.load(meta_file)
+                    metas.append((os.path.getmtime(path), meta))
+                except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                    _unlink(path)
+        kept = set()
+        for _, meta in sorted(metas):
+            if meta['expires_at'] <= now or not os.path.exists(meta['body']):
+                _unlink(self._path(meta['key'], _META))
+                continue
+            self._index[meta['key']] = (meta['size'], meta['expires_at'], meta['body'])
+            self._size += meta['size']
+            kept.add(meta['body'])
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(_BODY) and path not in kept:
+                _unlink_leftover(path, now)
+
+    def _remove(self, key, item):
+        """
+        Delete the files of an entry taken out of the index, must be called with the lock held
+        """
+        self._size -= item[0]
+        _unlink(self._path(key, _META))
+        _unlink(item[2])
+
+    def _path(self, key, suffix):
+        """
+        Path of a file of the entry stored under key
+        """
+        return os.path.join(self.directory, md5(key).hexdigest() + suffix)
+
+    def _new_body_path(self):
+        """
+        Path of a new body file, each version of an entry has its own so that readers of the previous one are not
+        disturbed
+        """
+        return os.path.join(self.directory, uuid.uuid4().hex + _BODY)
+
+
+class DiskBody(object):
+    """
+    Body of a cached response read from its file, length bytes from offset.
+
+    The WSGI server gets it as a file, so that wsgi.file_wrapper can send it with sendfile, and Django versions
+    without FileResponse iterate over slices of the file mapped in memory.
+    """
+
+    def __init__(self, file_object, path, offset=0, length=None):
+        self.path = path
+        self._file = file_object
+        self._offset = offset
+        self._length = os.fstat(file_object.fileno()).st_size - offset if length is None else length
+        self._remaining = self._length
+        file_object.seek(offset)
+
+    def __len__(self):
+        return self._length
+
+    def slice(self, start, end):
+        """
+        Body of bytes start to end included of this one
+        """
+        return DiskBody(self._file, self.path, self._offset + start, end - start + 1)
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes of the body, to its end by default
+        """
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        """
+        Descriptor of the body file, positioned at the start of the body for sendfile
+        """
+        return self._file.fileno()
+
+    def tell(self):
+        """
+        Position in the body file
+        """
+        return self._file.tell()
+
+    def __iter__(self):
+        if not self._length:
+            return
+        mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start in xrange(self._offset, self._offset + self._length, _SLICE_SIZE):
+                yield mapped[start:min(start + _SLICE_SIZE, self._offset + self._length)]
+        finally:
+            mapped.close()
+
+    def close(self):
+        """
+        Close the body file
+        """
+        self._file.close()
+
+
+class PartialBody(object):
+    """
+    Body file being written, abandoned when it would go past max_size bytes
+    """
+
+    def __init__(self, file_object, path, max_size):
+        self.path = path
+        self.size = 0
+        self.abandoned = False
+        self.finished = False
+        self._file = file_object
+        self._max_size = max_size
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        """
+        Append data to the body
+        """
+        if self.abandoned:
+            return
+        self.size += len(data)
+        if self.size > self._max_size:
+            self.discard()
+            return
+        try:
+            self._file.write(data)
+        except (IOError, OSError):
+            self.discard()
+
+    def finish(self):
+        """
+        Close the file, the body is complete
+        """
+        self.finished = True
+        self._file.close()
+
+    def discard(self):
+        """
+        Abandon the body and delete its file
+        """
+        self.abandoned = True
+        try:
+            self._file.close()
+            _unlink(self.path)
+        except (IOError, OSError):
+            pass
+
+
+class TeeBody(object):
+    """
+    Streamed response body written to a PartialBody as it is relayed, on_complete(partial) being called once it has
+    been relayed to the end
+    """
+
+    def __init__(self, content, partial, on_complete):
+        self._content = content
+        self._partial = partial
+        self._on_complete = on_complete
+
+    def __iter__(self):
+        complete = False
+        try:
+            for chunk in self._content:
+                self._partial.write(chunk)
+                yield chunk
+            complete = not self._partial.abandoned
+        finally:
+            if complete:
+                try:
+                    self._partial.finish()
+                    self._on_complete(self._partial)
+                except (IOError, OSError):
+                    # The body has been relayed whole, not storing it must not fail the response
+                    self._partial.discard()
+            elif not self._partial.abandoned:
+                self._partial.discard()
+
+    def close(self):
+        """
+        Called by the WSGI server once the response is done
+        """
+        if hasattr(self._content, 'close'):
+            self._content.close()
+        if not self._partial.abandoned and not self._partial.finished:
+            self._partial.discard()
+
+
+def _unlink_leftover(path, now):
+    """
+    Delete a file that is not indexed, if it has been left alone for long enough
+    """
+    try:
+        if os.path.getmtime(path) < now - _LEFTOVER_AGE:
+            _unlink(path)
+    except OSError:
+        pass
+
+
+def _unlink(path):
+    """
+    Delete a file, if it is still there
+    """
+    try:
+        os.unlink(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
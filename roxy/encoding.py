@@ -0,0 +1,137 @@
+"""
+Content codings of proxied responses: relaying compressed bodies as they are, and compressing on the fly
+"""
+import copy
+import zlib
+
+# Content codings roxy knows how to decode
+DECODABLE = frozenset(['gzip', 'deflate'])
+
+# Media types worth compressing, besides text/*
+COMPRESSIBLE_TYPES = frozenset([
+    'application/json', 'application/javascript', 'application/x-javascript', 'application/xml',
+    'application/xhtml+xml', 'application/rss+xml', 'application/atom+xml', 'image/svg+xml',
+])
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Content codings among DECODABLE that a client accepts, given its Accept-Encoding header
+    """
+    if not accept_encoding:
+        return frozenset()
+    accepted, refused = set(), set()
+    for item in accept_encoding.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else refused).add(coding)
+    if '*' in accepted:
+        accepted |= DECODABLE - refused
+    return frozenset(accepted & DECODABLE)
+
+
+def add_vary(response, name):
+    """
+    Add name to the headers the httplib2 response varies on
+    """
+    vary = [value.strip() for value in response.get('vary', '').split(',') if value.strip()]
+    if name.lower() not in [value.lower() for value in vary] and '*' not in vary:
+        response['vary'] = ', '.join(vary + [name])
+
+
+class Compressor(object):
+    """
+    Gzip responses of the origin that are not compressed yet, when the client accepts it.
+
+    Only bodies of at least min_size bytes, when their size is known, of compressible media types, in successful
+    responses that do not forbid it with Cache-Control: no-transform, are compressed. Their ETag becomes weak, as
+    the compressed body is not the same bytes as the body of the origin, and byte ranges of them are not offered.
+    """
+
+    def __init__(self, level=6, min_size=1024, types=COMPRESSIBLE_TYPES):
+        self.level = level
+        self.min_size = min_size
+        self.types = frozenset(types)
+
+    def compress(self, method, request_headers, response, content):
+        """
+        (httplib2 response, content) to send to the client, compressed if it should be
+        """
+        if not self._compressible(method, request_headers, response, content):
+            return response, content
+        response = copy.copy(response)
+        add_vary(response, 'Accept-Encoding')
+        if isinstance(content, basestring):
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compressed = compressor.compress(content) + compressor.flush()
+            if len(compressed) >= len(content):
+                return response, content
+            _mark_gzipped(response)
+            response['content-length'] = str(len(compressed))
+            return response, compressed
+        _mark_gzipped(response)
+        if 'content-length' in response:
+            del response['content-length']
+        return response, GzipBody(content, self.level)
+
+    def _compressible(self, method, request_headers, response, content):
+        """
+        Whether a response should be compressed
+        """
+        if method == 'HEAD' or not 200 <= response.status < 300 or response.status in (204, 206):
+            return False
+        if 'content-encoding' in response or 'gzip' not in accepted_encodings(request_headers.get('Accept-Encoding')):
+            return False
+        if 'no-transform' in response.get('cache-control', '').lower():
+            return False
+        media_type = response.get('content-type', '').split(';')[0].strip().lower()
+        if not (media_type.startswith('text/') or media_type in self.types):
+            return False
+        size = len(content) if isinstance(content, basestring) else response.get('content-length')
+        return size is None or int(size) >= self.min_size
+
+
+def _mark_gzipped(response):
+    """
+    Headers of a response whose body the proxy gzips
+    """
+    response['content-encoding'] = 'gzip'
+    etag = response.get('etag')
+    if etag is not None and not etag.startswith('W/'):
+        response['etag'] = 'W/' + etag
+    if 'accept-ranges' in response:
+        del response['accept-ranges']
+
+
+class GzipBody(object):
+    """
+    Streamed response body compressed chunk by chunk, each flushed so that the client gets it right away
+    """
+
+    def __init__(self, content, level):
+        self._content = content
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def __iter__(self):
+        for chunk in self._content:
+            compressed = self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            if compressed:
+                yield compressed
+        yield self._compressor.flush()
+
+    def close(self):
+        """
+        Called by the WSGI server once the response is done
+        """
+        if hasattr(self._content, 'close'):
+            self._content.close()
@@ -0,0 +1,86 @@
+"""
+Consistent hashing of requests over origins, so that requests for the same key keep going to the same origin
+"""
+import bisect
+import math
+import struct
+from hashlib import md5
+
+
+class HashRing(object):
+    """
+    Ring of virtual_nodes points per unit of weight of each origin, a key going to the origin of the first point
+    after its hash. Adding or removing an origin only moves the keys of the arcs its points take or leave, about 1/N
+    of them.
+
+    Load is bounded: an origin with more requests in flight than load_factor times its share of all requests in
+    flight is passed over for the next one on the ring, so that a hot key does not overload its origin.
+    """
+
+    def __init__(self, origins, virtual_nodes=160, load_factor=1.25):
+        self.origins = origins
+        self.load_factor = load_factor
+        points = []
+        for origin in origins:
+            for replica in xrange(int(virtual_nodes * origin.weight)):
+                points.append((_hash('%s#%d' % (origin.server, replica)), origin))
+        points.sort(key=lambda point: point[0])
+        self._hashes = [point[0] for point in points]
+        self._origins = [point[1] for point in points]
+        self._total_weight = sum(origin.weight for origin in origins)
+
+    def choose(self, key, candidates):
+        """
+        Origin among candidates that key goes to
+        """
+        loads = dict((origin, origin.outstanding) for origin in candidates)
+        in_flight = sum(loads.itervalues()) + 1
+        start = bisect.bisect(self._hashes, _hash(key))
+        passed = set()
+        for offset in xrange(len(self._origins)):
+            origin = self._origins[(start + offset) % len(self._origins)]
+            if origin in loads and origin not in passed:
+                if loads[origin] < self._capacity(origin, in_flight):
+                    return origin
+                passed.add(origin)
+                if len(passed) == len(loads):
+                    break
+        return min(candidates, key=lambda origin: loads[origin])
+
+    def _capacity(self, origin, in_flight):
+        """
+        Requests in flight origin may have before it is passed over
+        """
+        return math.ceil(self.load_factor * in_flight * origin.weight / self._total_weight)
+
+
+def request_key(spec, default=None):
+    """
+    Function giving the key a request is hashed or counted on from spec: 'path', 'ip', 'header:<name>',
+    'cookie:<name>' or 'query:<name>'. Requests without the header, cookie or query parameter get the key
+    default(request) gives, by default their path.
+    """
+    source, _, name = spec.partition(':')
+    default = default or (lambda request: request.path)
+    if source == 'path' and not name:
+        return lambda request: request.path
+    if source == 'ip' and not name:
+        return lambda request: request.META.get('REMOTE_ADDR', '')
+    if source == 'header' and name:
+        meta_key = name.upper().replace('-', '_')
+        if meta_key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            meta_key = 'HTTP_' + meta_key
+        return lambda request: request.META.get(meta_key) or default(request)
+    if source == 'cookie' and name:
+        return lambda request: request.COOKIES.get(name) or default(request)
+    if source == 'query' and name:
+        return lambda request: request.GET.get(name) or default(request)
+    raise ValueError("Unknown key %r, use 'path', 'ip', 'header:<name>', 'cookie:<name>' or 'query:<name>'" % spec)
+
+def _hash(value):
+    """
+    Position of value on the ring
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return struct.unpack('>Q', md5(value).digest()[:8])[0]
@@ -0,0 +1,172 @@
+"""
+Translation of the headers of proxied messages, compiled once per view
+"""
+
+# Hop-by-hop headers, defined in RFC 2616 section 13.5.1, are not to be forwarded by proxies
+HOP_BY_HOP = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
+    'upgrade',
+])
+
+# Keys of httplib2 responses that are not headers of the origin response
+_RESPONSE_PSEUDO_HEADERS = frozenset(['status', 'content-location'])
+
+# Names learned by a pipeline are kept up to this many, so that clients making up header names cannot grow it forever
+_MAX_NAMES = 1000
+
+_UNKNOWN = object()
+
+
+class HeaderRules(object):
+    """
+    Changes made to the headers of the messages going one way through the proxy.
+
+    remove is a list of headers not to forward, rename maps the name of headers to the name they are forwarded
+    under, add maps the name of headers to the value they get when the message does not have them, and override
+    maps the name of headers to the value they always get. Names are case insensitive.
+    """
+
+    def __init__(self, remove=(), rename=None, add=None, override=None):
+        self.remove = frozenset(name.lower() for name in remove)
+        self.rename = dict((name.lower(), new_name) for name, new_name in (rename or {}).items())
+        self.add = list((add or {}).items())
+        self.override = list((override or {}).items())
+
+    @classmethod
+    def from_option(cls, rules):
+        """
+        Rules given to proxy() as a HeaderRules, a dict of its arguments or None
+        """
+        if rules is None:
+            return cls()
+        if isinstance(rules, cls):
+            return rules
+        return cls(**rules)
+
+
+class _Pipeline(object):
+    """
+    Header translation common to both directions: memoized names, then the rules applied in a single pass
+    """
+
+    def __init__(self, rules, dropped):
+        self._rules = rules
+        # Overridden headers are dropped on the way, to be set once at the end
+        self._dropped = dropped | rules.remove | frozenset(name.lower() for name, _ in rules.override)
+        self._added = frozenset(name.lower() for name, _ in rules.add)
+        self._names = {}
+
+    def _learn(self, key):
+        """
+        Name key is forwarded under, None when it is not forwarded, remembered for the next messages
+        """
+        name = self._header_name(key)
+        if name is not None:
+            lower_name = name.lower()
+            if lower_name in self._dropped:
+                name = None
+            else:
+                name = self._rules.rename.get(lower_name, name)
+        if len(self._names) < _MAX_NAMES:
+            self._names[key] = name
+        return name
+
+    def _header_name(self, key):
+        """
+        Name of the header stored under key in the incoming message, None when key is not a header
+        """
+        raise NotImplementedError
+
+    def _finish(self, headers):
+        """
+        Apply the add and override rules to the translated headers
+        """
+        if self._added:
+            present = frozenset(name.lower() for name in headers)
+            for name, value in self._rules.add:
+                if name.lower() not in present:
+                    headers[name] = value
+        for name, value in self._rules.override:
+            headers[name] = value
+        return headers
+
+
+class RequestHeaders(_Pipeline):
+    """
+    Headers forwarded to the origin, from the META of the Django request
+    """
+
+    def __init__(self, rules=None):
+        _Pipeline.__init__(self, HeaderRules.from_option(rules), HOP_BY_HOP)
+
+    def translate(self, meta):
+        """
+        Headers of the request to send to the origin
+        """
+        names = self._names
+        headers = {}
+        for key, value in meta.iteritems():
+            name = names.get(key, _UNKNOWN)
+            if name is _UNKNOWN:
+                name = self._learn(key)
+            # Not forward empty content-length (esp in get), this causes weird response
+            if name is None or (value == '' and key == 'CONTENT_LENGTH'):
+                continue
+            headers[name] = value
+        return self._finish(headers)
+
+    def _header_name(self, key):
+        if key.startswith('HTTP_'):
+            key = key[5:]
+        elif key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            return None
+        return key.replace('_', '-').title()
+
+
+class ResponseHeaders(_Pipeline):
+    """
+    Headers relayed to the client, from the httplib2 response of the origin
+    """
+
+    def __init__(self, rules=None):
+        _Pipeline.__init__(self, HeaderRules.from_option(rules), HOP_BY_HOP | _RESPONSE_PSEUDO_HEADERS)
+
+    def translate(self, httplib2_response):
+        """
+        Headers of the response to send to the client
+        """
+        names = self._names
+        headers = {}
+        for key, value in httplib2_response.iteritems():
+            name = names.get(key, _UNKNOWN)
+            if name is _UNKNOWN:
+                name = self._learn(key)
+            if name is not None:
+                headers[name] = value
+        return self._finish(headers)
+
+    def _header_name(self, key):
+        return key
+
+
+_response_headers = ResponseHeaders()
+
+def update_response_headers(response, headers, pipeline=None):
+    """
+    update response header with given headers
+
+    ignore hop headers to avoid django hop-by-hop assertion error as
+    hop-by-hop should not be forwarded by proxy
+    """
+    for key, value in (pipeline or _response_headers).translate(headers).iteritems():
+        response[key] = value
+
+def update_messages_cookie(request, headers, httplib2_response, response):
+    """
+    If the request has messages cookie, and now the response from the backend says that it should be deleted,
+    we should delete the cookie
+    """
+    if request.method == 'GET' and headers.get('Cookie') and headers['Cookie'].find('messages='):
+        response_set_cookie = httplib2_response.get('set-cookie','')
+        if (response_set_cookie.find('messages=') == -1) or (response_set_cookie.find('messages=;') != -1):
+            response.delete_cookie('messages')
@@ -0,0 +1,125 @@
+"""
+Passive health checking of origins
+"""
+import threading
+import time
+from collections import deque
+
+from roxy import OriginUnavailable
+from roxy.signals import circuit_state_changed
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(OriginUnavailable):
+    """
+    Raised instead of sending a request when the circuit breakers of all the origins are open
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker tracking the health of one origin from the outcome of the requests sent to it.
+
+    After threshold consecutive failures the circuit opens and no request is sent to the origin for reset_timeout
+    seconds. A single probe request is then let through, half open: its success closes the circuit again and its
+    failure opens it for another reset_timeout seconds. Every change of state sends the circuit_state_changed signal.
+    """
+
+    def __init__(self, name, threshold=5, reset_timeout=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._transitions = deque(maxlen=10)
+        # Reentrant, as receivers of circuit_state_changed may look at the breaker
+        self._lock = threading.RLock()
+
+    def available(self):
+        """
+        Whether a request could be sent to the origin now
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return self._retry_after() <= 0
+            return not (self.state == HALF_OPEN and self._probing)
+
+    def acquire(self):
+        """
+        Reserve the right to send a request to the origin, return False when that is not possible now
+        """
+        with self._lock:
+            if self.state == OPEN and self._retry_after() <= 0:
+                self._change(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                return False
+            if self.state == HALF_OPEN:
+                self._probing = True
+            return True
+
+    def cancel(self):
+        """
+        Give back what acquire() reserved, for a request that was not sent after all
+        """
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        """
+        The origin answered a request properly
+        """
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._change(CLOSED)
+
+    def failure(self):
+        """
+        The origin failed a request
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.threshold):
+                self._opened_at = time.time()
+                self._change(OPEN)
+
+    def retry_after(self):
+        """
+        Seconds until the origin gets a request again
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return max(self._retry_after(), 0)
+            return 0
+
+    def stats(self):
+        """
+        Snapshot of the breaker state and of its last transitions
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'transitions': list(self._transitions),
+            }
+
+    def _retry_after(self):
+        """
+        Seconds left before an open circuit lets a probe through, must be called with the lock held
+        """
+        return self._opened_at + self.reset_timeout - time.time()
+
+    def _change(self, state):
+        """
+        Move to state, must be called with the lock held
+        """
+        old_state, self.state = self.state, state
+        self._transitions.append((time.time(), old_state, state))
+        circuit_state_changed.send(sender=self.__class__, breaker=self, old_state=old_state, new_state=state)
@@ -0,0 +1,582 @@
+"""
+HTTP/2 upstream connections, many proxied requests multiplexed over a few connections per origin
+"""
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from functools import partial
+from StringIO import StringIO
+from urlparse import urlsplit
+
+import httplib2
+from django.core.exceptions import ImproperlyConfigured
+from httplib2 import HttpLib2Error
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+    import h2.settings
+except ImportError:
+    h2 = None
+
+from roxy.streaming import body_decoder
+from roxy.timing import lap
+from roxy.transport import Transport
+
+# Connection specific headers, which HTTP/2 forbids (RFC 7540 section 8.1.2.2). The Host header becomes :authority.
+_CONNECTION_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade',
+                                 'host'])
+_READ_SIZE = 64 * 1024
+# Flow control windows offered to the origin. The connection window is given back as data arrives, so that it is
+# never held by a response nobody reads, while the window of a stream is given back as its body is read.
+_CONNECTION_WINDOW = 16 * 1024 * 1024
+_STREAM_WINDOW = 256 * 1024
+
+
+class Http2Error(HttpLib2Error):
+    """
+    Raised when an HTTP/2 connection to the origin fails or goes away before a request is answered
+    """
+
+
+class StreamReset(Http2Error):
+    """
+    Raised when the origin resets the stream of a request, with the HTTP/2 error code it gave
+    """
+
+    def __init__(self, error_code):
+        Http2Error.__init__(self, 'Stream reset by the origin, error code %s' % error_code)
+        self.error_code = error_code
+
+
+class Http2Transport(Transport):
+    """
+    HTTP/2 connections to the origins of a proxied view, up to max_connections per origin, each carrying up to
+    max_streams requests at the same time, or fewer if the origin says so.
+
+    Origins are reached over TLS, agreeing on HTTP/2 with ALPN, for https, and with prior knowledge for http. Of
+    http_kwargs, the arguments of ``httplib2.Http``, timeout, ca_certs and disable_ssl_certificate_validation are
+    used. Needs the h2 package.
+    """
+
+    def __init__(self, max_connections=2, max_streams=100, http_kwargs=None):
+        if h2 is None:
+            raise ImproperlyConfigured(
+                'HTTP/2 upstream connections need the h2 package: pip install django-roxy[http2]')
+        http_kwargs = http_kwargs or {}
+        self.max_connections = max_connections
+        self.max_streams = max_streams
+        self.timeout = http_kwargs.get('timeout')
+        self._ca_certs = http_kwargs.get('ca_certs')
+        self._verify = not http_kwargs.get('disable_ssl_certificate_validation', False)
+        self._ssl_context = None
+        self._connections = {}
+        self._opening = {}
+        self._in_use = 0
+        self._counters = dict.fromkeys(('created', 'streams', 'waits', 'resets'), 0)
+        self._condition = threading.Condition()
+
+    def send(self, uri, method, body, headers, chunk_size=None, keep_encodings=None):    # pylint: disable=R0913
+        """
+        Send a request on a stream of a connection to the origin, see ``Transport.send()``. A streamed body is
+        relayed in the chunks it arrives in whatever chunk_size.
+        """
+        scheme, authority, request_uri, _ = httplib2.urlnorm(httplib2.iri2uri(uri))
+        connection = self._acquire(scheme, authority)
+        h2_stream = connection.request(method, scheme, authority, request_uri, headers, body,
+                                       partial(self._release, connection))
+        response = _response(h2_stream.response_headers())
+        lap('ttfb')
+        decoder = body_decoder(response, method, keep_encodings)
+        content = Http2Body(h2_stream, decoder)
+        if chunk_size is None:
+            content = ''.join(content)
+            lap('body')
+            if decoder is not None:
+                response['content-length'] = str(len(content))
+        return response, content
+
+    def stats(self):
+        """
+        Snapshot of the transport counters, in_use being the requests in flight
+        """
+        with self._condition:
+            return dict(self._counters, in_use=self._in_use, max_connections=self.max_connections,
+                        connections=sum(len(connections) for connections in self._connections.values()))
+
+    def close(self):
+        """
+        Close every connection, requests in flight on them fail
+        """
+        with self._condition:
+            connections = [connection for group in self._connections.values() for connection in group]
+        for connection in connections:
+            connection.close()
+
+    def _acquire(self, scheme, authority):
+        """
+        Connection to authority with a stream to spare, opened if there is none and there may be more
+        """
+        key = (scheme, authority)
+        with self._condition:
+            while True:
+                connections = self._connections.setdefault(key, [])
+                connections[:] = [connection for connection in connections if connection.usable()]
+                available = [connection for connection in connections if connection.active < self._max_streams(
+                    connection)]
+                if available:
+                    connection = min(available, key=lambda connection: connection.active)
+                    self._take(connection)
+                    lap('wait')
+                    return connection
+                if len(connections) + self._opening.get(key, 0) < self.max_connections:
+                    self._opening[key] = self._opening.get(key, 0) + 1
+                    break
+                self._counters['waits'] += 1
+                self._condition.wait()
+        connection = None
+        try:
+            lap('wait')
+            connection = _Connection(scheme, authority, self.timeout, self._context(scheme), self._closed)
+            lap('connect')
+        finally:
+            with self._condition:
+                self._opening[key] -= 1
+                if connection is not None:
+                    self._connections[key].append(connection)
+                    self._counters['created'] += 1
+                    self._take(connection)
+                self._condition.notify_all()
+        return connection
+
+    def _take(self, connection):
+        """
+        Account for a new stream on connection, must be called with the condition held
+        """
+        connection.active += 1
+        self._in_use += 1
+        self._counters['streams'] += 1
+
+    def _release(self, connection, reset=False):
+        """
+        Account for a stream of connection that is done
+        """
+        with self._condition:
+            connection.active -= 1
+            self._in_use -= 1
+            if reset:
+                self._counters['resets'] += 1
+            self._condition.notify_all()
+        if not connection.active and connection.going_away:
+            connection.close()
+
+    def _closed(self):
+        """
+        Let requests waiting for a stream know that a connection has gone
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+    def _max_streams(self, connection):
+        """
+        Streams connection may carry at the same time
+        """
+        return min(self.max_streams, connection.max_concurrent_streams())
+
+    def _context(self, scheme):
+        """
+        TLS context of the connections to origins reached with scheme, None for http
+        """
+        if scheme != 'https':
+            return None
+        if self._ssl_context is None:
+            context = ssl.create_default_context(cafile=self._ca_certs)
+            if not self._verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            context.set_alpn_protocols(['h2'])
+            self._ssl_context = context
+        return self._ssl_context
+
+
+class _Connection(object):
+    """
+    HTTP/2 connection to an origin, its frames read by a thread of its own and dispatched to its streams
+    """
+
+    def __init__(self, scheme, authority, timeout, ssl_context, on_closed):    # pylint: disable=R0913
+        url = urlsplit('//' + authority)
+        host, port = url.hostname, url.port or (443 if scheme == 'https' else 80)
+        sock = socket.create_connection((host, port), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if ssl_context is not None:
+            sock = ssl_context.wrap_socket(sock, server_hostname=host)
+            if sock.selected_alpn_protocol() != 'h2':
+                sock.close()
+                raise Http2Error('%s does not speak HTTP/2' % authority)
+        sock.settimeout(None)
+        self.timeout = timeout
+        self.active = 0
+        self.closed = False
+        self.going_away = False
+        self._sock = sock
+        self._on_closed = on_closed
+        self._streams = {}
+        # The lock guards the state of the connection, the write lock keeps the frames in order on the socket
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._h2 = h2.connection.H2Connection(config=h2.config.H2Configuration(
+            client_side=True, header_encoding=None, normalize_outbound_headers=False))
+        self._send(self._initiate)
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+
+    def usable(self):
+        """
+        Whether new streams may be opened on the connection
+        """
+        return not self.closed and not self.going_away
+
+    def max_concurrent_streams(self):
+        """
+        Streams the origin lets the connection carry at the same time
+        """
+        return self._h2.remote_settings.max_concurrent_streams
+
+    def request(self, method, scheme, authority, path, headers, body, on_done):    # pylint: disable=R0913
+        """
+        Open a stream sending the request, on_done(reset) is called once the stream is done with
+        """
+        fields = [(':method', method), (':scheme', scheme), (':authority', authority), (':path', path)]
+        fields.extend(_h2_headers(headers))
+
+        def open_stream():
+            """
+            Send the headers on a new stream
+            """
+            if self.closed:
+                raise Http2Error('Connection to the origin lost')
+            stream_id = self._h2.get_next_available_stream_id()
+            self._h2.send_headers(stream_id, fields, end_stream=not body)
+            stream = self._streams[stream_id] = _Stream(self, stream_id, on_done)
+            return stream
+        try:
+            stream = self._send(open_stream)
+        except Exception:
+            on_done()
+            raise
+        if body:
+            try:
+                self._send_body(stream, body)
+            except Exception:
+                stream.close()
+                raise
+        return stream
+
+    def close(self):
+        """
+        Close the connection, its streams fail
+        """
+        self._close(Http2Error('Connection to the origin closed'))
+
+    def _send_body(self, stream, body):
+        """
+        Send the request body as the flow control windows of the stream and the connection allow
+        """
+        source = body if hasattr(body, 'read') else StringIO(body)
+        pending = ''
+        while True:
+            if not pending:
+                pending = source.read(_READ_SIZE)
+                if not pending:
+                    break
+            try:
+                sent = self._send(partial(self._send_data, stream, pending))
+            except h2.exceptions.StreamClosedError:
+                # The origin answered without waiting for the whole body
+                return
+            pending = pending[sent:]
+        try:
+            self._send(partial(self._h2.end_stream, stream.stream_id))
+        except h2.exceptions.StreamClosedError:
+            pass
+
+    def _send_data(self, stream, data):
+        """
+        Send as much of data as the flow control windows allow, waiting for them to open, return the size sent.
+        Must be called with the lock held.
+        """
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            stream.raise_error()
+            window = min(self._h2.local_flow_control_window(stream.stream_id), self._h2.max_outbound_frame_size)
+            if window > 0:
+                self._h2.send_data(stream.stream_id, data[:window])
+                return min(window, len(data))
+            _wait(self._changed, deadline)
+
+    def _send(self, operation):
+        """
+        Run operation on the HTTP/2 state, then write the frames it produced, return what it returned
+        """
+        with self._lock:
+            result = operation()
+            data = self._h2.data_to_send()
+            self._write_lock.acquire()
+        try:
+            if data:
+                self._sock.sendall(data)
+        except socket.error as error:
+            self._close(Http2Error('Connection to the origin lost: %s' % error))
+            raise
+        finally:
+            self._write_lock.release()
+        return result
+
+    def _initiate(self):
+        """
+        Send the preamble and settings of the connection, with larger flow control windows than the defaults
+        """
+        self._h2.initiate_connection()
+        self._h2.update_settings({h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: _STREAM_WINDOW})
+        self._h2.increment_flow_control_window(_CONNECTION_WINDOW - self._h2.inbound_flow_control_window)
+
+    def _read(self):
+        """
+        Read frames and dispatch them until the connection is closed
+        """
+        error = Http2Error('Connection closed by the origin')
+        try:
+            while True:
+                data = self._sock.recv(_READ_SIZE)
+                if not data:
+                    break
+                self._send(partial(self._dispatch, data))
+        except (socket.error, h2.exceptions.ProtocolError) as reason:
+            error = Http2Error('Connection to the origin lost: %s' % reason)
+        self._close(error)
+
+    def _dispatch(self, data):
+        """
+        Hand what data brings to the streams it is for. Must be called with the lock held.
+        """
+        for event in self._h2.receive_data(data):
+            stream = self._streams.get(getattr(event, 'stream_id', None))
+            if isinstance(event, h2.events.DataReceived) and event.flow_controlled_length:
+                self._h2.increment_flow_control_window(event.flow_controlled_length)
+            if isinstance(event, h2.events.ResponseReceived) and stream is not None:
+                stream.headers = event.headers
+            elif isinstance(event, h2.events.DataReceived) and stream is not None:
+                stream.chunks.append((event.data, event.flow_controlled_length))
+            elif isinstance(event, h2.events.StreamEnded) and stream is not None:
+                stream.ended = True
+                del self._streams[event.stream_id]
+            elif isinstance(event, h2.events.StreamReset) and stream is not None:
+                stream.error = StreamReset(event.error_code)
+                del self._streams[event.stream_id]
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.going_away = True
+                # Requests the origin has not seen can be sent again on another connection
+                for stream_id in [stream_id for stream_id in self._streams if stream_id > event.last_stream_id]:
+                    self._streams.pop(stream_id).error = Http2Error('Request refused by the origin going away')
+        self._changed.notify_all()
+
+    def _close(self, error):
+        """
+        Close the socket, streams in flight fail with error
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            for stream in self._streams.values():
+                stream.error = error
+            self._streams.clear()
+            self._changed.notify_all()
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+        self._on_closed()
+
+
+class _Stream(object):
+    """
+    Stream of a request on a connection, filled in by its reader thread
+    """
+
+    def __init__(self, connection, stream_id, on_done):
+        self.stream_id = stream_id
+        self.headers = None
+        self.chunks = deque()
+        self.ended = False
+        self.error = None
+        self._connection = connection
+        self._on_done = on_done
+        self._done = False
+
+    def response_headers(self):
+        """
+        Header fields of the response, once they have arrived
+        """
+        def wait_headers():
+            """
+            Wait for the headers to arrive
+            """
+            deadline = None if self._connection.timeout is None else time.time() + self._connection.timeout
+            while self.headers is None:
+                self.raise_error()
+                _wait(self._connection._changed, deadline)    # pylint: disable=W0212
+            return self.headers
+        try:
+            return self._connection._send(wait_headers)    # pylint: disable=W0212
+        except Exception:
+            self.close()
+            raise
+
+    def read(self):
+        """
+        Next chunk of the response body as it arrives, '' at its end
+        """
+        def next_chunk():
+            """
+            Wait for a chunk, and give its room in the flow control window of the stream back to the origin
+            """
+            deadline = None if self._connection.timeout is None else time.time() + self._connection.timeout
+            while not self.chunks:
+                if self.ended:
+                    return ''
+                self.raise_error()
+                _wait(self._connection._changed, deadline)    # pylint: disable=W0212
+            data, length = self.chunks.popleft()
+            if length and not self.ended:
+                try:
+                    self._connection._h2.increment_flow_control_window(    # pylint: disable=W0212
+                        length, stream_id=self.stream_id)
+                except h2.exceptions.StreamClosedError:
+                    pass
+            return data
+        try:
+            data = self._connection._send(next_chunk)    # pylint: disable=W0212
+        except Exception:
+            self.close()
+            raise
+        if not data:
+            self._finish(reset=False)
+        return data
+
+    def raise_error(self):
+        """
+        Raise the error the stream failed with, if any. Must be called with the lock of the connection held.
+        """
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Cancel the stream if it is still going, a response that is not read to its end does not hold the connection
+        """
+        if self._done:
+            return
+        connection = self._connection
+
+        def cancel():
+            """
+            Reset the stream, unless the origin is done with it
+            """
+            if connection._streams.pop(self.stream_id, None) is not None:    # pylint: disable=W0212
+                connection._h2.reset_stream(self.stream_id, h2.errors.ErrorCodes.CANCEL)    # pylint: disable=W0212
+        try:
+            connection._send(cancel)    # pylint: disable=W0212
+        except (socket.error, Http2Error, h2.exceptions.ProtocolError):
+            pass
+        self._finish(reset=isinstance(self.error, StreamReset))
+
+    def _finish(self, reset):
+        """
+        Let the pool know the stream is done with, only once
+        """
+        if not self._done:
+            self._done = True
+            self._on_done(reset)
+
+
+class Http2Body(object):
+    """
+    Iterator over the body of a response on an HTTP/2 stream, decompressed by decoder if given
+    """
+
+    def __init__(self, stream, decoder=None):
+        self._stream = stream
+        self._decoder = decoder
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._stream.read()
+                if not chunk:
+                    break
+                if self._decoder:
+                    chunk = self._decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if self._decoder:
+                chunk = self._decoder.flush()
+                if chunk:
+                    yield chunk
+        finally:
+            self._stream.close()
+
+    def close(self):
+        """
+        Called by the WSGI server once the response is done
+        """
+        self._stream.close()
+
+
+def _h2_headers(headers):
+    """
+    Request headers as HTTP/2 header fields. Names are lower cased, as HTTP/2 requires, values are sent as they are,
+    the way ``roxy.Http`` sends them, and connection specific headers are left out.
+    """
+    fields = []
+    for name, value in headers.items():
+        name = name.lower()
+        if name in _CONNECTION_HEADERS or (name == 'te' and value.strip().lower() != 'trailers'):
+            continue
+        if isinstance(value, unicode):
+            value = value.encode('latin-1')
+        # Whitespace around a value is not part of it in HTTP/1.1 either
+        fields.append((str(name), str(value).strip()))
+    return fields
+
+def _response(fields):
+    """
+    httplib2 response of the header fields of an HTTP/2 response, repeated fields joined as httplib2 does
+    """
+    info = {}
+    for name, value in fields:
+        if name == ':status':
+            info['status'] = value
+        elif not name.startswith(':'):
+            info[name] = '%s, %s' % (info[name], value) if name in info else value
+    return httplib2.Response(info)
+
+def _wait(condition, deadline):
+    """
+    Wait for condition to be notified, raise socket.timeout past deadline, a time.time() or None for no limit
+    """
+    if deadline is None:
+        condition.wait()
+        return
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise socket.timeout('Timed out waiting for the origin')
+    condition.wait(remaining)
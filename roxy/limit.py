@@ -0,0 +1,134 @@
+"""
+Cap the requests in flight to an origin and shed the load past it
+"""
+import threading
+import time
+
+from roxy import OriginUnavailable
+
+
+class OriginOverloaded(OriginUnavailable):
+    """
+    Raised instead of sending a request to an origin that has too many requests in flight already
+    """
+
+
+class ConcurrencyLimiter(object):
+    """
+    Let at most max_in_flight requests be sent to an origin at the same time.
+
+    Up to max_queue more requests wait, first come first served, for up to queue_timeout seconds for one of them to
+    finish. Requests past that are rejected right away with OriginOverloaded, and so are those that time out.
+    """
+
+    def __init__(self, max_in_flight, max_queue=0, queue_timeout=1):
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queue = []
+        self._condition = threading.Condition()
+        self._counters = dict.fromkeys(('admitted', 'queued', 'rejected', 'timeouts'), 0)
+
+    def acquire(self):
+        """
+        Wait for a slot to send a request to the origin, raise OriginOverloaded when none is available in time
+        """
+        with self._condition:
+            if self._in_flight < self.max_in_flight and not self._queue:
+                return self._admit()
+            if len(self._queue) >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise OriginOverloaded('Too many requests in flight to the origin', retry_after=self._retry_after())
+            ticket = object()
+            self._queue.append(ticket)
+            self._counters['queued'] += 1
+            deadline = time.time() + self.queue_timeout
+            try:
+                while self._queue[0] is not ticket or self._in_flight >= self.max_in_flight:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise OriginOverloaded('Timed out waiting for a request to the origin to finish',
+                                               retry_after=self._retry_after())
+                    self._condition.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                # The next in line may be able to go now
+                self._condition.notify_all()
+            return self._admit()
+
+    def release(self):
+        """
+        Give back the slot of a request that is done with the origin
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def limit(self, content):
+        """
+        Content of a response, with its slot released once it has been read, at once unless it is streamed
+        """
+        if isinstance(content, basestring):
+            self.release()
+            return content
+        return LimitedBody(content, self)
+
+    def stats(self):
+        """
+        Snapshot of the requests in flight and waiting, and of the load shedding counters
+        """
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update(in_flight=self._in_flight, queue_depth=len(self._queue), max_in_flight=self.max_in_flight)
+        return stats
+
+    def _admit(self):
+        """
+        Take a slot, must be called with the lock held
+        """
+        self._in_flight += 1
+        self._counters['admitted'] += 1
+
+    def _retry_after(self):
+        """
+        Seconds a rejected client is told to wait before trying again
+        """
+        return max(self.queue_timeout, 1)
+
+
+class LimitedBody(object):
+    """
+    Streamed response body holding a slot of the limiter until it has been read or closed
+    """
+
+    def __init__(self, content, limiter):
+        self._content = content
+        self._limiter = limiter
+        self._released = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._content:
+                yield chunk
+        finally:
+            self._release()
+
+    def close(self):
+        """
+        Called by the WSGI server once the response is done
+        """
+        if hasattr(self._content, 'close'):
+            self._content.close()
+        self._release()
+
+    def _release(self):
+        """
+        Give the slot back, once
+        """
+        if not self._released:
+            self._released = True
+            self._limiter.release()
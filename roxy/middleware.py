@@ -0,0 +1,65 @@
+"""
+Middleware proxying requests to the origins of the ROXY_ROUTES setting
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from roxy.router import Router
+
+
+class RoxyRouterMiddleware(object):
+    """
+    Proxy the requests matching a route of the ROXY_ROUTES setting, see ``Router``, before URL resolution.
+
+    ROXY_ROUTES is the route table, or a callable returning it. The table is built again when the setting is replaced
+    by another table, and a callable is called again every ROXY_ROUTES_RELOAD_INTERVAL seconds, default 60, so routes
+    can change without restarting workers. Requests that match no route go on to the URL configuration.
+    """
+
+    def __init__(self):
+        if getattr(settings, 'ROXY_ROUTES', None) is None:
+            raise MiddlewareNotUsed('ROXY_ROUTES is not set')
+        self.router = None
+        self._source = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def process_request(self, request):
+        """
+        Response of the origin routed to, None when no route matches
+        """
+        view = self.current_router().resolve(request.get_host(), request.path_info)
+        if view is None:
+            return None
+        return view(request)
+
+    def current_router(self):
+        """
+        Router of the current route table, built again when it has changed
+        """
+        source = getattr(settings, 'ROXY_ROUTES', None)
+        if source is not self._source or (callable(source) and self._reload_due()):
+            with self._lock:
+                if source is not self._source or (callable(source) and self._reload_due()):
+                    self.reload(source)
+        return self.router
+
+    def reload(self, source=None):
+        """
+        Build the router again from source, the ROXY_ROUTES setting by default
+        """
+        if source is None:
+            source = getattr(settings, 'ROXY_ROUTES', None) or {}
+        routes = source() if callable(source) else source
+        self.router = Router(routes, previous=self.router)
+        self._source = source
+        self._loaded_at = time.time()
+
+    def _reload_due(self):
+        """
+        Whether a callable route table should be called again
+        """
+        return time.time() - self._loaded_at >= getattr(settings, 'ROXY_ROUTES_RELOAD_INTERVAL', 60)
@@ -0,0 +1,116 @@
+"""
+Mirroring of proxied requests to a shadow origin
+"""
+import random
+import threading
+from Queue import Empty, Full, Queue
+
+from roxy.balancer import Origin
+from roxy.transport import Httplib2Transport
+
+
+class Mirror(object):
+    """
+    Send copies of a sample of the proxied requests to a shadow origin, discarding its responses.
+
+    A fraction sample of the requests, from 0 to 1, is copied to a queue of up to queue_size requests, sent to the
+    shadow origin by as many threads as workers through transport, a ``Transport``, by default with a keep-alive
+    connection each. Copies are dropped when the queue is full, so the shadow origin never slows the requests being
+    proxied down, and so are requests whose body is being read from the client while it is sent to the origin, as
+    it cannot be read twice.
+    """
+
+    def __init__(self, server, sample=1.0, workers=2, queue_size=100, transport=None):    # pylint: disable=R0913
+        self.origin = Origin(server, pool=transport or Httplib2Transport(workers))
+        self.sample = sample
+        self.workers = workers
+        self._queue = Queue(queue_size)
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('mirrored', 'dropped', 'unbuffered', 'responses', 'errors'), 0)
+        self._statuses = {}
+
+    def copy(self, method, scheme, full_path, body, headers):    # pylint: disable=R0913
+        """
+        Queue a copy of a request for the shadow origin, if it is in the sample. Never blocks.
+        """
+        if self._closed or self.sample < 1 and random.random() >= self.sample:
+            return
+        if hasattr(body, 'read'):
+            self._count('unbuffered')
+            return
+        self._start()
+        headers = dict(headers)
+        if 'Host' in headers:
+            headers['Host'] = self.origin.host
+        try:
+            self._queue.put_nowait((method, self.origin.target_url(scheme, full_path), body, headers))
+        except Full:
+            self._count('dropped')
+        else:
+            self._count('mirrored')
+
+    def stats(self):
+        """
+        Snapshot of the mirroring counters, with the responses of the shadow origin by status
+        """
+        with self._lock:
+            stats = dict(self._counters, statuses=dict(self._statuses))
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def close(self):
+        """
+        Stop the workers, dropping the copies still queued, and close the connections to the shadow origin
+        """
+        with self._lock:
+            self._closed = True
+            threads, self._threads = self._threads, []
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        for _ in threads:
+            # Each worker stops at the first None it gets
+            self._queue.put(None)
+        self.origin.pool.close()
+
+    def _start(self):
+        """
+        Start the workers, the first time there is a copy to send
+        """
+        if len(self._threads) < self.workers:
+            with self._lock:
+                while len(self._threads) < self.workers and not self._closed:
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self):
+        """
+        Send copies as they come
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            method, target_url, body, headers = item
+            try:
+                response, _ = self.origin.pool.send(target_url, method, body, headers)
+            except Exception:    # pylint: disable=W0703
+                # Whatever the shadow origin or the transport does, the worker goes on with the next copy
+                self._count('errors')
+                continue
+            with self._lock:
+                self._counters['responses'] += 1
+                self._statuses[response.status] = self._statuses.get(response.status, 0) + 1
+
+    def _count(self, name):
+        """
+        Increment a counter
+        """
+        with self._lock:
+            self._counters[name] += 1
@@ -0,0 +1,105 @@
+"""
+Negative caching of the error responses of the origin, so that requests bound to fail again do not reach it
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from roxy.cache import parse_cache_control
+
+DEFAULT_TTLS = {404: 10, 410: 60, 500: 1, 502: 1, 503: 1, 504: 1}
+
+# Larger error bodies are not kept
+_MAX_BODY_SIZE = 64 * 1024
+
+
+class NegativeCache(object):
+    """
+    Keep the 404, 410 and 5xx responses of the origin to GET and HEAD requests, and answer identical requests with
+    them for a while instead of sending them to the origin.
+
+    ttls maps the statuses kept to the seconds they are kept for. Requests are identical when they have the same
+    method, URL and values for key_headers, which should name the headers that identify a user. Up to max_entries
+    responses are kept, the least recently used dropped first. Streamed responses, those the origin says not to
+    store and those of more than 64 KiB are not kept. A request with another method that succeeds drops the
+    responses kept for its URL.
+    """
+
+    def __init__(self, ttls=None, max_entries=10000, key_headers=('Authorization', 'Cookie')):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.key_headers = tuple(key_headers)
+        # Responses of each URL by variant, the URL used the least recently first
+        self._urls = OrderedDict()
+        self._entries = 0
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('suppressed', 'misses', 'stored', 'expired', 'evictions', 'invalidations'), 0)
+
+    def fetch(self, method, url, headers, send):
+        """
+        Response for a request, the one kept for an identical request when there is one.
+
+        send(headers) sends the request to the origin and returns (httplib2 response, content).
+        """
+        if method not in ('GET', 'HEAD'):
+            response, content = send(headers)
+            if response.status < 400:
+                self.invalidate(url)
+            return response, content
+        variant = (method,) + tuple(headers.get(name) for name in self.key_headers)
+        now = time.time()
+        with self._lock:
+            variants = self._urls.pop(url, None)
+            if variants is not None:
+                self._urls[url] = variants
+                entry = variants.get(variant)
+                if entry is not None and entry[0] > now:
+                    self._counters['suppressed'] += 1
+                    return copy.copy(entry[1]), entry[2]
+                if entry is not None:
+                    del variants[variant]
+                    self._entries -= 1
+                    self._counters['expired'] += 1
+                    if not variants:
+                        del self._urls[url]
+            self._counters['misses'] += 1
+        response, content = send(headers)
+        ttl = self.ttls.get(response.status)
+        if ttl and isinstance(content, basestring) and len(content) <= _MAX_BODY_SIZE and \
+                'no-store' not in parse_cache_control(response.get('cache-control')):
+            self._store(url, variant, (now + ttl, copy.copy(response), content))
+        return response, content
+
+    def invalidate(self, url):
+        """
+        Drop the responses kept for url
+        """
+        with self._lock:
+            variants = self._urls.pop(url, None)
+            if variants:
+                self._entries -= len(variants)
+                self._counters['invalidations'] += 1
+
+    def stats(self):
+        """
+        Snapshot of the negative caching counters, suppressed being the requests answered without the origin
+        """
+        with self._lock:
+            return dict(self._counters, entries=self._entries)
+
+    def _store(self, url, variant, entry):
+        """
+        Keep entry, dropping the least recently used ones past max_entries
+        """
+        with self._lock:
+            variants = self._urls.pop(url, None) or {}
+            self._urls[url] = variants
+            if variant not in variants:
+                self._entries += 1
+            variants[variant] = entry
+            self._counters['stored'] += 1
+            while self._entries > self.max_entries:
+                evicted = len(self._urls.pop(next(iter(self._urls))))
+                self._entries -= evicted
+                self._counters['evictions'] += evicted
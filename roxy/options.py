@@ -0,0 +1,203 @@
+"""
+Options of proxy(), and the components of a proxied view they configure
+"""
+from django.conf import settings
+
+from roxy.balancer import Balancer, Origin, parse_origins
+from roxy.cache import ResponseCache, django_cache
+from roxy.coalesce import Coalescer
+from roxy.disk import DiskStore
+from roxy.encoding import Compressor
+from roxy.health import CircuitBreaker
+from roxy.http2 import Http2Transport
+from roxy.limit import ConcurrencyLimiter
+from roxy.mirror import Mirror
+from roxy.negative import NegativeCache
+from roxy.ratelimit import RateLimiter
+from roxy.retry import Retry, RetryBudget
+from roxy.transport import HttplibTransport, Httplib2Transport
+
+
+def option(options, name, default):
+    """
+    Take a proxy() option out of options, falling back to the ROXY_<NAME> setting and then to default
+    """
+    if name in options:
+        return options.pop(name)
+    return getattr(settings, 'ROXY_%s' % name.upper(), default)
+
+def view_scope(balancer, rewriter):
+    """
+    Text telling a view apart by its origin servers and rewrite rules, keying what it keeps in stores shared with
+    other views
+    """
+    return ' '.join(sorted(origin.server for origin in balancer.origins) + [rewriter.key])
+
+def check_no_options_left(options):
+    """
+    Complain about proxy() options that are not known
+    """
+    if options:
+        raise TypeError('proxy() got unexpected options: %s' % ', '.join(sorted(options)))
+
+def build_balancer(options, origin_server, transport):
+    """
+    Balancer over the origins of origin_server, each with the transport that transport(server) gives, and its
+    circuit breaker and concurrency limiter as configured by the balance, hash, circuit breaker and max_in_flight
+    options
+    """
+    circuit_breaker = breaker_factory(options)
+    concurrency_limiter = limiter_factory(options)
+    return Balancer(
+        [Origin(server, weight, transport(server), circuit_breaker(server), concurrency_limiter(server))
+         for server, weight in parse_origins(origin_server)],
+        strategy=option(options, 'balance', 'round_robin'),
+        ewma_decay_time=option(options, 'balance_ewma_decay_time', 10),
+        hash_virtual_nodes=option(options, 'hash_virtual_nodes', 160),
+        hash_load_factor=option(options, 'hash_load_factor', 1.25))
+
+def transport_factory(options, http_kwargs):
+    """
+    Function giving the transport of an origin server, as configured by the transport, pool and http2 options.
+    The transport_options of the server, if any, override them and update http_kwargs, the arguments of
+    ``httplib2.Http``.
+    """
+    defaults = dict((name, option(options, name, default)) for name, default in (
+        ('transport', 'httplib2'), ('pool_size', 10), ('pool_idle_timeout', 60), ('http2_max_connections', 2)))
+    per_origin = option(options, 'transport_options', {})
+
+    def create(server):
+        """
+        Transport of server
+        """
+        server_kwargs = dict(http_kwargs, **per_origin.get(server, {}))
+        chosen = dict((name, server_kwargs.pop(name, default)) for name, default in defaults.items())
+        transport = chosen['transport']
+        if callable(transport):
+            return transport(server_kwargs)
+        if transport == 'httplib2':
+            return Httplib2Transport(chosen['pool_size'], chosen['pool_idle_timeout'], server_kwargs)
+        if transport == 'httplib':
+            return HttplibTransport(chosen['pool_size'], chosen['pool_idle_timeout'], server_kwargs)
+        if transport == 'http2':
+            return Http2Transport(chosen['http2_max_connections'], http_kwargs=server_kwargs)
+        raise ValueError("Unknown transport %r, use 'httplib2', 'httplib', 'http2' or a function" % (transport,))
+    return create
+
+def build_cache(options, scope):
+    """
+    Response cache configured by the cache options, None when caching is off. Its keys are prefixed with scope
+    unless cache_key_prefix is given.
+    """
+    cache_options = dict((name, option(options, name, default)) for name, default in (
+        ('cache_max_size', 32 * 1024 * 1024), ('cache_max_entry_size', 1024 * 1024), ('cache_backend', None),
+        ('cache_stale_while_revalidate', 0), ('cache_stale_if_error', 0), ('cache_disk_dir', None),
+        ('cache_disk_max_size', 1024 * 1024 * 1024), ('cache_disk_max_entry_size', 256 * 1024 * 1024),
+        ('cache_key_prefix', None)))
+    if not option(options, 'cache', False):
+        return None
+    backend = cache_options['cache_backend']
+    disk_dir = cache_options['cache_disk_dir']
+    return ResponseCache(
+        max_size=cache_options['cache_max_size'],
+        max_entry_size=cache_options['cache_max_entry_size'],
+        backend=django_cache(backend) if backend else None,
+        stale_while_revalidate=cache_options['cache_stale_while_revalidate'],
+        stale_if_error=cache_options['cache_stale_if_error'],
+        disk=DiskStore(disk_dir, cache_options['cache_disk_max_size'],
+                       cache_options['cache_disk_max_entry_size']) if disk_dir else None,
+        key_prefix=scope if cache_options['cache_key_prefix'] is None else cache_options['cache_key_prefix'])
+
+def build_coalescer(options):
+    """
+    Coalescer configured by the coalesce options, None when coalescing is off
+    """
+    timeout = option(options, 'coalesce_timeout', 30)
+    key_headers = option(options, 'coalesce_key_headers', ('Authorization', 'Cookie'))
+    if not option(options, 'coalesce', False):
+        return None
+    return Coalescer(timeout=timeout, key_headers=key_headers)
+
+def build_negative_cache(options):
+    """
+    NegativeCache configured by the negative cache options, None when negative caching is off
+    """
+    ttls = option(options, 'negative_cache_ttls', None)
+    max_entries = option(options, 'negative_cache_max_entries', 10000)
+    if not option(options, 'negative_cache', False):
+        return None
+    return NegativeCache(ttls, max_entries)
+
+def breaker_factory(options):
+    """
+    Function giving the circuit breaker of an origin, as configured by the circuit breaker options, or None when off
+    """
+    threshold = option(options, 'circuit_breaker_threshold', 5)
+    reset_timeout = option(options, 'circuit_breaker_reset_timeout', 30)
+    if not option(options, 'circuit_breaker', False):
+        return lambda server: None
+    return lambda server: CircuitBreaker(server, threshold=threshold, reset_timeout=reset_timeout)
+
+def limiter_factory(options):
+    """
+    Function giving the concurrency limiter of an origin, as configured by the max_in_flight options, or None when
+    there is no limit
+    """
+    max_in_flight = option(options, 'max_in_flight', None)
+    max_queue = option(options, 'max_in_flight_queue', 0)
+    queue_timeout = option(options, 'max_in_flight_queue_timeout', 1)
+    if max_in_flight is None:
+        return lambda server: None
+    return lambda server: ConcurrencyLimiter(max_in_flight, max_queue=max_queue, queue_timeout=queue_timeout)
+
+def build_compressor(options):
+    """
+    Compressor configured by the compress options, None when compressing is off
+    """
+    level = option(options, 'compress_level', 6)
+    min_size = option(options, 'compress_min_size', 1024)
+    if not option(options, 'compress', False):
+        return None
+    return Compressor(level=level, min_size=min_size)
+
+def build_mirror(options, transport):
+    """
+    Mirror to the shadow origin of the mirror option, sending copies with the transport that transport(server)
+    gives, None when mirroring is off
+    """
+    sample = option(options, 'mirror_sample', 1.0)
+    workers = option(options, 'mirror_workers', 2)
+    queue_size = option(options, 'mirror_queue_size', 100)
+    server = option(options, 'mirror', None)
+    if server is None:
+        return None
+    return Mirror(server, sample, workers, queue_size, transport(server))
+
+def build_rate_limiter(options, scope):
+    """
+    RateLimiter configured by the rate limit options, None when clients are not limited. The counts it shares with
+    other processes are those of scope unless rate_limit_scope is given.
+    """
+    burst = option(options, 'rate_limit_burst', None)
+    key = option(options, 'rate_limit_key', 'ip')
+    max_clients = option(options, 'rate_limit_max_clients', 10000)
+    backend = option(options, 'rate_limit_backend', None)
+    scope = option(options, 'rate_limit_scope', scope)
+    rate = option(options, 'rate_limit', None)
+    if rate is None:
+        return None
+    return RateLimiter(rate, burst, key, max_clients, django_cache(backend) if backend else None, scope)
+
+def build_retry(options):
+    """
+    Retry configured by the retry and hedge options, None when requests are neither retried nor hedged
+    """
+    retries = option(options, 'retries', 0)
+    statuses = option(options, 'retry_statuses', (502, 503, 504))
+    budget = RetryBudget(option(options, 'retry_budget_ratio', 0.2), option(options, 'retry_budget_min_per_second', 10))
+    hedge = option(options, 'hedge', False)
+    hedge_min_delay = option(options, 'hedge_min_delay', 0)
+    hedge_quantile = option(options, 'hedge_quantile', 0.95)
+    if not retries and not hedge:
+        return None
+    return Retry(retries, statuses, budget, hedge, hedge_min_delay, hedge_quantile)
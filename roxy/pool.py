@@ -0,0 +1,207 @@
+"""
+Keep-alive connection pool for upstream requests
+"""
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from roxy import Http
+
+
+class BasePool(object):
+    """
+    Bookkeeping of a bounded, thread-safe pool of connections to an origin, or of objects holding them.
+
+    Up to size of them are kept. When they are all in use another one is opened, so that callers never wait for one,
+    and closed once it is given back. Those idle for longer than idle_timeout seconds are closed. Subclasses say how
+    one is taken for a key and how it is closed.
+    """
+
+    def __init__(self, size=10, idle_timeout=60):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._condition = threading.Condition()
+        # Stack of (released at, key, connection). The most recently used connection is at the end, so it is handed
+        # out first and the connections at the bottom are the ones that expire.
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._overflows = 0
+        self._handshakes = 0
+
+    def stats(self):
+        """
+        Snapshot of the pool counters
+        """
+        with self._condition:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'overflows': self._overflows,
+                'handshakes': self._handshakes,
+            }
+
+    def close(self):
+        """
+        Close the idle connections
+        """
+        with self._condition:
+            for _, _, conn in self._idle:
+                self._discard(conn)
+
+    def _checkout(self, key):
+        """
+        Take a connection for key out of the pool, a new one past size when all of them are in use
+        """
+        with self._condition:
+            self._expire_idle()
+            if not self._idle and self._created >= self.size:
+                self._overflows += 1
+            conn = self._take(key)
+            self._in_use += 1
+        return conn
+
+    def _checkin(self, key, conn, handshakes=0):
+        """
+        Give a connection for key back to the pool, counting the handshakes it went through while it was out. It is
+        closed instead when more than size are open.
+        """
+        with self._condition:
+            self._handshakes += handshakes
+            self._in_use -= 1
+            if self._created > self.size:
+                self._created -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((time.time(), key, conn))
+
+    def _take(self, key):
+        """
+        Most recently used idle connection, or a new one. Must be called with the condition held.
+        """
+        if self._idle:
+            return self._idle.pop()[2]
+        self._created += 1
+        return self._create(key)
+
+    def _create(self, key):
+        """
+        Open a new connection for key
+        """
+        raise NotImplementedError
+
+    def _discard(self, conn):
+        """
+        Close a connection
+        """
+        raise NotImplementedError
+
+    def _expire_idle(self):
+        """
+        Drop connections that have been idle for longer than idle_timeout. Must be called with the condition held.
+        """
+        if self.idle_timeout is None:
+            return
+        deadline = time.time() - self.idle_timeout
+        while self._idle and self._idle[0][0] < deadline:
+            self._discard(self._idle.pop(0)[2])
+            self._created -= 1
+
+
+class ConnectionPool(BasePool):
+    """
+    Bounded, thread-safe pool of ``roxy.Http`` instances for one origin.
+
+    Each Http instance keeps its own keep-alive connections, so handing the same instance out again lets the
+    next request skip the TCP and TLS handshake. An instance is only ever used by one thread at a time.
+    """
+
+    def __init__(self, size=10, idle_timeout=60, http_kwargs=None):
+        super(ConnectionPool, self).__init__(size, idle_timeout)
+        self.http_kwargs = http_kwargs or {}
+
+    def acquire(self):
+        """
+        Take an Http instance out of the pool, blocking while all of them are in use.
+        """
+        http = self._checkout(None)
+        _close_dead_connections(http)
+        http.roxy_sockets = _open_sockets(http)
+        return http
+
+    def release(self, http, broken=False):
+        """
+        Give an Http instance back to the pool. Connections of a ``broken`` instance are closed first, as they
+        may have been left half way through a message.
+        """
+        if broken:
+            _close_connections(http)
+        self._checkin(None, http, len(_open_sockets(http) - http.roxy_sockets))
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager around acquire() and release()
+        """
+        http = self.acquire()
+        broken = True
+        try:
+            yield http
+            broken = False
+        finally:
+            self.release(http, broken)
+
+    def _create(self, key):    # pylint: disable=W0613
+        """
+        Build a new Http instance
+        """
+        http = Http(**self.http_kwargs)
+        http.follow_redirects = False
+        return http
+
+    def _discard(self, conn):
+        """
+        Close the connections of an Http instance
+        """
+        _close_connections(conn)
+
+
+def _open_sockets(http):
+    """
+    Identities of the sockets currently open by an Http instance
+    """
+    return set(id(conn.sock) for conn in http.connections.values() if getattr(conn, 'sock', None) is not None)
+
+
+def _close_connections(http):
+    """
+    Close all the connections of an Http instance, they will be reopened on the next request
+    """
+    for conn in http.connections.values():
+        conn.close()
+
+
+def _close_dead_connections(http):
+    """
+    Close keep-alive connections that the origin has dropped while they were idle.
+
+    An idle keep-alive socket should have nothing to read. If it is readable the origin has either closed it or
+    sent something unexpected, and in both cases it cannot carry the next request.
+    """
+    for conn in http.connections.values():
+        sock = getattr(conn, 'sock', None)
+        if sock is not None and dropped(sock):
+            conn.close()
+
+
+def dropped(sock):
+    """
+    Whether an idle keep-alive socket has been dropped by the origin, or cannot be used for another reason
+    """
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, ValueError, TypeError):
+        return True
@@ -0,0 +1,176 @@
+"""
+Rate limiting of the requests of each client of a proxied view, with token buckets
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+from django.http import HttpResponse
+
+from roxy.hashring import request_key
+
+
+class RateLimiter(object):
+    """
+    Let each client send rate requests per second to the origin, and up to burst of them at once.
+
+    Clients are told apart by key, 'ip', 'header:<name>', 'cookie:<name>' or 'query:<name>', those without the
+    header, cookie or query parameter by their IP address. Their buckets are kept by ``TokenBuckets`` in the memory
+    of the process, up to max_clients of them, and also by ``SharedTokenBuckets`` in backend, a Django cache, for
+    limits across processes, counted apart for each scope. Requests past the limit are answered 429 Too Many Requests
+    without reaching the origin.
+    """
+
+    def __init__(self, rate, burst=None, key='ip', max_clients=10000, backend=None,
+                 scope=''):    # pylint: disable=R0913
+        if rate <= 0:
+            raise ValueError('rate_limit must be positive')
+        self.rate = rate
+        self.burst = burst or int(math.ceil(rate))
+        self.key = request_key(key, default=request_key('ip'))
+        self.buckets = TokenBuckets(rate, self.burst, max_clients)
+        self.shared = SharedTokenBuckets(backend, rate, self.burst, scope) if backend is not None else None
+
+    def check(self, request):
+        """
+        429 response for a request past the limit of its client, None when it may go on
+        """
+        key = self.key(request)
+        allowed, remaining, wait = self.buckets.take(key)
+        if allowed and self.shared is not None:
+            allowed, remaining, wait = self.shared.take(key)
+        if allowed:
+            return None
+        response = HttpResponse('Too many requests', status=429, content_type='text/plain')
+        response['Retry-After'] = str(int(math.ceil(wait)))
+        response['RateLimit-Limit'] = str(self.burst)
+        response['RateLimit-Remaining'] = str(remaining)
+        response['RateLimit-Reset'] = str(int(math.ceil(wait)))
+        return response
+
+    def stats(self):
+        """
+        Snapshot of the rate limiting counters
+        """
+        stats = self.buckets.stats()
+        if self.shared is not None:
+            shared = self.shared.stats()
+            stats['allowed'] -= shared['limited']
+            stats['limited'] += shared['limited']
+            stats['shared'] = shared
+        return stats
+
+
+class TokenBuckets(object):
+    """
+    Token bucket of each client, filling up with rate tokens per second up to burst, a request taking one.
+
+    Clients are spread over shards by the hash of their key, each shard with its own lock and up to max_clients /
+    shards buckets, the least recently used forgotten first. A forgotten client starts again with a full bucket,
+    which is what an idle one has anyway. Taking a token costs a dict lookup whatever the number of clients.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000, shards=16):
+        self.rate = float(rate)
+        self.burst = burst
+        self._shard_size = max(1, int(math.ceil(float(max_clients) / shards)))
+        self._shards = [_Shard() for _ in xrange(shards)]
+
+    def take(self, key, now=None):
+        """
+        Take a token from the bucket of key, return (taken, tokens left, seconds until the next token)
+        """
+        now = time.time() if now is None else now
+        shard = self._shards[hash(key) % len(self._shards)]
+        with shard.lock:
+            bucket = shard.buckets.pop(key, None)
+            if bucket is None:
+                tokens = self.burst
+                if len(shard.buckets) >= self._shard_size:
+                    shard.buckets.popitem(last=False)
+                    shard.evictions += 1
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+                shard.allowed += 1
+            else:
+                shard.limited += 1
+            shard.buckets[key] = (tokens, now)
+        return taken, int(tokens), 0 if taken else (1 - tokens) / self.rate
+
+    def stats(self):
+        """
+        Snapshot of the counters of every shard
+        """
+        stats = dict.fromkeys(('clients', 'allowed', 'limited', 'evictions'), 0)
+        for shard in self._shards:
+            with shard.lock:
+                stats['clients'] += len(shard.buckets)
+                stats['allowed'] += shard.allowed
+                stats['limited'] += shard.limited
+                stats['evictions'] += shard.evictions
+        return stats
+
+
+class SharedTokenBuckets(object):
+    """
+    Limits shared by every process through cache, a Django cache backend.
+
+    Django caches can add to a counter atomically but not compare and set, so the bucket of a client is approximated
+    by fixed windows of burst / rate seconds, each letting burst requests through. The long run rate and the largest
+    burst are the same, though up to twice burst requests may get through around the end of a window. Buckets of
+    different scopes are counted apart, so that limiters with other rates do not share them.
+    """
+
+    def __init__(self, cache, rate, burst, scope=''):
+        self.cache = cache
+        self.scope = scope
+        self.burst = burst
+        self.window = float(burst) / rate
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('allowed', 'limited'), 0)
+
+    def take(self, key, now=None):
+        """
+        Count a request of key in the current window, return (allowed, requests left, seconds until the next window)
+        """
+        now = time.time() if now is None else now
+        window = int(now // self.window)
+        scoped = '\n'.join(part.encode('utf-8') if isinstance(part, unicode) else part for part in (self.scope, key))
+        cache_key = 'roxy-rate:%s:%d' % (md5(scoped).hexdigest(), window)
+        timeout = int(math.ceil(self.window)) + 1
+        self.cache.add(cache_key, 0, timeout)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:
+            # Expired in between
+            self.cache.add(cache_key, 1, timeout)
+            count = 1
+        allowed = count <= self.burst
+        with self._lock:
+            self._counters['allowed' if allowed else 'limited'] += 1
+        return allowed, max(0, self.burst - count), 0 if allowed else (window + 1) * self.window - now
+
+    def stats(self):
+        """
+        Snapshot of the counters of this process
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+class _Shard(object):
+    """
+    Buckets of some of the clients, in least recently used order, with their lock and counters
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
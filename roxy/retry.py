@@ -0,0 +1,285 @@
+"""
+Retries and hedging of idempotent proxied requests, within a retry budget
+"""
+import threading
+import time
+from collections import deque
+
+from roxy import UPSTREAM_ERRORS, OriginUnavailable
+from roxy.upload import rewind
+
+# Methods a request can be sent more than once with, RFC 7231 section 4.2.2
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'])
+
+
+class Retry(object):
+    """
+    Send idempotent requests again, up to retries more times, when they fail with a connection error or a status
+    among statuses, and hedge them when hedge is on.
+
+    A hedged request is sent again when the origins have not answered it within the hedge_quantile of the recent
+    latencies, or hedge_min_delay seconds if that is longer, and the first answer is used. Retries and hedged requests
+    both draw from budget, a RetryBudget, so that they cannot multiply the load of origins that are failing.
+    Requests whose body is read from the client while it is sent are only retried when it can be read again, and
+    never hedged. Requests an origin has turned down, e.g. with its circuit open, are not retried.
+    """
+
+    def __init__(self, retries=2, statuses=(502, 503, 504), budget=None, hedge=False, hedge_min_delay=0,
+                 hedge_quantile=0.95):    # pylint: disable=R0913
+        self.retries = retries
+        self.statuses = frozenset(statuses)
+        self.budget = budget or RetryBudget()
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.latencies = LatencyWindow(quantile=hedge_quantile)
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('retries', 'hedges', 'hedge_wins'), 0)
+
+    def send(self, method, body, attempt, headers):
+        """
+        (httplib2 response, content) of attempt(headers), sent again as allowed
+        """
+        self.budget.deposit()
+        if method not in IDEMPOTENT_METHODS:
+            return attempt(headers)
+        hedge = self.hedge and not hasattr(body, 'read')
+        retries = self.retries
+        while True:
+            try:
+                response, content = self._hedged(attempt, headers) if hedge else self._timed(attempt, headers)
+            except OriginUnavailable:
+                raise
+            except UPSTREAM_ERRORS:
+                if not self._may_retry(retries, body):
+                    raise
+            else:
+                if response.status not in self.statuses or not self._may_retry(retries, body):
+                    return response, content
+                _close(content)
+            retries -= 1
+            self._count('retries')
+
+    def stats(self):
+        """
+        Snapshot of the retry and hedging counters, with the budget and the hedging delay
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(budget=self.budget.stats(), hedge_delay=self._hedge_delay())
+        return stats
+
+    def _may_retry(self, retries, body):
+        """
+        Whether a request that failed can be sent again
+        """
+        return retries > 0 and rewind(body) and self.budget.withdraw()
+
+    def _timed(self, attempt, headers):
+        """
+        attempt(headers), recording how long it took to answer
+        """
+        started = time.time()
+        response, content = attempt(headers)
+        self.latencies.record(time.time() - started)
+        return response, content
+
+    def _hedged(self, attempt, headers):
+        """
+        attempt(headers), made a second time when the first one is slow to answer
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._timed(attempt, headers)
+        race = _Race(self._timed, headers)
+        race.start(attempt)
+        outcome = race.wait(delay)
+        if outcome is None and self.budget.withdraw():
+            self._count('hedges')
+            race.start(attempt)
+            outcome = race.wait()
+            if race.winner == 1:
+                self._count('hedge_wins')
+        elif outcome is None:
+            outcome = race.wait()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def _hedge_delay(self):
+        """
+        Seconds to wait before hedging a request, None until enough latencies are known
+        """
+        quantile = self.latencies.value()
+        return None if quantile is None else max(quantile, self.hedge_min_delay)
+
+    def _count(self, name):
+        """
+        Increment a counter
+        """
+        with self._lock:
+            self._counters[name] += 1
+
+
+class RetryBudget(object):
+    """
+    Retries allowed over the last window seconds: ratio of the requests, plus min_per_second whatever the traffic
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=10, window=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        # Per second of the window, [second, requests, retries]
+        self._buckets = [[0, 0, 0] for _ in range(window)]
+        self._exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """
+        Account for a request
+        """
+        with self._lock:
+            self._bucket()[1] += 1
+
+    def withdraw(self):
+        """
+        Take a retry out of the budget, return False when there is none left
+        """
+        with self._lock:
+            requests, retries = self._totals()
+            if retries >= self.min_per_second * self.window + self.ratio * requests:
+                self._exhausted += 1
+                return False
+            self._bucket()[2] += 1
+            return True
+
+    def stats(self):
+        """
+        Requests and retries over the window, and retries refused
+        """
+        with self._lock:
+            requests, retries = self._totals()
+            return {'requests': requests, 'retries': retries, 'exhausted': self._exhausted}
+
+    def _bucket(self):
+        """
+        Counters of the current second, must be called with the lock held
+        """
+        second = int(time.time())
+        bucket = self._buckets[second % self.window]
+        if bucket[0] != second:
+            bucket[:] = [second, 0, 0]
+        return bucket
+
+    def _totals(self):
+        """
+        (requests, retries) over the window, must be called with the lock held
+        """
+        oldest = int(time.time()) - self.window
+        live = [bucket for bucket in self._buckets if bucket[0] > oldest]
+        return sum(bucket[1] for bucket in live), sum(bucket[2] for bucket in live)
+
+
+class LatencyWindow(object):
+    """
+    Latencies of the last size requests, and their quantile once there are min_samples of them. The quantile is
+    computed again every size / 10 requests.
+    """
+
+    def __init__(self, size=1000, quantile=0.95, min_samples=20):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=size)
+        self._refresh_every = max(size // 10, 1)
+        self._since_refresh = 0
+        self._value = None
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Account for the latency of a request
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_refresh += 1
+            if len(self._latencies) < self.min_samples:
+                return
+            if self._value is None or self._since_refresh >= self._refresh_every:
+                ordered = sorted(self._latencies)
+                self._value = ordered[int(self.quantile * (len(ordered) - 1))]
+                self._since_refresh = 0
+
+    def value(self):
+        """
+        Quantile of the recent latencies, None while there are too few of them
+        """
+        return self._value
+
+
+class _Race(object):
+    """
+    Attempts at a request made at the same time, the first answer wins and the others are let go of
+    """
+
+    def __init__(self, run, headers):
+        self.winner = None
+        self._run = run
+        self._headers = headers
+        self._started = 0
+        self._failed = 0
+        self._outcome = None
+        self._condition = threading.Condition()
+
+    def start(self, attempt):
+        """
+        Make another attempt in a thread of its own
+        """
+        index = self._started
+        self._started += 1
+        thread = threading.Thread(target=self._attempt, args=(index, attempt))
+        thread.daemon = True
+        thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Outcome of the first attempt to answer, or the error of the last one when all failed, None when there is
+        none within timeout seconds
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self.winner is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._outcome
+
+    def _attempt(self, index, attempt):
+        """
+        Make an attempt and take part in the race
+        """
+        try:
+            outcome = self._run(attempt, dict(self._headers))
+        except Exception as error:    # pylint: disable=W0703
+            # Raised in the thread waiting for the race
+            outcome = error
+        with self._condition:
+            if self.winner is None and isinstance(outcome, Exception):
+                self._failed += 1
+                lost = self._failed < self._started
+            else:
+                lost = self.winner is not None
+            if not lost:
+                self.winner = index
+                self._outcome = outcome
+                self._condition.notify_all()
+        if lost and not isinstance(outcome, Exception):
+            _close(outcome[1])
+
+
+def _close(content):
+    """
+    Let go of a response body that is not used, streamed bodies hold an upstream connection
+    """
+    if hasattr(content, 'close'):
+        content.close()
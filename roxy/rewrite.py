@@ -0,0 +1,87 @@
+"""
+Rewriting of the URLs of proxied requests, and of the redirects of the origin the other way round
+"""
+import re
+import urllib
+from urlparse import urlsplit, urlunsplit
+
+# Responses whose Location header points the client to another URL
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+
+
+class UrlRewriter(object):
+    """
+    Rules rewriting the path and query of the requests forwarded to the origin, compiled once.
+
+    strip_prefix is removed from the start of paths. path_rewrites is a list of (pattern, replacement) regular
+    expression substitutions applied in turn to paths, each of which may carry a (pattern, replacement, reverse_pattern,
+    reverse_replacement) reverse substitution. pin_query maps query parameters to the value they always have.
+
+    The Location of the redirects of the origin goes through the rules in reverse: the reverse substitutions, the
+    prefix added back and the pinned parameters removed.
+    """
+
+    def __init__(self, strip_prefix='', path_rewrites=(), pin_query=None):
+        self.strip_prefix = strip_prefix.rstrip('/')
+        self._rewrites = []
+        self._reverse_rewrites = []
+        for rule in path_rewrites:
+            self._rewrites.append((re.compile(rule[0]), rule[1]))
+            if len(rule) == 4:
+                self._reverse_rewrites.insert(0, (re.compile(rule[2]), rule[3]))
+        self._pinned = sorted((pin_query or {}).items())
+        self._pinned_names = frozenset(name for name, _ in self._pinned)
+        self._pinned_query = urllib.urlencode(self._pinned)
+        self._identity = not (self.strip_prefix or self._rewrites or self._pinned)
+        # Text of the rules, the same for rewriters built from the same rules
+        self.key = repr((self.strip_prefix, [tuple(getattr(part, 'pattern', part) for part in rule)
+                                             for rule in path_rewrites], self._pinned))
+
+    @classmethod
+    def from_option(cls, rewrite):
+        """
+        Rules given to proxy() as an UrlRewriter, a dict of its arguments or None
+        """
+        if rewrite is None:
+            return cls()
+        if isinstance(rewrite, cls):
+            return rewrite
+        return cls(**rewrite)
+
+    def forward(self, full_path):
+        """
+        Path and query to request from the origin for full_path, the path and query requested from the proxy
+        """
+        if self._identity:
+            return full_path
+        path, _, query = full_path.partition('?')
+        prefix = self.strip_prefix
+        if prefix and path.startswith(prefix) and path[len(prefix):len(prefix) + 1] in ('', '/'):
+            path = path[len(prefix):] or '/'
+        for pattern, replacement in self._rewrites:
+            path = pattern.sub(replacement, path)
+        if self._pinned:
+            query = '&'.join(param for param in (self._unpinned(query), self._pinned_query) if param)
+        return '%s?%s' % (path, query) if query else path
+
+    def location(self, location, host, scheme=None):
+        """
+        Location of a redirect of the origin as seen by the client of the proxy at host, and scheme if given
+        """
+        parts = urlsplit(location)
+        path = parts.path
+        for pattern, replacement in self._reverse_rewrites:
+            path = pattern.sub(replacement, path)
+        if self.strip_prefix and path.startswith('/'):
+            path = self.strip_prefix + path
+        query = self._unpinned(parts.query) if self._pinned else parts.query
+        if not parts.netloc:
+            return urlunsplit((parts.scheme, '', path, query, parts.fragment))
+        return urlunsplit((scheme or parts.scheme, host, path, query, parts.fragment))
+
+    def _unpinned(self, query):
+        """
+        Query without the pinned parameters, otherwise left as it is
+        """
+        return '&'.join(param for param in query.split('&')
+                        if param and urllib.unquote_plus(param.partition('=')[0]) not in self._pinned_names)
@@ -0,0 +1,133 @@
+"""
+Dispatch of requests to many origins by host name and path prefix
+"""
+from roxy.views import proxy
+
+
+class Router(object):
+    """
+    Proxied views picked by host name and longest path prefix, in time proportional to the length of the path.
+
+    routes maps a path prefix, a host name, or a host name followed by a path prefix, to an origin server as given to
+    proxy(), or to an (origin server, proxy() options) pair. Routes of the host of a request come first, then routes
+    without a host. Prefixes match whole path segments, so '/api' matches '/api' and '/api/users' but not '/apiary'.
+
+    Views of the routes that are the same as in previous, an earlier router, are kept along with their connection
+    pools and caches, and the other views of previous are closed. Targets are compared by content, so that the same
+    table built again, by a reload, keeps its views even when its options hold objects or functions.
+    """
+
+    def __init__(self, routes, previous=None):
+        self.routes = dict(routes)
+        self.views = {}
+        self._keys = {}
+        self._tries = {}
+        for route, target in self.routes.items():
+            key = self._keys[route] = _stable_key(target)
+            if previous is not None and previous._keys.get(route) == key:    # pylint: disable=W0212
+                view = previous.views[route]
+            else:
+                view = _proxy(target)
+            self.views[route] = view
+            host, prefix = _split_route(route)
+            node = self._tries.setdefault(host, _Node())
+            for segment in _segments(prefix):
+                node = node.children.setdefault(segment, _Node())
+            node.view = view
+        if previous is not None:
+            kept = set(self.views.values())
+            for view in previous.views.values():
+                if view not in kept:
+                    view.close()
+
+    def resolve(self, host, path):
+        """
+        View of the route of a request for path on host, None when no route matches
+        """
+        host = _hostname(host)
+        for trie in (self._tries.get(host), self._tries.get(None)):
+            if trie is not None:
+                view = _longest_prefix(trie, path)
+                if view is not None:
+                    return view
+        return None
+
+
+class _Node(object):
+    """
+    Node of a prefix trie, keyed by path segment
+    """
+    __slots__ = ('view', 'children')
+
+    def __init__(self):
+        self.view = None
+        self.children = {}
+
+
+def _proxy(target):
+    """
+    Proxied view of the target of a route
+    """
+    if isinstance(target, tuple) and len(target) == 2 and isinstance(target[1], dict):
+        return proxy(target[0], **target[1])
+    return proxy(target)
+
+def _stable_key(value):
+    """
+    Key of a route target equal to that of the same target built again: containers and objects compared by content,
+    regular expressions by pattern, and functions by their code and the values they hold
+    """
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((key, _stable_key(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return ('set',) + tuple(sorted(_stable_key(item) for item in value))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_stable_key(item) for item in value)
+    code = getattr(value, '__code__', None)
+    if code is not None:
+        held = [cell.cell_contents for cell in getattr(value, '__closure__', None) or ()]
+        return ('function', code.co_filename, code.co_firstlineno, code.co_name,
+                _stable_key(held), _stable_key(getattr(value, '__defaults__', None)))
+    if hasattr(value, 'pattern') and hasattr(value, 'flags'):
+        return ('pattern', value.pattern, value.flags)
+    if isinstance(getattr(value, '__dict__', None), dict):
+        return (type(value).__name__, _stable_key(vars(value)))
+    return value
+
+def _split_route(route):
+    """
+    (host name or None, path prefix) of a route
+    """
+    if route.startswith('/'):
+        return None, route
+    host, slash, prefix = route.partition('/')
+    return host.lower(), slash + prefix
+
+def _segments(path):
+    """
+    Non empty segments of path
+    """
+    return [segment for segment in path.split('/') if segment]
+
+def _longest_prefix(node, path):
+    """
+    View of the longest prefix of path in the trie rooted at node
+    """
+    view = node.view
+    for segment in path.split('/'):
+        if not segment:
+            continue
+        node = node.children.get(segment)
+        if node is None:
+            break
+        if node.view is not None:
+            view = node.view
+    return view
+
+def _hostname(host):
+    """
+    Host name of a Host header, without port
+    """
+    if host.rfind(':') > host.rfind(']'):
+        host = host[:host.rfind(':')]
+    return host.lower()
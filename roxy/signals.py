@@ -0,0 +1,10 @@
+"""
+Signals sent by roxy
+"""
+from django.dispatch import Signal
+
+# Sent when the circuit breaker of an origin changes state, see roxy.health.CircuitBreaker
+circuit_state_changed = Signal(providing_args=['breaker', 'old_state', 'new_state'])
+
+# Sent once a proxied view with timing on has built its response, see roxy.timing.RequestTimer
+request_timed = Signal(providing_args=['request', 'response', 'timer'])
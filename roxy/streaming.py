@@ -0,0 +1,187 @@
+"""
+Relay upstream response bodies in chunks instead of reading them whole
+"""
+import httplib
+import socket
+import zlib
+
+import httplib2
+from django.http import HttpResponse
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Before Django 1.5 a plain HttpResponse streams an iterator content as long as nothing reads response.content
+    StreamingHttpResponse = HttpResponse
+try:
+    from django.http import FileResponse
+except ImportError:
+    # Before Django 1.8 the response is its own WSGI iterable, bodies cached on disk are sent as memory mapped slices
+    FileResponse = None
+
+from roxy.encoding import DECODABLE, add_vary
+from roxy.timing import lap
+from roxy.upload import rewind
+
+
+def django_response(content, status, content_type):
+    """
+    Django response relaying content, a string, a body cached on disk or an iterator over a streamed body
+    """
+    if isinstance(content, basestring):
+        response_class = HttpResponse
+    elif FileResponse is not None and hasattr(content, 'fileno'):
+        # Handed to wsgi.file_wrapper, which may send it with sendfile
+        response_class = FileResponse
+    else:
+        response_class = StreamingHttpResponse
+    return response_class(content, status=status, content_type=content_type)
+
+
+def open_stream(pool, uri, method, body, headers, chunk_size, keep_encodings=()):
+    """
+    Send a request to the origin through a pooled Http instance and return (httplib2 response, body iterator).
+
+    Only the status line and the headers have been read when this returns. The Http instance goes back to the pool
+    once the body iterator has been exhausted or closed. Bodies are decompressed unless their content coding is one
+    of keep_encodings.
+    """
+    http = pool.acquire()
+    response = None
+    try:
+        response = _send(http, uri, method, body, headers)
+    finally:
+        if response is None:
+            pool.release(http, broken=True)
+    info = httplib2.Response(response)
+    return info, UpstreamBody(pool, http, response, chunk_size, body_decoder(info, method, keep_encodings))
+
+
+def body_decoder(info, method, keep_encodings=()):
+    """
+    Decompressor of the body of the httplib2 response info, None when it is relayed as it is. Its content coding is
+    kept if it is one of keep_encodings, otherwise its headers are changed to those of the decompressed body.
+    """
+    if info.get('content-encoding') in (keep_encodings or ()):
+        # The response now depends on whether the client accepts its encoding
+        add_vary(info, 'Accept-Encoding')
+    elif method != 'HEAD' and info.get('content-encoding') in DECODABLE:
+        # httplib2 decompresses bodies before handing them to us, do the same on the fly so the headers a client
+        # gets are the same whether the view streams or not.
+        del info['content-encoding']
+        if 'content-length' in info:
+            del info['content-length']
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+    return None
+
+
+class UpstreamBody(object):
+    """
+    Iterator over an upstream response body, chunk_size bytes at a time
+    """
+
+    def __init__(self, pool, http, response, chunk_size, decoder=None):
+        self._pool = pool
+        self._http = http
+        self._response = response
+        self._chunk_size = chunk_size
+        self._decoder = decoder
+        self._released = False
+
+    def __iter__(self):
+        broken = True
+        try:
+            while True:
+                chunk = self._response.read(self._chunk_size)
+                if not chunk:
+                    break
+                if self._decoder:
+                    chunk = self._decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if self._decoder:
+                chunk = self._decoder.flush()
+                if chunk:
+                    yield chunk
+            broken = False
+        finally:
+            self._release(broken)
+
+    def close(self):
+        """
+        Called by the WSGI server once the response is done. A body that has not been read to the end leaves the
+        connection in the middle of a message, so it is closed instead of being kept alive.
+        """
+        self._release(broken=True)
+
+    def _release(self, broken):
+        """
+        Give the Http instance back to the pool, only once
+        """
+        if self._released:
+            return
+        self._released = True
+        self._response.close()
+        self._pool.release(self._http, broken)
+
+
+def _send(http, uri, method, body, headers):
+    """
+    Send the request on the keep-alive connection the Http instance has for the origin, and read the response
+    status line and headers.
+    """
+    scheme, authority, request_uri, _ = httplib2.urlnorm(httplib2.iri2uri(uri))
+    conn = _connection(http, scheme, authority)
+    lap('wait')
+    return send_request(conn, method, request_uri, body, headers)
+
+
+def send_request(conn, method, request_uri, body, headers):
+    """
+    Send the request on an ``httplib`` connection, opening it if it is not, and read the response status line and
+    headers. A kept alive connection the origin has dropped is opened again.
+    """
+    while True:
+        reused = conn.sock is not None
+        try:
+            if not reused:
+                conn.connect()
+                lap('connect')
+            conn.request(method, request_uri, body, headers)
+            response = conn.getresponse()
+            lap('ttfb')
+            return response
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            # A kept alive connection may have been dropped by the origin in between, try once on a new one unless
+            # part of a body read from the client has already gone.
+            if not reused or not rewind(body):
+                raise
+
+
+def _connection(http, scheme, authority):
+    """
+    Connection of the Http instance for scheme and authority, created the same way httplib2 does so that both share
+    the connection cache.
+    """
+    conn_key = '%s:%s' % (scheme, authority)
+    conn = http.connections.get(conn_key)
+    if conn is None:
+        conn = http.connections[conn_key] = new_connection(http, scheme, authority)
+    return conn
+
+
+def new_connection(http, scheme, authority):
+    """
+    Connection to authority, not opened yet, with the timeout, proxy and TLS settings of the Http instance
+    """
+    proxy_info = http.proxy_info
+    if callable(proxy_info):
+        proxy_info = proxy_info(scheme)
+    kwargs = {'timeout': http.timeout, 'proxy_info': proxy_info}
+    if scheme == 'https':
+        kwargs['ca_certs'] = http.ca_certs
+        kwargs['disable_ssl_certificate_validation'] = http.disable_ssl_certificate_validation
+        certs = list(http.certificates.iter(authority))
+        if certs:
+            kwargs['key_file'], kwargs['cert_file'] = certs[0][:2]
+    return httplib2.SCHEME_TO_CONNECTION[scheme](authority, **kwargs)
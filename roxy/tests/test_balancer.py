@@ -0,0 +1,66 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.balancer import Balancer, Origin, parse_origins
+from roxy.pool import ConnectionPool
+from roxy.views import proxy
+
+
+urlpatterns = patterns('',
+    url(r'', proxy(['https://one.localhost:8009', ('two.localhost:8010', 2)])),
+)
+
+
+def create_balancer(strategy, *weights):
+    return Balancer([Origin('origin%d:80' % i, weight, ConnectionPool()) for i, weight in enumerate(weights)],
+                    strategy=strategy)
+
+
+class TestBalancer(TestCase):
+
+    def test_weighted_round_robin(self):
+        balancer = create_balancer('round_robin', 1, 2)
+        chosen = [balancer.choose().server for _ in range(6)]
+        self.assertEqual(chosen, ['origin1:80', 'origin0:80', 'origin1:80'] * 2)
+
+    def test_least_outstanding(self):
+        balancer = create_balancer('least_outstanding', 1, 1)
+        busy = balancer.origins[0].pool.acquire()
+        self.assertEqual([balancer.choose().server for _ in range(3)], ['origin1:80'] * 3)
+        balancer.origins[0].pool.release(busy)
+
+    def test_ewma_prefers_faster_origin(self):
+        balancer = create_balancer('ewma', 1, 1)
+        balancer.record(balancer.origins[0], 1.0)
+        balancer.record(balancer.origins[1], 0.01)
+        self.assertEqual([balancer.choose().server for _ in range(5)], ['origin1:80'] * 5)
+        self.assertEqual(balancer.stats()['origins'][1]['requests'], 5)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, create_balancer, 'fastest', 1)
+
+    def test_parse_origins(self):
+        self.assertEqual(parse_origins('localhost:8001'), [('localhost:8001', 1)])
+        self.assertEqual(parse_origins(['http://a', ('http://b', 3)]), [('http://a', 1), ('http://b', 3)])
+        self.assertRaises(ValueError, parse_origins, [('http://a', 0)])
+        self.assertRaises(ValueError, parse_origins, [])
+
+
+@patch('httplib2.Http.request')
+class TestBalancedView(TestCase):
+    urls = 'roxy.tests.test_balancer'
+
+    def test_rewrites_url_and_host_for_chosen_origin(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'OK'
+
+        for _ in range(3):
+            self.client.get('/some/path', {'some': 'data'}, HTTP_HOST='testserver')
+
+        calls = [(call[0][0], call[1]['headers']['Host']) for call in mock_request.call_args_list]
+        self.assertEqual(sorted(calls), [
+            (u'http://two.localhost:8010/some/path?some=data', 'two.localhost:8010'),
+            (u'http://two.localhost:8010/some/path?some=data', 'two.localhost:8010'),
+            (u'https://one.localhost:8009/some/path?some=data', 'one.localhost:8009'),
+        ])
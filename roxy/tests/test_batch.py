@@ -0,0 +1,79 @@
+import json
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.batch import FanOut, batch, parse_batch
+
+batch_view = batch({'/places': 'http://places.local', '/users': 'http://users.local'}, batch_max_items=3,
+                   batch_deadline=0.5)
+
+urlpatterns = patterns('',
+    url(r'^batch$', batch_view),
+)
+
+
+def origin(uri, method='GET', body=None, headers=None, **kwargs):
+    if '/slow' in uri:
+        time.sleep(1)
+    if '/fail' in uri:
+        raise IOError('Connection refused')
+    content = '%s %s %s' % (method, uri, body or '')
+    return Response({'status': 200, 'content-type': 'text/plain', 'x-cookie': headers.get('Cookie', '')}), content
+
+
+class TestParseBatch(TestCase):
+
+    def test_parses_requests(self):
+        self.assertEqual(parse_batch('[{"path": "/a", "method": "post"}]'), [{'path': '/a', 'method': 'POST'}])
+
+    def test_refuses_malformed_batches(self):
+        for body in ('not json', '{"path": "/a"}', '[{"path": "a"}]', '[{"path": "/a", "headers": []}]'):
+            self.assertRaises(ValueError, parse_batch, body)
+
+
+class TestFanOut(TestCase):
+
+    def test_maps_in_order_within_deadline(self):
+        fan_out = FanOut(workers=2)
+
+        results = fan_out.map(lambda item: time.sleep(item) or item, [0.2, 0, 0.01], time.time() + 0.1)
+
+        self.assertEqual(results, [None, 0, 0.01])
+        self.assertEqual(fan_out.stats()['submitted'], 3)
+
+
+@patch('httplib2.Http.request', side_effect=origin)
+class TestBatchView(TestCase):
+    urls = 'roxy.tests.test_batch'
+
+    def post(self, items):
+        return self.client.post('/batch', json.dumps(items), content_type='application/json', HTTP_COOKIE='id=42')
+
+    def test_fans_out_and_aggregates(self, mock_request):
+        response = self.post([
+            {'path': '/places/1?lang=en'},
+            {'path': '/users/2', 'method': 'PUT', 'body': 'name=Ann', 'headers': {'Content-Type': 'text/plain'}},
+            {'path': '/nowhere'},
+        ])
+
+        entries = json.loads(response.content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual([entry['status'] for entry in entries], [200, 200, 404])
+        self.assertEqual(entries[0]['body'], 'GET http://places.local/places/1?lang=en ')
+        self.assertEqual(entries[0]['headers']['x-cookie'], 'id=42')
+        self.assertEqual(entries[1]['body'], 'PUT http://users.local/users/2 name=Ann')
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_answers_late_and_failed_requests_in_the_batch(self, mock_request):
+        entries = json.loads(self.post([{'path': '/places/slow'}, {'path': '/places/fail'}]).content)
+
+        self.assertEqual([entry['status'] for entry in entries], [504, 502])
+
+    def test_refuses_bad_batches(self, mock_request):
+        self.assertEqual(self.client.get('/batch').status_code, 405)
+        self.assertEqual(self.post([{'path': '/places'}] * 4).status_code, 400)
+        self.assertEqual(self.client.post('/batch', 'nope', content_type='application/json').status_code, 400)
@@ -0,0 +1,237 @@
+import socket
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.core.cache import cache as default_cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.http import http_date
+from httplib2 import Response
+from mock import Mock, patch
+
+from roxy.cache import ResponseCache, parse_cache_control
+from roxy.views import proxy
+
+
+cached_view = proxy('https://localhost:8009', cache=True)
+
+urlpatterns = patterns('',
+    url(r'', cached_view),
+)
+
+URL = u'https://localhost:8009/resource'
+
+
+def create_send(status=200, content='Origin content', **headers):
+    response = Response({'status': status})
+    response['date'] = http_date()
+    for key, value in headers.items():
+        response[key.replace('_', '-').lower()] = value
+    return Mock(return_value=(response, content))
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+
+    def test_serves_fresh_response(self):
+        send = create_send(cache_control='max-age=60', etag='"v1"')
+        self.cache.fetch('GET', URL, {}, send)
+        response, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(content, 'Origin content')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response['etag'], '"v1"')
+        self.assertIn(response['age'], ('0', '1'))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_does_not_store_uncacheable_responses(self):
+        for headers in ({'cache_control': 'no-store, max-age=60'}, {'cache_control': 'private, max-age=60'},
+                        {'cache_control': 'max-age=60', 'set_cookie': 'a=b'}, {'cache_control': 'max-age=60',
+                        'vary': '*'}, {}):
+            send = create_send(**headers)
+            self.cache.fetch('GET', URL, {}, send)
+            self.cache.fetch('GET', URL, {}, send)
+            self.assertEqual(send.call_count, 2, headers)
+
+    def test_expires_and_heuristic_freshness(self):
+        send = create_send(expires=http_date(time.time() + 60))
+        self.cache.fetch('GET', URL, {}, send)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 1)
+
+        send = create_send(last_modified=http_date(time.time() - 3600))
+        self.cache.fetch('GET', URL + '2', {}, send)
+        self.cache.fetch('GET', URL + '2', {}, send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_stale_response_goes_to_origin(self):
+        send = create_send(cache_control='max-age=60', age='60')
+        self.cache.fetch('GET', URL, {}, send)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 2)
+
+    def test_vary(self):
+        send = create_send(cache_control='max-age=60', vary='Accept-Language')
+        self.cache.fetch('GET', URL, {'Accept-Language': 'en'}, send)
+        self.cache.fetch('GET', URL, {'Accept-Language': 'en'}, send)
+        self.assertEqual(send.call_count, 1)
+        self.cache.fetch('GET', URL, {'Accept-Language': 'th'}, send)
+        self.assertEqual(send.call_count, 2)
+
+    def test_client_asking_for_origin(self):
+        send = create_send(cache_control='max-age=60')
+        self.cache.fetch('GET', URL, {}, send)
+        self.cache.fetch('GET', URL, {'Cache-Control': 'no-cache'}, send)
+        self.cache.fetch('GET', URL, {'Authorization': 'Basic eDp5'}, send)
+        self.assertEqual(send.call_count, 3)
+
+    def test_conditional_request_from_client(self):
+        send = create_send(cache_control='max-age=60', etag='"v1"')
+        self.cache.fetch('GET', URL, {}, send)
+        response, content = self.cache.fetch('GET', URL, {'If-None-Match': '"v0", "v1"'}, send)
+        self.assertEqual(response.status, 304)
+        self.assertEqual(content, '')
+        self.assertEqual(response['etag'], '"v1"')
+
+    def test_unsafe_method_invalidates(self):
+        send = create_send(cache_control='max-age=60')
+        self.cache.fetch('GET', URL, {}, send)
+        self.cache.fetch('POST', URL, {}, send)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 3)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(max_size=300)
+        for path in ('/a', '/b', '/c'):
+            cache.fetch('GET', URL + path, {}, create_send(content='x' * 100, cache_control='max-age=60'))
+        send = create_send(cache_control='max-age=60')
+        cache.fetch('GET', URL + '/a', {}, send)
+        self.assertEqual(send.call_count, 1)
+        self.assertTrue(cache.stats()['evictions'] > 0)
+        self.assertTrue(cache.stats()['size'] <= 300)
+
+    def test_shared_backend(self):
+        backend = {}
+        shared = Mock()
+        shared.get.side_effect = backend.get
+        shared.set.side_effect = lambda key, value, timeout: backend.__setitem__(key, value)
+        send = create_send(cache_control='max-age=60')
+        ResponseCache(backend=shared).fetch('GET', URL, {}, send)
+        ResponseCache(backend=shared).fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_parse_cache_control(self):
+        self.assertEqual(parse_cache_control('Max-Age=60, no-cache, private="Set-Cookie"'),
+                         {'max-age': '60', 'no-cache': None, 'private': 'Set-Cookie'})
+
+
+@patch('httplib2.Http.request')
+class TestCachedView(TestCase):
+    urls = 'roxy.tests.test_cache'
+
+    def test_hit(self, mock_request):
+        mock_request.return_value = create_send(cache_control='max-age=60', content_type='text/plain')()
+
+        self.client.get('/cached/path')
+        response = self.client.get('/cached/path')
+
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(response.content, 'Origin content')
+        self.assertEqual(response['Cache-Control'], 'max-age=60')
+        self.assertIn(response['Age'], ('0', '1'))
+
+    def test_views_sharing_a_backend_keep_their_own_responses(self, mock_request):
+        default_cache.clear()
+        mock_request.side_effect = lambda uri, *args, **kwargs: create_send(cache_control='max-age=60',
+                                                                            content=uri)()
+        one = proxy('http://one.local', cache=True, cache_backend='default')
+        two = proxy('http://two.local', cache=True, cache_backend='default')
+
+        request = RequestFactory().get('/index.html')
+        contents = [view(request).content for view in (one, two, one, two)]
+
+        self.assertEqual(contents, ['http://one.local/index.html', 'http://two.local/index.html'] * 2)
+        self.assertEqual(mock_request.call_count, 2)
+
+
+class TestRevalidation(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(stale_while_revalidate=60, stale_if_error=60)
+
+    def test_not_modified_refreshes_entry(self):
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='no-cache', etag='"v1"'))
+        send = create_send(status=304, cache_control='max-age=60', etag='"v1"')
+
+        response, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_args[0][0]['If-None-Match'], '"v1"')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response['cache-control'], 'max-age=60')
+        self.assertEqual(content, 'Origin content')
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_if_modified_since(self):
+        last_modified = http_date(time.time() - 3600)
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='max-age=0, must-revalidate',
+                                                     last_modified=last_modified))
+        send = create_send(status=304)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_args[0][0]['If-Modified-Since'], last_modified)
+
+    def test_stale_while_revalidate(self):
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='max-age=60', age='90', etag='"v1"'))
+        send = create_send(status=304, cache_control='max-age=60')
+
+        response, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(content, 'Origin content')
+        self.assertEqual(response['warning'], '110 - "Response is Stale"')
+        for _ in range(100):
+            if self.cache.stats()['revalidations']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(send.call_count, 1)
+        response, content = self.cache.fetch('GET', URL, {}, send)
+        self.assertNotIn('warning', response)
+        self.assertEqual(send.call_count, 1)
+
+    def test_head_revalidation_does_not_store_its_body(self):
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='max-age=60', age='90'))
+        send = create_send(content='', cache_control='max-age=60', content_length='0')
+
+        self.cache.fetch('HEAD', URL, {}, send)
+        for _ in range(100):
+            if send.called and not self.cache._revalidating:    # pylint: disable=W0212
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(send.call_count, 1)
+        response, content = self.cache.fetch('GET', URL, {}, create_send(content='Fresh content'))
+        self.assertEqual(content, 'Origin content')
+        self.assertNotEqual(response.get('content-length'), '0')
+
+    def test_stale_if_error(self):
+        self.cache.stale_while_revalidate = 0
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='max-age=60', age='90'))
+
+        response, content = self.cache.fetch('GET', URL, {}, Mock(side_effect=socket.error('Connection refused')))
+        self.assertEqual(content, 'Origin content')
+        self.assertEqual(response['warning'], '111 - "Revalidation Failed"')
+
+        response, content = self.cache.fetch('GET', URL, {}, create_send(status=503, content='Down'))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, 'Origin content')
+
+    def test_must_revalidate_is_never_served_stale(self):
+        self.cache.fetch('GET', URL, {}, create_send(cache_control='max-age=60, must-revalidate', age='90'))
+        response, content = self.cache.fetch('GET', URL, {}, create_send(status=503, content='Down'))
+        self.assertEqual(response.status, 503)
+        self.assertEqual(content, 'Down')
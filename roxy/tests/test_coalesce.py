@@ -0,0 +1,120 @@
+import socket
+import threading
+import time
+
+from django.test import TestCase
+from httplib2 import Response
+
+from roxy.coalesce import Coalescer, CoalescingTimeout
+
+URL = u'https://localhost:8009/popular'
+
+
+class BlockingOrigin(object):
+    """
+    Origin that answers once released, counting the requests it gets
+    """
+
+    def __init__(self, content='Popular content', error=None, **headers):
+        self.release = threading.Event()
+        self.calls = 0
+        self.content = content
+        self.error = error
+        self.headers = headers
+
+    def __call__(self, headers):
+        self.calls += 1
+        self.release.wait(1)
+        if self.error is not None:
+            raise self.error
+        response = Response({'status': 200})
+        response.update(self.headers)
+        return response, self.content
+
+
+def run_concurrently(coalescer, origin, count, headers=None):
+    results = []
+
+    def fetch(request_headers):
+        try:
+            results.append(coalescer.fetch('GET', URL, request_headers, origin))
+        except Exception as error:
+            results.append(error)
+    threads = [threading.Thread(target=fetch, args=((headers or {}).get(i, {}),)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    origin.release.set()
+    for thread in threads:
+        thread.join(1)
+    return results
+
+
+class TestCoalescer(TestCase):
+
+    def test_collapses_identical_requests(self):
+        coalescer = Coalescer()
+        origin = BlockingOrigin()
+
+        results = run_concurrently(coalescer, origin, 5)
+
+        self.assertEqual(origin.calls, 1)
+        self.assertEqual([content for _, content in results], ['Popular content'] * 5)
+        self.assertEqual(coalescer.stats()['collapsed'], 4)
+        self.assertEqual(coalescer.stats()['in_flight'], 0)
+
+    def test_propagates_errors(self):
+        coalescer = Coalescer()
+        origin = BlockingOrigin(error=socket.error('Connection refused'))
+
+        results = run_concurrently(coalescer, origin, 3)
+
+        self.assertEqual(origin.calls, 1)
+        self.assertTrue(all(isinstance(result, socket.error) for result in results))
+        self.assertEqual(coalescer.stats()['errors'], 2)
+
+    def test_waiters_time_out(self):
+        coalescer = Coalescer(timeout=0.01)
+        origin = BlockingOrigin()
+
+        results = run_concurrently(coalescer, origin, 2)
+
+        self.assertEqual(len([result for result in results if isinstance(result, CoalescingTimeout)]), 1)
+        self.assertEqual(coalescer.stats()['timeouts'], 1)
+
+    def test_different_users_do_not_share(self):
+        coalescer = Coalescer()
+        origin = BlockingOrigin()
+
+        run_concurrently(coalescer, origin, 2, headers={0: {'Cookie': 'sessionid=a'}, 1: {'Cookie': 'sessionid=b'}})
+
+        self.assertEqual(origin.calls, 2)
+
+    def test_waiter_of_another_variant_sends_its_own_request(self):
+        coalescer = Coalescer()
+        origin = BlockingOrigin(vary='Accept-Language')
+
+        run_concurrently(coalescer, origin, 2, headers={0: {'Accept-Language': 'en'}, 1: {'Accept-Language': 'th'}})
+
+        self.assertEqual(origin.calls, 2)
+        self.assertEqual(coalescer.stats()['uncollapsed'], 1)
+
+    def test_personal_responses_are_not_shared(self):
+        for headers in ({'set-cookie': 'sessionid=1'}, {'cache-control': 'private'},
+                        {'cache-control': 'max-age=0, no-store'}):
+            coalescer = Coalescer()
+            origin = BlockingOrigin(**headers)
+
+            run_concurrently(coalescer, origin, 3)
+
+            self.assertEqual(origin.calls, 3)
+            self.assertEqual(coalescer.stats()['uncollapsed'], 2)
+
+    def test_unsafe_methods_are_not_collapsed(self):
+        coalescer = Coalescer()
+        origin = BlockingOrigin()
+        origin.release.set()
+        coalescer.fetch('POST', URL, {}, origin)
+        coalescer.fetch('POST', URL, {}, origin)
+        self.assertEqual(origin.calls, 2)
+        self.assertEqual(coalescer.stats()['flights'], 0)
@@ -0,0 +1,223 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from mock import patch
+
+from roxy.cache import CacheEntry, ResponseCache, parse_byte_range
+from roxy.disk import DiskBody, DiskStore
+from roxy.tests.test_cache import URL, create_send
+from roxy.views import proxy
+
+VIEW_DIR = tempfile.mkdtemp()
+
+urlpatterns = patterns('',
+    url(r'', proxy('https://localhost:8009', cache=True, cache_max_entry_size=10, cache_disk_dir=VIEW_DIR)),
+)
+
+LARGE = '0123456789' * 100
+
+
+def wait_for_revalidation(cache, send):
+    for _ in range(100):
+        if send.called and not cache._revalidating:    # pylint: disable=W0212
+            break
+        time.sleep(0.01)
+
+
+class TestDiskStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = DiskStore(self.directory, max_size=2500, max_entry_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store_entry(self, key, content):
+        self.store.set(key, CacheEntry({'status': '200'}, content, {}, 1, 2), 60)
+
+    def test_stores_bodies_in_files(self):
+        self.store_entry('a', LARGE)
+        entry = self.store.get('a', CacheEntry)
+
+        self.assertIsInstance(entry.content, DiskBody)
+        self.assertEqual(''.join(entry.content), LARGE)
+        self.assertEqual(entry.headers, {'status': '200'})
+        self.assertIsNone(self.store.get('b', CacheEntry))
+
+    def test_evicts_least_recently_used_by_size(self):
+        self.store_entry('a', LARGE)
+        self.store_entry('b', LARGE)
+        self.store.get('a', CacheEntry)
+        self.store_entry('c', LARGE)
+
+        self.assertIsNone(self.store.get('b', CacheEntry))
+        self.assertIsNotNone(self.store.get('a', CacheEntry))
+        self.assertEqual(self.store.stats(), {'disk_entries': 2, 'disk_size': 2000, 'disk_evictions': 1})
+
+    def test_rebuilds_index_on_restart(self):
+        self.store_entry('a', LARGE)
+        left_over = self.store.partial()
+        left_over.write('Left over')
+        os.utime(left_over.path, (0, 0))
+        being_written = self.store.partial()
+
+        store = DiskStore(self.directory)
+
+        self.assertEqual(''.join(store.get('a', CacheEntry).content), LARGE)
+        self.assertEqual(store.stats()['disk_size'], 1000)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertTrue(os.path.exists(being_written.path))
+
+    def test_slices_and_reads_body(self):
+        self.store_entry('a', LARGE)
+        body = self.store.get('a', CacheEntry).content.slice(5, 14)
+
+        self.assertEqual(len(body), 10)
+        self.assertEqual(body.read(4), '5678')
+        self.assertEqual(body.read(), '901234')
+        self.assertEqual(body.read(), '')
+
+
+class TestDiskTier(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResponseCache(max_entry_size=10, disk=DiskStore(self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_serves_large_response_from_disk(self):
+        send = create_send(content=LARGE, cache_control='max-age=60')
+        self.cache.fetch('GET', URL, {}, send)
+        response, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(''.join(content), LARGE)
+        self.assertEqual(response['content-length'], '1000')
+        self.assertEqual(self.cache.stats()['disk_entries'], 1)
+
+    def test_stores_streamed_response_once_relayed(self):
+        send = create_send(content=iter([LARGE[:500], LARGE[500:]]), cache_control='max-age=60')
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(''.join(content), LARGE)
+        _, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(''.join(content), LARGE)
+
+    def test_does_not_store_interrupted_stream(self):
+        send = create_send(content=iter([LARGE[:500], LARGE[500:]]), cache_control='max-age=60')
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        next(iter(content))
+        content.close()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 2)
+
+    def test_does_not_store_truncated_stream(self):
+        send = create_send(content=iter([LARGE[:400]]), cache_control='max-age=60', content_length='1000')
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(''.join(content), LARGE[:400])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 2)
+
+    def test_new_store_leaves_streams_being_written_alone(self):
+        send = create_send(content=iter([LARGE[:500], LARGE[500:]]), cache_control='max-age=60')
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        chunks = iter(content)
+        first = next(chunks)
+
+        DiskStore(self.directory)
+
+        self.assertEqual(first + ''.join(chunks), LARGE)
+        self.cache.fetch('GET', URL, {}, send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_write_failures_do_not_fail_responses(self):
+        send = create_send(content=iter([LARGE[:500], LARGE[500:]]), cache_control='max-age=60')
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        chunks = iter(content)
+        first = next(chunks)
+
+        shutil.rmtree(self.directory)
+
+        self.assertEqual(first + ''.join(chunks), LARGE)
+        send.return_value = send.return_value[0], iter([LARGE])
+        self.assertEqual(''.join(self.cache.fetch('GET', URL, {}, send)[1]), LARGE)
+        self.assertEqual(self.cache.stats()['disk_entries'], 0)
+
+    def test_background_revalidation_leaves_served_body_open(self):
+        self.cache.stale_while_revalidate = 60
+        self.cache.fetch('GET', URL, {}, create_send(content=LARGE, cache_control='max-age=60', age='90', etag='"v1"'))
+        send = create_send(status=304, cache_control='max-age=60')
+
+        _, content = self.cache.fetch('GET', URL, {}, send)
+        wait_for_revalidation(self.cache, send)
+
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+        self.assertEqual(''.join(content), LARGE)
+
+    def test_background_revalidation_stores_streamed_body(self):
+        self.cache.stale_while_revalidate = 60
+        self.cache.fetch('GET', URL, {}, create_send(content=LARGE, cache_control='max-age=60', age='90'))
+        send = create_send(content=iter(['Fresh content'] * 100), cache_control='max-age=60')
+
+        self.cache.fetch('GET', URL, {}, send)
+        wait_for_revalidation(self.cache, send)
+        response, content = self.cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertNotIn('warning', response)
+        self.assertEqual(''.join(content), 'Fresh content' * 100)
+
+    def test_serves_byte_ranges(self):
+        send = create_send(content=LARGE, cache_control='max-age=60', etag='"v1"')
+        self.cache.fetch('GET', URL, {}, send)
+
+        response, content = self.cache.fetch('GET', URL, {'Range': 'bytes=10-19'}, send)
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response['content-range'], 'bytes 10-19/1000')
+        self.assertEqual(''.join(content), '0123456789')
+
+        response, content = self.cache.fetch('GET', URL, {'Range': 'bytes=2000-'}, send)
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response['content-range'], 'bytes */1000')
+
+        response, content = self.cache.fetch('GET', URL, {'Range': 'bytes=0-0', 'If-Range': '"v0"'}, send)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(content), 1000)
+
+    def test_parse_byte_range(self):
+        self.assertEqual(parse_byte_range('bytes=0-499', 1000), (0, 499))
+        self.assertEqual(parse_byte_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_byte_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_byte_range('bytes=900-2000', 1000), (900, 999))
+        self.assertFalse(parse_byte_range('bytes=1000-', 1000))
+        self.assertIsNone(parse_byte_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_byte_range('items=0-1', 1000))
+
+
+@patch('httplib2.Http.request')
+class TestDiskCachedView(TestCase):
+    urls = 'roxy.tests.test_disk'
+
+    def test_serves_large_response_from_disk(self, mock_request):
+        mock_request.return_value = create_send(content=LARGE, cache_control='max-age=60').return_value
+
+        self.client.get('/large')
+        response = self.client.get('/large', HTTP_RANGE='bytes=-10')
+
+        self.assertEqual(mock_request.call_count, 1)
+        content = ''.join(response.streaming_content) if getattr(response, 'streaming', False) else response.content
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, '0123456789')
+        self.assertEqual(response['Content-Range'], 'bytes 990-999/1000')
@@ -0,0 +1,110 @@
+import gzip
+import zlib
+from StringIO import StringIO
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.encoding import Compressor, accepted_encodings
+from roxy.tests.test_streaming import create_mock_connection, create_raw_response
+from roxy.views import proxy
+
+urlpatterns = patterns('',
+    url(r'^relay/', proxy('https://localhost:8009', relay_encoded=True)),
+    url(r'^compress/', proxy('https://localhost:8009', compress=True)),
+)
+
+PAGE = '<html>%s</html>' % ('Compressible content. ' * 100)
+
+
+def gzipped(content):
+    compressed = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+    gzip_file.write(content)
+    gzip_file.close()
+    return compressed.getvalue()
+
+
+class TestAcceptedEncodings(TestCase):
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings(None), frozenset())
+        self.assertEqual(accepted_encodings('gzip, deflate, br'), frozenset(['gzip', 'deflate']))
+        self.assertEqual(accepted_encodings('x-gzip;q=0.5, deflate;q=0'), frozenset(['gzip']))
+        self.assertEqual(accepted_encodings('*, gzip;q=0'), frozenset(['deflate']))
+
+
+class TestCompressor(TestCase):
+
+    def setUp(self):
+        self.compressor = Compressor(min_size=100)
+        self.response = Response({'status': 200, 'content-type': 'text/html; charset=utf-8'})
+
+    def test_compresses_accepted_text(self):
+        response, content = self.compressor.compress('GET', {'Accept-Encoding': 'gzip'}, self.response, PAGE)
+        self.assertEqual(response['content-encoding'], 'gzip')
+        self.assertEqual(response['vary'], 'Accept-Encoding')
+        self.assertEqual(zlib.decompress(content, 16 + zlib.MAX_WBITS), PAGE)
+        self.assertNotIn('content-encoding', self.response)
+
+    def test_weakens_etag_and_drops_ranges(self):
+        self.response.update({'etag': '"v1"', 'accept-ranges': 'bytes'})
+        for content in (PAGE, iter([PAGE])):
+            response, _ = self.compressor.compress('GET', {'Accept-Encoding': 'gzip'}, self.response, content)
+
+            self.assertEqual(response['etag'], 'W/"v1"')
+            self.assertNotIn('accept-ranges', response)
+        self.assertEqual(self.response['etag'], '"v1"')
+
+    def test_compresses_streamed_body(self):
+        _, content = self.compressor.compress('GET', {'Accept-Encoding': 'gzip'}, self.response, iter([PAGE, PAGE]))
+        self.assertEqual(zlib.decompress(''.join(content), 16 + zlib.MAX_WBITS), PAGE * 2)
+
+    def test_leaves_others_alone(self):
+        for method, headers, content_type, content in (
+                ('GET', {}, 'text/html', PAGE),
+                ('HEAD', {'Accept-Encoding': 'gzip'}, 'text/html', PAGE),
+                ('GET', {'Accept-Encoding': 'gzip'}, 'image/png', PAGE),
+                ('GET', {'Accept-Encoding': 'gzip'}, 'text/html', 'Too small')):
+            self.response['content-type'] = content_type
+            self.assertEqual(self.compressor.compress(method, headers, self.response, content),
+                             (self.response, content))
+
+
+@patch('roxy.streaming._connection')
+class TestRelayEncoded(TestCase):
+    urls = 'roxy.tests.test_encoding'
+
+    def test_relays_compressed_body(self, mock_connection):
+        mock_connection.return_value = create_mock_connection(
+            create_raw_response(gzipped(PAGE), Content_Encoding='gzip', Content_Type='text/html'))
+
+        response = self.client.get('/relay/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response.content, gzipped(PAGE))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_decompresses_for_other_clients(self, mock_connection):
+        mock_connection.return_value = create_mock_connection(
+            create_raw_response(gzipped(PAGE), Content_Encoding='gzip', Content_Type='text/html'))
+
+        response = self.client.get('/relay/', HTTP_ACCEPT_ENCODING='br')
+
+        self.assertEqual(response.content, PAGE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@patch('httplib2.Http.request')
+class TestCompressingView(TestCase):
+    urls = 'roxy.tests.test_encoding'
+
+    def test_compresses_response(self, mock_request):
+        mock_request.return_value = Response({'status': 200, 'content-type': 'text/html'}), PAGE
+
+        response = self.client.get('/compress/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), PAGE)
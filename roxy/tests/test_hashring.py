@@ -0,0 +1,84 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from django.test.client import RequestFactory
+from httplib2 import Response
+from mock import patch
+
+from roxy.balancer import Origin
+from roxy.hashring import HashRing, request_key
+from roxy.pool import ConnectionPool
+from roxy.views import proxy
+
+urlpatterns = patterns('',
+    url(r'', proxy(['https://one.localhost:8009', 'https://two.localhost:8010', 'https://three.localhost:8011'],
+                   balance='consistent_hash', hash_key='cookie:user')),
+)
+
+KEYS = ['/places/%d' % i for i in range(5000)]
+
+
+def create_origins(count):
+    return [Origin('origin%d:80' % i, 1, ConnectionPool()) for i in range(count)]
+
+
+class TestHashRing(TestCase):
+
+    def test_spreads_keys_and_remaps_few(self):
+        origins = create_origins(5)
+        before = HashRing(origins[:4])
+        after = HashRing(origins)
+
+        chosen = dict((key, before.choose(key, origins[:4])) for key in KEYS)
+        moved = [key for key in KEYS if after.choose(key, origins) is not chosen[key]]
+
+        for origin in origins[:4]:
+            self.assertTrue(0.15 < chosen.values().count(origin) / 5000.0 < 0.35)
+        self.assertTrue(0.1 < len(moved) / 5000.0 < 0.3)
+        self.assertEqual(set(after.choose(key, origins) for key in moved), set([origins[4]]))
+
+    def test_unavailable_origin_moves_its_keys_only(self):
+        origins = create_origins(3)
+        ring = HashRing(origins)
+
+        moved = [key for key in KEYS if ring.choose(key, origins) is not ring.choose(key, origins[1:])]
+
+        self.assertEqual(set(ring.choose(key, origins) for key in moved), set([origins[0]]))
+
+    def test_bounds_load(self):
+        origins = create_origins(2)
+        ring = HashRing(origins, load_factor=1.25)
+        key = KEYS[0]
+        home = ring.choose(key, origins)
+        busy = [home.pool.acquire() for _ in range(4)]
+
+        self.assertIsNot(ring.choose(key, origins), home)
+        for http in busy:
+            home.pool.release(http)
+        self.assertIs(ring.choose(key, origins), home)
+
+    def test_request_key(self):
+        request = RequestFactory().get('/places/1', {'user': '7'}, HTTP_X_USER='42')
+        request.COOKIES['user'] = '9'
+
+        self.assertEqual(request_key('path')(request), '/places/1')
+        self.assertEqual(request_key('header:X-User')(request), '42')
+        self.assertEqual(request_key('cookie:user')(request), '9')
+        self.assertEqual(request_key('query:user')(request), '7')
+        self.assertEqual(request_key('query:other')(request), '/places/1')
+        self.assertRaises(ValueError, request_key, 'body')
+
+
+@patch('httplib2.Http.request')
+class TestHashedView(TestCase):
+    urls = 'roxy.tests.test_hashring'
+
+    def test_sends_same_key_to_same_origin(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'OK'
+
+        for path in ('/a', '/b', '/c'):
+            self.client.cookies['user'] = 'ann'
+            self.client.get(path, HTTP_HOST='testserver')
+
+        hosts = set(call[0][0].split('/')[2] for call in mock_request.call_args_list)
+        self.assertEqual(len(hosts), 1)
+        self.assertEqual(mock_request.call_args[1]['headers']['Host'], hosts.pop())
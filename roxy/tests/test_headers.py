@@ -0,0 +1,55 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.headers import HeaderRules, RequestHeaders, ResponseHeaders
+from roxy.views import proxy
+
+urlpatterns = patterns('',
+    url(r'', proxy('http://one.localhost:8009',
+                   request_headers={'remove': ['Cookie'], 'override': {'X-Forwarded-Proto': 'https'}},
+                   response_headers=HeaderRules(rename={'X-Powered-By': 'X-Origin'}, add={'X-Frame-Options': 'DENY'}))),
+)
+
+
+class TestHeaderPipelines(TestCase):
+
+    def test_request_headers_from_meta(self):
+        pipeline = RequestHeaders()
+        meta = {'HTTP_ACCEPT_LANGUAGE': 'th', 'HTTP_CONNECTION': 'close', 'CONTENT_TYPE': 'text/plain',
+                'CONTENT_LENGTH': '', 'REMOTE_ADDR': '127.0.0.1'}
+        for _ in range(2):
+            self.assertEqual(pipeline.translate(meta), {'Accept-Language': 'th', 'Content-Type': 'text/plain'})
+
+    def test_request_rules(self):
+        pipeline = RequestHeaders({'remove': ['cookie'], 'rename': {'X-Token': 'Authorization'},
+                                   'add': {'Accept': '*/*', 'User-Agent': 'roxy'}, 'override': {'Via': 'roxy'}})
+        meta = {'HTTP_COOKIE': 'a=b', 'HTTP_X_TOKEN': 'secret', 'HTTP_ACCEPT': 'text/html', 'HTTP_VIA': 'other'}
+        self.assertEqual(pipeline.translate(meta), {
+            'Authorization': 'secret', 'Accept': 'text/html', 'User-Agent': 'roxy', 'Via': 'roxy'})
+
+    def test_response_rules(self):
+        pipeline = ResponseHeaders({'remove': ['Server'], 'override': {'X-Frame-Options': 'DENY'}})
+        origin_response = Response({'status': 200, 'server': 'Apache', 'x-frame-options': 'ALLOW',
+                                    'transfer-encoding': 'chunked', 'etag': '"1"'})
+        self.assertEqual(pipeline.translate(origin_response), {'etag': '"1"', 'X-Frame-Options': 'DENY'})
+
+
+@patch('httplib2.Http.request')
+class TestHeaderRulesView(TestCase):
+    urls = 'roxy.tests.test_headers'
+
+    def test_rules_apply_both_ways(self, mock_request):
+        origin_response = Response({'status': 200})
+        origin_response['x-powered-by'] = 'PHP'
+        mock_request.return_value = origin_response, 'OK'
+
+        response = self.client.get('/', HTTP_COOKIE='sessionid=1', HTTP_X_FORWARDED_PROTO='http')
+
+        headers = mock_request.call_args[1]['headers']
+        self.assertNotIn('Cookie', headers)
+        self.assertEqual(headers['X-Forwarded-Proto'], 'https')
+        self.assertEqual(response['X-Origin'], 'PHP')
+        self.assertFalse(response.has_header('X-Powered-By'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
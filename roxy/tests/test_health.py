@@ -0,0 +1,131 @@
+import socket
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.balancer import Balancer, Origin
+from roxy.health import CircuitBreaker, CircuitOpen, CLOSED, HALF_OPEN, OPEN
+from roxy.pool import ConnectionPool
+from roxy.signals import circuit_state_changed
+from roxy.views import proxy
+
+single_origin = proxy('http://one.localhost:8009', circuit_breaker=True, circuit_breaker_threshold=2)
+two_origins = proxy(['http://one.localhost:8009', 'http://two.localhost:8010'], circuit_breaker=True,
+                    circuit_breaker_threshold=1)
+
+urlpatterns = patterns('',
+    url(r'^single/', single_origin),
+    url(r'^two/', two_origins),
+)
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.changes = []
+        circuit_state_changed.connect(self.record_change)
+
+    def tearDown(self):
+        circuit_state_changed.disconnect(self.record_change)
+
+    def record_change(self, sender, breaker, old_state, new_state, **kwargs):
+        self.changes.append((breaker.name, old_state, new_state))
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('origin', threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.acquire())
+        self.assertTrue(0 < breaker.retry_after() <= 30)
+        self.assertEqual(self.changes, [('origin', CLOSED, OPEN)])
+
+    def test_half_open_probe_closes_circuit(self):
+        breaker = CircuitBreaker('origin', threshold=1, reset_timeout=0)
+        breaker.failure()
+        self.assertTrue(breaker.acquire())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.acquire())
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(self.changes, [('origin', CLOSED, OPEN), ('origin', OPEN, HALF_OPEN),
+                                        ('origin', HALF_OPEN, CLOSED)])
+        self.assertEqual([transition[1:] for transition in breaker.stats()['transitions']],
+                         [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_failed_probe_opens_circuit_again(self):
+        breaker = CircuitBreaker('origin', threshold=3, reset_timeout=0)
+        for _ in range(3):
+            breaker.failure()
+        breaker.acquire()
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_balancer_skips_open_origins(self):
+        balancer = Balancer([Origin('origin%d:80' % i, 1, ConnectionPool(), CircuitBreaker('origin%d' % i, 1))
+                             for i in range(2)])
+        balancer.record(balancer.origins[0], 0.1, failed=True)
+        self.assertEqual([balancer.choose().server for _ in range(3)], ['origin1:80'] * 3)
+        balancer.record(balancer.origins[1], 0.1, failed=True)
+        self.assertRaises(CircuitOpen, balancer.choose)
+        self.assertEqual(balancer.stats()['origins'][0]['breaker']['state'], OPEN)
+
+
+@patch('httplib2.Http.request')
+class TestCircuitBreakingView(TestCase):
+    urls = 'roxy.tests.test_health'
+
+    def setUp(self):
+        for view in (single_origin, two_origins):
+            for origin in view.balancer.origins:
+                origin.breaker.success()
+
+    def test_fails_fast_when_circuit_is_open(self, mock_request):
+        mock_request.side_effect = socket.error('Connection refused')
+
+        for _ in range(2):
+            self.assertRaises(socket.error, self.client.get, '/single/')
+        response = self.client.get('/single/')
+
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(0 < int(response['Retry-After']) <= 30)
+
+    def test_probe_failing_on_the_client_side_is_given_back(self, mock_request):
+        breaker = single_origin.balancer.origins[0].breaker
+        for _ in range(2):
+            breaker.failure()
+        mock_request.side_effect = IOError('Client went away during the upload')
+
+        with patch.object(breaker, 'reset_timeout', 0):
+            self.assertRaises(IOError, self.client.get, '/single/')
+            mock_request.side_effect = None
+            mock_request.return_value = Response({'status': 200}), 'OK'
+            response = self.client.get('/single/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failure_statuses_count(self, mock_request):
+        mock_request.return_value = Response({'status': 502}), 'Bad Gateway'
+
+        for _ in range(3):
+            self.client.get('/single/')
+
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_routes_to_healthy_origin(self, mock_request):
+        mock_request.return_value = Response({'status': 503}), 'Down'
+        self.client.get('/two/')
+        failed = mock_request.call_args[0][0]
+        mock_request.return_value = Response({'status': 200}), 'OK'
+
+        for _ in range(3):
+            self.assertEqual(self.client.get('/two/').status_code, 200)
+
+        self.assertNotIn(failed, [call[0][0] for call in mock_request.call_args_list[1:]])
@@ -0,0 +1,201 @@
+import gzip
+import socket
+import threading
+from StringIO import StringIO
+from unittest import skipIf
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+except ImportError:
+    h2 = None
+
+from roxy.http2 import Http2Transport, StreamReset
+from roxy.views import proxy
+
+BIG = 'x' * 200000
+PAGE = 'Compressible content. ' * 100
+
+
+class H2Origin(object):
+    """
+    Local HTTP/2 origin, spoken to with prior knowledge
+    """
+
+    def __init__(self, gather=5):
+        self.gather = gather
+        self.received = []
+        self._listener = socket.socket()
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(5)
+        self.port = self._listener.getsockname()[1]
+        self._start(self._accept)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            sock, _ = self._listener.accept()
+            self._start(self._serve, sock)
+
+    def _serve(self, sock):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding=None))
+        conn.initiate_connection()
+        requests, pending, gathered = {}, {}, []
+        while True:
+            sock.sendall(conn.data_to_send())
+            data = sock.recv(65535)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = [event.headers, '']
+                    self.received.append(event.headers)
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1] += event.data
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    self._answer(conn, event.stream_id, requests.pop(event.stream_id), pending, gathered)
+            _send_pending(conn, pending)
+
+    def _answer(self, conn, stream_id, request, pending, gathered):    # pylint: disable=R0913
+        headers, body = request
+        fields = dict(headers)
+        path = fields[':path']
+        if path == '/reset':
+            conn.reset_stream(stream_id, h2.errors.ErrorCodes.INTERNAL_ERROR)
+            return
+        if path == '/gather':
+            # Only answered once enough requests are open at the same time
+            gathered.append(stream_id)
+            if len(gathered) < self.gather:
+                return
+            for gathered_id in gathered:
+                conn.send_headers(gathered_id, [(':status', '200')])
+                pending[gathered_id] = 'Gathered'
+            return
+        response = [(':status', '200'), ('x-method', fields[':method'])]
+        if path == '/big':
+            body = BIG
+        elif path == '/gzip':
+            compressed = StringIO()
+            gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+            gzip_file.write(PAGE)
+            gzip_file.close()
+            body = compressed.getvalue()
+            response.append(('content-encoding', 'gzip'))
+        conn.send_headers(stream_id, response)
+        pending[stream_id] = body
+
+
+def _send_pending(conn, pending):
+    for stream_id, data in pending.items():
+        while data:
+            window = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)
+            if window <= 0:
+                break
+            conn.send_data(stream_id, data[:window])
+            data = data[window:]
+        if data:
+            pending[stream_id] = data
+        else:
+            conn.end_stream(stream_id)
+            del pending[stream_id]
+
+
+origin = H2Origin() if h2 is not None else None
+
+urlpatterns = patterns('',
+    url(r'', proxy('http://127.0.0.1:%d' % origin.port, transport='http2') if origin else proxy('localhost:1')),
+)
+
+
+@skipIf(h2 is None, 'h2 is not installed')
+class TestHttp2Transport(TestCase):
+
+    def setUp(self):
+        self.pool = Http2Transport(max_connections=1, http_kwargs={'timeout': 5})
+        self.url = 'http://127.0.0.1:%d' % origin.port
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_multiplexes_requests_over_one_connection(self):
+        results = []
+
+        def send():
+            results.append(self.pool.send(self.url + '/gather', 'GET', '', {})[1])
+        threads = [threading.Thread(target=send) for _ in range(origin.gather)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ['Gathered'] * origin.gather)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['connections'], stats['streams'], stats['in_use']),
+                         (1, 1, origin.gather, 0))
+
+    def test_flow_control_both_ways(self):
+        response, content = self.pool.send(self.url + '/echo', 'PUT', BIG, {})
+        self.assertEqual(response['x-method'], 'PUT')
+        self.assertEqual(content, BIG)
+
+        self.assertEqual(self.pool.send(self.url + '/big', 'GET', StringIO(BIG), {})[1], BIG)
+
+    def test_unread_stream_does_not_stall_the_others(self):
+        _, unread = self.pool.send(self.url + '/big', 'GET', '', {}, chunk_size=1024)
+        try:
+            self.assertEqual(self.pool.send(self.url + '/echo', 'POST', 'Not stalled', {})[1], 'Not stalled')
+        finally:
+            unread.close()
+
+    def test_stream_reset_leaves_connection_usable(self):
+        self.assertRaises(StreamReset, self.pool.send, self.url + '/reset', 'GET', '', {})
+
+        self.assertEqual(self.pool.send(self.url + '/echo', 'POST', 'Still there', {})[1], 'Still there')
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['resets'], stats['in_use']), (1, 1, 0))
+
+    def test_headers_are_not_normalized(self):
+        self.pool.send(self.url + '/echo', 'GET', '', {'X-List': 'a,  b', 'Cookie': 'a=1; b=2', 'Connection': 'close',
+                                                       'Host': 'example.com'})
+
+        fields = origin.received[-1]
+        self.assertIn(('x-list', 'a,  b'), fields)
+        self.assertIn(('cookie', 'a=1; b=2'), fields)
+        self.assertIn((':authority', '127.0.0.1:%d' % origin.port), fields)
+        self.assertNotIn('connection', dict(fields))
+
+    def test_streams_and_decodes_body(self):
+        response, content = self.pool.send(self.url + '/gzip', 'GET', '', {}, chunk_size=1024)
+
+        self.assertNotIn('content-encoding', response)
+        self.assertEqual(''.join(content), PAGE)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_relays_kept_encoding(self):
+        response, _ = self.pool.send(self.url + '/gzip', 'GET', '', {}, keep_encodings=frozenset(['gzip']))
+
+        self.assertEqual(response['content-encoding'], 'gzip')
+        self.assertEqual(response['vary'], 'Accept-Encoding')
+
+
+@skipIf(h2 is None, 'h2 is not installed')
+class TestHttp2View(TestCase):
+    urls = 'roxy.tests.test_http2'
+
+    def test_proxies_over_http2(self):
+        response = self.client.post('/echo', 'Over HTTP/2', content_type='text/plain')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'Over HTTP/2')
+        self.assertEqual(response['X-Method'], 'POST')
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.limit import ConcurrencyLimiter, OriginOverloaded
+from roxy.views import proxy
+
+limited = proxy('http://one.localhost:8009', max_in_flight=1, max_in_flight_queue=1,
+                max_in_flight_queue_timeout=0.05)
+
+urlpatterns = patterns('',
+    url(r'', limited),
+)
+
+
+class TestConcurrencyLimiter(TestCase):
+
+    def test_rejects_when_queue_is_full(self):
+        limiter = ConcurrencyLimiter(1)
+        limiter.acquire()
+        try:
+            limiter.acquire()
+        except OriginOverloaded as error:
+            self.assertEqual(error.retry_after, 1)
+        else:
+            self.fail('second request was not rejected')
+        limiter.release()
+        limiter.acquire()
+        self.assertEqual(limiter.stats(), {'admitted': 2, 'queued': 0, 'rejected': 1, 'timeouts': 0,
+                                           'in_flight': 1, 'queue_depth': 0, 'max_in_flight': 1})
+
+    def test_queued_request_gets_released_slot(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=1)
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(limiter.stats()['queue_depth'], 1)
+        self.assertRaises(OriginOverloaded, limiter.acquire)
+        limiter.release()
+        waiter.join(1)
+        self.assertEqual(limiter.stats()['in_flight'], 1)
+        self.assertEqual(limiter.stats()['queue_depth'], 0)
+
+    def test_queue_timeout(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=0.01)
+        limiter.acquire()
+        self.assertRaises(OriginOverloaded, limiter.acquire)
+        self.assertEqual(limiter.stats()['timeouts'], 1)
+
+    def test_streamed_body_holds_slot_until_read(self):
+        limiter = ConcurrencyLimiter(1)
+        limiter.acquire()
+        body = limiter.limit(iter(['chunk', 'chunk']))
+        self.assertEqual(limiter.stats()['in_flight'], 1)
+        self.assertEqual(''.join(body), 'chunkchunk')
+        self.assertEqual(limiter.stats()['in_flight'], 0)
+
+
+@patch('httplib2.Http.request')
+class TestLimitedView(TestCase):
+    urls = 'roxy.tests.test_limit'
+
+    def test_sheds_load_with_503(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'OK'
+        limiter = limited.balancer.origins[0].limiter
+        limiter.acquire()
+        try:
+            response = self.client.get('/some/path')
+        finally:
+            limiter.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(mock_request.called)
+        self.assertEqual(limited.balancer.stats()['origins'][0]['limiter']['timeouts'], 1)
+        self.assertEqual(self.client.get('/some/path').status_code, 200)
+        self.assertEqual(limiter.stats()['in_flight'], 0)
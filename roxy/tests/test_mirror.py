@@ -0,0 +1,110 @@
+import threading
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import Mock, patch
+
+from roxy.mirror import Mirror
+from roxy.views import proxy
+
+mirrored_view = proxy('https://localhost:8009', mirror='http://shadow.local:8010', rewrite={'strip_prefix': '/api'})
+
+urlpatterns = patterns('',
+    url(r'', mirrored_view),
+)
+
+
+def wait_for(mirror, name, count):
+    deadline = time.time() + 2
+    while mirror.stats()[name] < count and time.time() < deadline:
+        time.sleep(0.01)
+    return mirror.stats()
+
+
+@patch('httplib2.Http.request')
+class TestMirror(TestCase):
+
+    def test_sends_copies_and_counts_responses(self, mock_request):
+        mock_request.return_value = Response({'status': 201}), 'Shadow content'
+        mirror = Mirror('http://shadow.local')
+
+        mirror.copy('POST', 'https', '/places?a=1', 'name=Ann', {'Host': 'example.com', 'Accept': 'text/plain'})
+
+        stats = wait_for(mirror, 'responses', 1)
+        self.assertEqual(stats['mirrored'], 1)
+        self.assertEqual(stats['statuses'], {201: 1})
+        mock_request.assert_called_once_with('http://shadow.local/places?a=1', 'POST', body='name=Ann',
+                                             headers={'Host': 'shadow.local', 'Accept': 'text/plain'})
+
+    def test_drops_copies_when_queue_is_full(self, mock_request):
+        sending = threading.Event()
+        release = threading.Event()
+
+        def blocked(*args, **kwargs):
+            sending.set()
+            release.wait(2)
+            return Response({'status': 200}), ''
+        mock_request.side_effect = blocked
+        mirror = Mirror('http://shadow.local', workers=1, queue_size=1)
+
+        mirror.copy('GET', 'http', '/1', '', {})
+        sending.wait(2)
+        mirror.copy('GET', 'http', '/2', '', {})
+        mirror.copy('GET', 'http', '/3', '', {})
+        release.set()
+
+        stats = wait_for(mirror, 'responses', 2)
+        self.assertEqual((stats['mirrored'], stats['dropped'], stats['responses']), (2, 1, 2))
+
+    def test_workers_outlive_any_error(self, mock_request):
+        transport = Mock()
+        transport.send.side_effect = [ValueError('Not an upstream error'), (Response({'status': 200}), '')]
+        mirror = Mirror('http://shadow.local', workers=1, transport=transport)
+
+        mirror.copy('GET', 'http', '/1', '', {})
+        mirror.copy('GET', 'http', '/2', '', {})
+
+        stats = wait_for(mirror, 'responses', 1)
+        self.assertEqual((stats['errors'], stats['responses']), (1, 1))
+
+    def test_close_stops_workers(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), ''
+        mirror = Mirror('http://shadow.local')
+        mirror.copy('GET', 'http', '/', '', {})
+        wait_for(mirror, 'responses', 1)
+        threads = list(mirror._threads)    # pylint: disable=W0212
+
+        mirror.close()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        mirror.copy('GET', 'http', '/', '', {})
+        self.assertEqual(mirror.stats()['mirrored'], 1)
+
+    def test_samples_and_skips_unbuffered_bodies(self, mock_request):
+        mirror = Mirror('http://shadow.local', sample=0)
+        mirror.copy('GET', 'http', '/', '', {})
+        mirror.sample = 1
+        mirror.copy('POST', 'http', '/', open(__file__), {})
+
+        self.assertEqual(mirror.stats()['mirrored'], 0)
+        self.assertEqual(mirror.stats()['unbuffered'], 1)
+        self.assertFalse(mock_request.called)
+
+
+@patch('httplib2.Http.request')
+class TestMirroredView(TestCase):
+    urls = 'roxy.tests.test_mirror'
+
+    def test_mirrors_rewritten_request(self, mock_request):
+        mock_request.return_value = Response({'status': 200, 'content-type': 'text/plain'}), 'Content'
+
+        response = self.client.get('/api/places', HTTP_X_TRACE='1')
+
+        self.assertEqual(response.content, 'Content')
+        wait_for(mirrored_view.mirror, 'responses', 1)
+        urls = sorted(call[0][0] for call in mock_request.call_args_list)
+        self.assertEqual(urls, ['http://shadow.local:8010/places', 'https://localhost:8009/places'])
@@ -0,0 +1,96 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import Mock, patch
+
+from roxy.negative import NegativeCache
+from roxy.views import proxy
+
+negative_view = proxy('https://localhost:8009', negative_cache=True, negative_cache_ttls={404: 60})
+
+urlpatterns = patterns('',
+    url(r'', negative_view),
+)
+
+URL = '/places/missing'
+
+
+def not_found(content='Not Found', **headers):
+    headers['status'] = 404
+    return Response(headers), content
+
+
+class TestNegativeCache(TestCase):
+
+    def test_serves_errors_again(self):
+        cache = NegativeCache()
+        send = Mock(return_value=not_found())
+
+        first = cache.fetch('GET', URL, {}, send)
+        second = cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual((second[0].status, second[1]), (404, 'Not Found'))
+        self.assertIsNot(second[0], first[0])
+        stats = cache.stats()
+        self.assertEqual((stats['suppressed'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_keeps_statuses_for_their_ttl(self):
+        cache = NegativeCache({404: 10, 503: 1})
+        send = Mock(side_effect=[(Response({'status': 503}), 'Down'), (Response({'status': 200}), 'Up'),
+                                 (Response({'status': 200}), 'Up')])
+
+        with patch('time.time', return_value=100):
+            cache.fetch('GET', URL, {}, send)
+            cache.fetch('GET', URL, {}, send)
+        with patch('time.time', return_value=101):
+            self.assertEqual(cache.fetch('GET', URL, {}, send)[1], 'Up')
+            cache.fetch('GET', URL, {}, send)
+
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual((cache.stats()['expired'], cache.stats()['entries']), (1, 0))
+
+    def test_does_not_keep_others(self):
+        cache = NegativeCache()
+        for method, result in (('GET', not_found(iter(['Streamed']))),
+                               ('GET', not_found(**{'cache-control': 'no-store'})),
+                               ('POST', not_found()),
+                               ('GET', (Response({'status': 403}), 'Forbidden'))):
+            cache.fetch(method, URL, {}, Mock(return_value=result))
+
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_requests_of_other_users_are_not_identical(self):
+        cache = NegativeCache()
+        send = Mock(return_value=not_found())
+
+        cache.fetch('GET', URL, {'Cookie': 'user=ann'}, send)
+        cache.fetch('GET', URL, {'Cookie': 'user=bob'}, send)
+        cache.fetch('HEAD', URL, {'Cookie': 'user=bob'}, send)
+
+        self.assertEqual(send.call_count, 3)
+
+    def test_bounded_and_invalidated(self):
+        cache = NegativeCache(max_entries=2)
+        for path in ('/a', '/b', '/a', '/c'):
+            cache.fetch('GET', path, {}, Mock(return_value=not_found()))
+        self.assertEqual((cache.stats()['entries'], cache.stats()['evictions']), (2, 1))
+
+        cache.fetch('PUT', '/a', {}, Mock(return_value=(Response({'status': 201}), 'Created')))
+        send = Mock(return_value=(Response({'status': 200}), 'Found'))
+        self.assertEqual(cache.fetch('GET', '/a', {}, send)[1], 'Found')
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+@patch('httplib2.Http.request')
+class TestNegativelyCachedView(TestCase):
+    urls = 'roxy.tests.test_negative'
+
+    def test_suppresses_repeated_requests(self, mock_request):
+        mock_request.return_value = not_found()
+
+        responses = [self.client.get('/gone/%d' % (i % 2)) for i in range(4)]
+
+        self.assertEqual([response.status_code for response in responses], [404] * 4)
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(negative_view.negative_cache.stats()['suppressed'], 2)
@@ -0,0 +1,95 @@
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import Mock, patch
+
+from roxy.pool import ConnectionPool
+from roxy.views import proxy
+
+
+pooled_view = proxy('https://localhost:8009', pool_size=2)
+
+urlpatterns = patterns('',
+    url(r'', pooled_view),
+)
+
+
+class TestConnectionPool(TestCase):
+
+    def test_reuses_released_instance(self):
+        pool = ConnectionPool(size=2)
+        with pool.connection() as http:
+            first = http
+        with pool.connection() as http:
+            self.assertIs(first, http)
+        self.assertEqual(pool.stats()['created'], 1)
+        self.assertEqual(pool.stats()['idle'], 1)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_does_not_follow_redirects(self):
+        pool = ConnectionPool()
+        with pool.connection() as http:
+            self.assertFalse(http.follow_redirects)
+
+    def test_passes_constructor_kwargs(self):
+        pool = ConnectionPool(http_kwargs={'disable_ssl_certificate_validation': True})
+        with pool.connection() as http:
+            self.assertTrue(http.disable_ssl_certificate_validation)
+
+    def test_overflows_when_exhausted(self):
+        pool = ConnectionPool(size=1)
+        http = pool.acquire()
+        overflow = pool.acquire()
+        self.assertIsNot(overflow, http)
+        self.assertEqual(pool.stats()['overflows'], 1)
+
+        pool.release(overflow)
+        pool.release(http)
+        with pool.connection() as reused:
+            self.assertIs(reused, http)
+        self.assertEqual(pool.stats()['created'], 1)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_expires_idle_instances(self):
+        pool = ConnectionPool(size=1, idle_timeout=0)
+        http = pool.acquire()
+        connection = Mock(sock=None)
+        http.connections['https:localhost:8009'] = connection
+        pool.release(http)
+        time.sleep(0.01)
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, http)
+        connection.close.assert_called_with()
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_closes_connections_of_broken_instance(self):
+        pool = ConnectionPool()
+        connection = Mock(sock=None)
+        try:
+            with pool.connection() as http:
+                http.connections['https:localhost:8009'] = connection
+                raise IOError('connection reset')
+        except IOError:
+            pass
+        connection.close.assert_called_with()
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+
+@patch('httplib2.Http.request')
+class TestPooledView(TestCase):
+    urls = 'roxy.tests.test_pool'
+
+    def test_view_reuses_pool(self, mock_request):
+        mock_request.return_value = Response({'status': 200, 'content-type': 'text/plain'}), 'OK'
+
+        self.client.get('/one')
+        self.client.get('/two')
+
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(pooled_view.pool.stats()['created'], 1)
+        self.assertEqual(pooled_view.pool.stats()['size'], 2)
+
+    def test_unknown_option(self, mock_request):
+        self.assertRaises(TypeError, proxy, 'https://localhost:8009', pool_sise=2)
@@ -0,0 +1,77 @@
+from django.conf.urls.defaults import patterns, url
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from httplib2 import Response
+from mock import patch
+
+from roxy.ratelimit import SharedTokenBuckets, TokenBuckets
+from roxy.views import proxy
+
+limited_view = proxy('https://localhost:8009', rate_limit=1, rate_limit_burst=2, rate_limit_key='header:X-Api-Key')
+
+urlpatterns = patterns('',
+    url(r'', limited_view),
+)
+
+
+class TestTokenBuckets(TestCase):
+
+    def test_burst_then_rate(self):
+        buckets = TokenBuckets(rate=2, burst=3)
+
+        self.assertEqual([buckets.take('ann', now=0)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(buckets.take('ann', now=0), (False, 0, 0.5))
+        self.assertEqual(buckets.take('bob', now=0)[0], True)
+        self.assertEqual(buckets.take('ann', now=0.5), (True, 0, 0))
+        self.assertEqual(buckets.take('ann', now=100), (True, 2, 0))
+        stats = buckets.stats()
+        self.assertEqual((stats['allowed'], stats['limited'], stats['clients']), (6, 2, 2))
+
+    def test_forgets_least_recently_used_clients(self):
+        buckets = TokenBuckets(rate=1, burst=1, max_clients=2, shards=1)
+        for key in ('ann', 'bob', 'ann', 'cat'):
+            buckets.take(key, now=0)
+
+        self.assertEqual(buckets.stats()['evictions'], 1)
+        self.assertEqual(buckets.take('ann', now=0)[0], False)
+        self.assertEqual(buckets.take('bob', now=0)[0], True)
+
+    def test_shared_windows(self):
+        cache.clear()
+        one, two = SharedTokenBuckets(cache, rate=1, burst=2), SharedTokenBuckets(cache, rate=1, burst=2)
+
+        self.assertEqual(one.take('ann', now=10.5), (True, 1, 0))
+        self.assertEqual(two.take('ann', now=10.5), (True, 0, 0))
+        self.assertEqual(one.take('ann', now=11), (False, 0, 1))
+        self.assertEqual(two.take('ann', now=12)[0], True)
+        self.assertEqual(one.stats(), {'allowed': 1, 'limited': 1})
+
+    def test_views_sharing_a_backend_count_apart(self):
+        cache.clear()
+        one = proxy('http://one.local', rate_limit=1, rate_limit_burst=2, rate_limit_backend='default')
+        two = proxy('http://two.local', rate_limit=1, rate_limit_burst=2, rate_limit_backend='default')
+        request = RequestFactory().get('/places')
+
+        self.assertEqual([one.rate_limiter.check(request) for _ in range(2)], [None, None])
+        self.assertEqual([two.rate_limiter.check(request) for _ in range(2)], [None, None])
+        self.assertEqual(one.rate_limiter.check(request).status_code, 429)
+
+
+@patch('httplib2.Http.request')
+class TestRateLimitedView(TestCase):
+    urls = 'roxy.tests.test_ratelimit'
+
+    def test_answers_429_past_the_limit(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'Content'
+
+        statuses = [self.client.get('/places', HTTP_X_API_KEY='ann').status_code for _ in range(2)]
+        response = self.client.get('/places', HTTP_X_API_KEY='ann')
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual((response['RateLimit-Limit'], response['RateLimit-Remaining']), ('2', '0'))
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(self.client.get('/places', HTTP_X_API_KEY='bob').status_code, 200)
+        self.assertEqual(limited_view.rate_limiter.stats()['limited'], 1)
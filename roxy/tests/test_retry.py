@@ -0,0 +1,99 @@
+import socket
+import threading
+import time
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import Mock, patch
+
+from roxy import OriginUnavailable
+from roxy.retry import LatencyWindow, Retry, RetryBudget
+from roxy.views import proxy
+
+urlpatterns = patterns('',
+    url(r'', proxy(['https://localhost:8009', 'https://localhost:8010'], retries=1)),
+)
+
+
+def ok(content='Content'):
+    return Response({'status': 200}), content
+
+
+class TestRetry(TestCase):
+
+    def test_retries_idempotent_requests_on_errors_and_statuses(self):
+        unavailable = Mock()
+        attempt = Mock(side_effect=[socket.error('reset'), (Response({'status': 503}), unavailable), ok()])
+        retry = Retry(retries=2)
+
+        self.assertEqual(retry.send('GET', '', attempt, {}), ok())
+        self.assertEqual(attempt.call_count, 3)
+        self.assertTrue(unavailable.close.called)
+        self.assertEqual(retry.stats()['retries'], 2)
+
+    def test_does_not_retry_others(self):
+        retry = Retry(retries=2)
+        for method, error in (('POST', socket.error('reset')), ('GET', OriginUnavailable('Circuit open'))):
+            attempt = Mock(side_effect=error)
+            self.assertRaises(type(error), retry.send, method, '', attempt, {})
+            self.assertEqual(attempt.call_count, 1)
+
+    def test_gives_up_when_out_of_budget(self):
+        retry = Retry(retries=2, budget=RetryBudget(ratio=0, min_per_second=0))
+        attempt = Mock(return_value=(Response({'status': 502}), ''))
+
+        self.assertEqual(retry.send('GET', '', attempt, {})[0].status, 502)
+        self.assertEqual(attempt.call_count, 1)
+        self.assertEqual(retry.stats()['budget']['exhausted'], 1)
+
+    def test_budget_is_a_ratio_of_requests(self):
+        budget = RetryBudget(ratio=0.2, min_per_second=0)
+        for _ in range(10):
+            budget.deposit()
+
+        self.assertEqual([budget.withdraw() for _ in range(3)], [True, True, False])
+        self.assertEqual(budget.stats(), {'requests': 10, 'retries': 2, 'exhausted': 1})
+
+    def test_latency_quantile(self):
+        window = LatencyWindow(size=100, quantile=0.95, min_samples=20)
+        for latency in range(19):
+            window.record(latency)
+        self.assertIsNone(window.value())
+        for latency in range(19, 100):
+            window.record(latency)
+        self.assertEqual(window.value(), 94)
+
+    def test_hedges_slow_requests(self):
+        retry = Retry(retries=0, hedge=True)
+        for _ in range(20):
+            retry.latencies.record(0.01)
+        slow_content = Mock()
+        closed = threading.Event()
+        slow_content.close.side_effect = lambda: closed.set()
+        calls = []
+
+        def attempt(headers):
+            calls.append(headers)
+            if len(calls) == 1:
+                time.sleep(0.2)
+                return ok(slow_content)
+            return ok('Fast')
+
+        self.assertEqual(retry.send('GET', '', attempt, {})[1], 'Fast')
+        self.assertEqual((retry.stats()['hedges'], retry.stats()['hedge_wins']), (1, 1))
+        self.assertTrue(closed.wait(1))
+
+
+@patch('httplib2.Http.request')
+class TestRetriedView(TestCase):
+    urls = 'roxy.tests.test_retry'
+
+    def test_retries_on_another_origin(self, mock_request):
+        mock_request.side_effect = [socket.error('Connection reset'), (Response({'status': 200}), 'Content')]
+
+        response = self.client.get('/places')
+
+        self.assertEqual(response.content, 'Content')
+        self.assertEqual([call[0][0] for call in mock_request.call_args_list],
+                         ['https://localhost:8009/places', 'https://localhost:8010/places'])
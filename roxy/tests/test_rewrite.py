@@ -0,0 +1,58 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.rewrite import UrlRewriter
+from roxy.views import proxy
+
+urlpatterns = patterns('',
+    url(r'^api/', proxy('https://localhost:8009', rewrite={
+        'strip_prefix': '/api', 'path_rewrites': [(r'^/v1/', '/legacy/', r'^/legacy/', '/v1/')],
+        'pin_query': {'format': 'json'}})),
+)
+
+
+class TestUrlRewriter(TestCase):
+
+    def test_identity(self):
+        rewriter = UrlRewriter()
+        self.assertEqual(rewriter.forward('/some/path?some=data'), '/some/path?some=data')
+        self.assertEqual(rewriter.location('https://origin/login/?next=/#top', 'testserver', 'http'),
+                         'http://testserver/login/?next=/#top')
+        self.assertEqual(rewriter.location('/login/', 'testserver'), '/login/')
+
+    def test_strip_prefix(self):
+        rewriter = UrlRewriter(strip_prefix='/api/')
+        self.assertEqual(rewriter.forward('/api/users?id=1'), '/users?id=1')
+        self.assertEqual(rewriter.forward('/api'), '/')
+        self.assertEqual(rewriter.forward('/apiary'), '/apiary')
+        self.assertEqual(rewriter.location('http://origin/users/1', 'testserver'), 'http://testserver/api/users/1')
+
+    def test_path_rewrites(self):
+        rewriter = UrlRewriter(path_rewrites=[(r'^/(\w+)/(\d+)$', r'/\1?id=\2'), (r'/old/', '/new/')])
+        self.assertEqual(rewriter.forward('/old/users'), '/new/users')
+        self.assertEqual(rewriter.location('/old/users', 'testserver'), '/old/users')
+
+    def test_pin_query(self):
+        rewriter = UrlRewriter(pin_query={'format': 'json', 'v': '2'})
+        self.assertEqual(rewriter.forward('/search?q=a+b&format=xml'), '/search?q=a+b&format=json&v=2')
+        self.assertEqual(rewriter.forward('/search'), '/search?format=json&v=2')
+        self.assertEqual(rewriter.location('http://origin/search?q=c&v=2', 'testserver'),
+                         'http://testserver/search?q=c')
+
+
+@patch('httplib2.Http.request')
+class TestRewritingView(TestCase):
+    urls = 'roxy.tests.test_rewrite'
+
+    def test_rewrites_request_and_redirect(self, mock_request):
+        for status in (301, 303, 307, 308):
+            mock_request.return_value = (
+                Response({'status': status, 'location': 'https://localhost:8009/legacy/users?format=json'}), '')
+
+            response = self.client.get('/api/v1/users', {'page': '2'})
+
+            self.assertEqual(mock_request.call_args[0][0], 'https://localhost:8009/legacy/users?page=2&format=json')
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(response['Location'], 'http://testserver/api/v1/users')
@@ -0,0 +1,91 @@
+from django.core.exceptions import MiddlewareNotUsed
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from httplib2 import Response
+from mock import patch
+
+from roxy.headers import HeaderRules
+from roxy.middleware import RoxyRouterMiddleware
+from roxy.rewrite import UrlRewriter
+from roxy.router import Router
+from roxy.transport import HttplibTransport
+
+ROUTES = {
+    '/': 'http://default.localhost',
+    '/api': 'http://api.localhost',
+    '/api/v2/': ('http://api2.localhost', {'pool_size': 2}),
+    'media.example.com': 'http://media.localhost',
+    'media.example.com/api/': 'http://media-api.localhost',
+}
+
+
+class TestRouter(TestCase):
+
+    def setUp(self):
+        self.router = Router(ROUTES)
+        self.views = self.router.views
+
+    def test_longest_prefix(self):
+        self.assertIs(self.router.resolve('testserver', '/api/v2/users'), self.views['/api/v2/'])
+        self.assertIs(self.router.resolve('testserver', '/api/v1/users'), self.views['/api'])
+        self.assertIs(self.router.resolve('testserver', '/api'), self.views['/api'])
+        self.assertIs(self.router.resolve('testserver', '/apiary'), self.views['/'])
+
+    def test_host_routes_come_first(self):
+        self.assertIs(self.router.resolve('Media.Example.com:8000', '/photo.jpg'), self.views['media.example.com'])
+        self.assertIs(self.router.resolve('media.example.com', '/api/users'), self.views['media.example.com/api/'])
+
+    def test_no_route(self):
+        self.assertIsNone(Router({'/api/': 'http://api.localhost'}).resolve('testserver', '/admin/'))
+
+    def test_unchanged_routes_keep_their_views(self):
+        router = Router(dict(ROUTES, **{'/api': 'http://other.localhost'}), previous=self.router)
+        self.assertIs(router.views['/'], self.views['/'])
+        self.assertIsNot(router.views['/api'], self.views['/api'])
+
+    def test_table_built_again_keeps_its_views(self):
+        def table():
+            return {'/': ('http://default.localhost', {
+                'rewrite': UrlRewriter(strip_prefix='/app', path_rewrites=[(r'^/old/', '/new/')]),
+                'request_headers': HeaderRules(remove=['X-Debug']),
+                'transport': lambda http_kwargs: HttplibTransport(http_kwargs=http_kwargs),
+                'mirror': 'http://shadow.localhost'})}
+        first = Router(table())
+        view = first.views['/']
+
+        self.assertIs(Router(table(), previous=first).views['/'], view)
+        Router({'/': 'http://default.localhost'}, previous=first)
+        view.mirror.copy('GET', 'http', '/', '', {})
+        self.assertEqual(view.mirror.stats()['mirrored'], 0)
+
+
+@patch('httplib2.Http.request')
+class TestRoxyRouterMiddleware(TestCase):
+
+    def test_proxies_matching_requests(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'OK'
+        with override_settings(ROXY_ROUTES={'/api/': 'http://api.localhost'}):
+            middleware = RoxyRouterMiddleware()
+            response = middleware.process_request(RequestFactory().get('/api/users'))
+            self.assertIsNone(middleware.process_request(RequestFactory().get('/admin/')))
+
+        self.assertEqual(response.content, 'OK')
+        self.assertEqual(mock_request.call_args[0][0], 'http://api.localhost/api/users')
+
+    def test_reloads_changed_table(self, mock_request):
+        with override_settings(ROXY_ROUTES={'/api/': 'http://api.localhost'}):
+            middleware = RoxyRouterMiddleware()
+            middleware.current_router()
+        with override_settings(ROXY_ROUTES={'/admin/': 'http://admin.localhost'}):
+            self.assertIsNotNone(middleware.current_router().resolve('testserver', '/admin/'))
+
+    def test_reloads_callable_table(self, mock_request):
+        tables = [{'/api/': 'http://api.localhost'}, {'/admin/': 'http://admin.localhost'}]
+        with override_settings(ROXY_ROUTES=lambda: tables.pop(0), ROXY_ROUTES_RELOAD_INTERVAL=0):
+            middleware = RoxyRouterMiddleware()
+            self.assertIsNotNone(middleware.current_router().resolve('testserver', '/api/'))
+            self.assertIsNotNone(middleware.current_router().resolve('testserver', '/admin/'))
+
+    def test_not_used_without_routes(self, mock_request):
+        self.assertRaises(MiddlewareNotUsed, RoxyRouterMiddleware)
@@ -0,0 +1,105 @@
+import gzip
+import httplib
+from StringIO import StringIO
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from mock import Mock, patch
+
+from roxy.pool import ConnectionPool
+from roxy.streaming import open_stream
+from roxy.views import proxy
+
+
+streaming_view = proxy('https://localhost:8009', stream=True, stream_chunk_size=4)
+
+urlpatterns = patterns('',
+    url(r'', streaming_view),
+)
+
+
+class FakeSocket(object):
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, *args, **kwargs):
+        return StringIO(self.data)
+
+
+def create_raw_response(body, status='200 OK', **headers):
+    headers.setdefault('Content-Length', str(len(body)))
+    lines = ['HTTP/1.1 %s' % status] + ['%s: %s' % (key.replace('_', '-'), value) for key, value in headers.items()]
+    response = httplib.HTTPResponse(FakeSocket('\r\n'.join(lines) + '\r\n\r\n' + body))
+    response.begin()
+    return response
+
+
+def create_mock_connection(raw_response):
+    connection = Mock()
+    connection.sock = object()
+    connection.getresponse.return_value = raw_response
+    return connection
+
+
+@patch('roxy.streaming._connection')
+class TestOpenStream(TestCase):
+
+    def test_reads_body_in_chunks(self, mock_connection):
+        mock_connection.return_value = create_mock_connection(create_raw_response('0123456789'))
+        pool = ConnectionPool()
+
+        response, body = open_stream(pool, 'https://localhost:8009/big', 'GET', '', {}, 4)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(pool.stats()['in_use'], 1)
+        self.assertEqual(list(body), ['0123', '4567', '89'])
+        self.assertEqual(pool.stats()['in_use'], 0)
+        mock_connection.return_value.request.assert_called_with('GET', '/big', '', {})
+
+    def test_decompresses_like_httplib2(self, mock_connection):
+        compressed = StringIO()
+        gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+        gzip_file.write('Compressed content')
+        gzip_file.close()
+        mock_connection.return_value = create_mock_connection(
+            create_raw_response(compressed.getvalue(), Content_Encoding='gzip'))
+
+        response, body = open_stream(ConnectionPool(), 'https://localhost:8009/', 'GET', '', {}, 4)
+
+        self.assertEqual(''.join(body), 'Compressed content')
+        self.assertNotIn('content-encoding', response)
+        self.assertNotIn('content-length', response)
+
+    def test_close_before_end_drops_connection(self, mock_connection):
+        connection = create_mock_connection(create_raw_response('0123456789'))
+        mock_connection.side_effect = lambda http, scheme, authority: http.connections.setdefault(scheme, connection)
+        pool = ConnectionPool()
+
+        _, body = open_stream(pool, 'https://localhost:8009/', 'GET', '', {}, 4)
+        iter(body).next()
+        body.close()
+
+        self.assertEqual(pool.stats()['in_use'], 0)
+        connection.close.assert_called_with()
+
+
+class TestStreamingView(TestCase):
+    urls = 'roxy.tests.test_streaming'
+
+    @patch('roxy.streaming._connection')
+    def test_streams_response(self, mock_connection):
+        mock_connection.return_value = create_mock_connection(create_raw_response(
+            'Streamed content', status='302 Found', Location='https://localhost:8009/login/', Set_Cookie='a=b',
+            Connection='keep-alive'))
+
+        response = self.client.get('/some/path', HTTP_HOST='testserver')
+
+        content = ''.join(response.streaming_content) if getattr(response, 'streaming', False) else response.content
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(content, 'Streamed content')
+        self.assertEqual(response['Location'], 'http://testserver/login/')
+        self.assertEqual(response['Set-Cookie'], 'a=b')
+        self.assertFalse(response.has_header('Connection'))
+        args = mock_connection.return_value.request.call_args[0]
+        self.assertEqual(args[:2], ('GET', '/some/path'))
+        self.assertEqual(args[3]['Host'], 'localhost:8009')
@@ -0,0 +1,76 @@
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from httplib2 import Response
+from mock import patch
+
+from roxy.signals import request_timed
+from roxy.tests.test_transport import ORIGIN
+from roxy.timing import RequestTimer, TimingHistogram, current_timer, lap
+from roxy.views import proxy
+
+timed_view = proxy(ORIGIN, timing=True, timing_header=True)
+
+urlpatterns = patterns('',
+    url(r'^metrics$', timed_view.timings.view),
+    url(r'', timed_view),
+)
+
+
+class TestRequestTimer(TestCase):
+
+    def test_laps_add_up(self):
+        with RequestTimer() as timer:
+            self.assertIs(current_timer(), timer)
+            lap('headers')
+            lap('connect')
+            lap('connect')
+        self.assertIsNone(current_timer())
+        self.assertEqual(sorted(timer.phases), ['connect', 'headers'])
+        self.assertAlmostEqual(sum(timer.phases.values()), timer.total)
+        self.assertTrue(timer.server_timing().startswith('headers;dur='))
+
+    def test_lap_without_timer_does_nothing(self):
+        lap('headers')
+        self.assertIsNone(current_timer())
+
+    def test_histogram(self):
+        histogram = TimingHistogram(buckets=(0.1, 1))
+        timer = RequestTimer()
+        timer.phases = {'ttfb': 0.5}
+        histogram.record(timer)
+        timer.phases = {'ttfb': 5}
+        histogram.record(timer)
+
+        stats = histogram.stats()['ttfb']
+        self.assertEqual(stats['buckets'], [(0.1, 0), (1, 1), (float('inf'), 2)])
+        self.assertEqual(stats['sum'], 5.5)
+        self.assertIn('roxy_phase_seconds_bucket{phase="ttfb",le="1.0"} 1', histogram.exposition())
+
+
+class TestTimedView(TestCase):
+    urls = 'roxy.tests.test_timing'
+
+    def test_times_phases(self):
+        timers = []
+
+        def receiver(sender, request, response, timer, **kwargs):
+            timers.append(timer)
+        request_timed.connect(receiver)
+        try:
+            response = self.client.get('/some/path')
+        finally:
+            request_timed.disconnect(receiver)
+
+        self.assertEqual(response.content, '/some/path')
+        self.assertEqual(sorted(timers[0].phases), ['body', 'headers', 'response', 'ttfb', 'wait'])
+        self.assertEqual([part.split(';')[0] for part in response['Server-Timing'].split(', ')],
+                         ['headers', 'wait', 'ttfb', 'body', 'response'])
+        metrics = self.client.get('/metrics').content
+        self.assertIn('roxy_phase_seconds_count{phase="ttfb"} 1', metrics)
+
+    @patch('httplib2.Http.request')
+    def test_timed_requests_are_sent_by_httplib2(self, mock_request):
+        mock_request.return_value = Response({'status': 200}), 'Timed content'
+
+        self.assertEqual(self.client.get('/some/path').content, 'Timed content')
+        self.assertEqual(mock_request.call_count, 1)
@@ -0,0 +1,146 @@
+import atexit
+import BaseHTTPServer
+import gzip
+import SocketServer
+import threading
+from StringIO import StringIO
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+
+from roxy.transport import HttplibTransport, Httplib2Transport
+from roxy.views import proxy
+
+PAGE = 'Compressible content. ' * 100
+
+
+def gzipped(content):
+    compressed = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+    gzip_file.write(content)
+    gzip_file.close()
+    return compressed.getvalue()
+
+
+class OriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_any(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)) or self.path
+        self.send_response(200)
+        if self.path == '/gzip':
+            body = gzipped(PAGE)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Method', self.command)
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the connection without telling the client
+        self.close_connection = int(self.path == '/drop')
+
+    do_GET = do_POST = do_PUT = handle_any
+
+    def log_message(self, *args):
+        pass
+
+
+class Origin(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connections closed by the transports under test
+        pass
+
+
+origin = Origin(('127.0.0.1', 0), OriginHandler)
+origin_thread = threading.Thread(target=origin.serve_forever)
+origin_thread.daemon = True
+origin_thread.start()
+atexit.register(origin.shutdown)
+ORIGIN = 'http://127.0.0.1:%d' % origin.server_address[1]
+
+httplib_view = proxy(ORIGIN, transport='httplib', pool_size=2)
+mixed_view = proxy(['http://one.local', 'http://two.local'], transport_options={
+    'http://two.local': {'transport': 'httplib', 'pool_size': 3, 'timeout': 7}})
+
+urlpatterns = patterns('',
+    url(r'', httplib_view),
+)
+
+
+class TestHttplibTransport(TestCase):
+
+    def setUp(self):
+        self.transport = HttplibTransport(size=1, http_kwargs={'timeout': 5})
+
+    def tearDown(self):
+        self.transport.close()
+
+    def test_reuses_connection(self):
+        for path in ('/one', '/two', '/three'):
+            response, content = self.transport.send(ORIGIN + path, 'GET', '', {})
+            self.assertEqual((response.status, content), (200, path))
+
+        stats = self.transport.stats()
+        self.assertEqual((stats['created'], stats['handshakes'], stats['idle'], stats['in_use']), (1, 1, 1, 0))
+
+    def test_reopens_dropped_connection(self):
+        self.transport.send(ORIGIN + '/drop', 'GET', '', {})
+
+        self.assertEqual(self.transport.send(ORIGIN + '/after', 'POST', 'Body', {})[1], 'Body')
+        self.assertEqual(self.transport.stats()['handshakes'], 2)
+
+    def test_streams_and_decodes_body(self):
+        response, content = self.transport.send(ORIGIN + '/gzip', 'GET', '', {}, chunk_size=100)
+
+        self.assertNotIn('content-encoding', response)
+        self.assertEqual(self.transport.stats()['in_use'], 1)
+        self.assertEqual(''.join(content), PAGE)
+        self.assertEqual(self.transport.stats()['in_use'], 0)
+
+    def test_relays_kept_encoding(self):
+        response, content = self.transport.send(ORIGIN + '/gzip', 'GET', '', {}, keep_encodings=frozenset(['gzip']))
+
+        self.assertEqual(content, gzipped(PAGE))
+        self.assertEqual(response['vary'], 'Accept-Encoding')
+
+    def test_overflows_when_all_connections_are_in_use(self):
+        _, content = self.transport.send(ORIGIN + '/first', 'GET', '', {}, chunk_size=100)
+
+        self.assertEqual(self.transport.send(ORIGIN + '/second', 'GET', '', {})[1], '/second')
+        content.close()
+        stats = self.transport.stats()
+        self.assertEqual((stats['overflows'], stats['created'], stats['idle'], stats['in_use']), (1, 1, 1, 0))
+
+
+class TestTransportOptions(TestCase):
+    urls = 'roxy.tests.test_transport'
+
+    def test_proxies_over_httplib(self):
+        response = self.client.put('/places', 'Over httplib', content_type='text/plain')
+
+        self.assertEqual(response.content, 'Over httplib')
+        self.assertEqual(response['X-Method'], 'PUT')
+        self.assertIsInstance(httplib_view.pool, HttplibTransport)
+
+    def test_options_per_origin(self):
+        one, two = [origin.pool for origin in mixed_view.balancer.origins]
+
+        self.assertIsInstance(one, Httplib2Transport)
+        self.assertEqual(one.size, 10)
+        self.assertIsInstance(two, HttplibTransport)
+        self.assertEqual(two.size, 3)
+        self.assertEqual(two._settings.timeout, 7)
+
+    def test_transport_function(self):
+        created = []
+
+        def transport(http_kwargs):
+            created.append(http_kwargs)
+            return HttplibTransport(http_kwargs=http_kwargs)
+        proxy(ORIGIN, transport=transport, transport_options={ORIGIN: {'timeout': 3}})
+
+        self.assertEqual(created, [{'timeout': 3}])
+
+    def test_unknown_transport(self):
+        self.assertRaises(ValueError, proxy, ORIGIN, transport='carrier pigeon')
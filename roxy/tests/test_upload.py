@@ -0,0 +1,74 @@
+from StringIO import StringIO
+
+from django.conf.urls.defaults import patterns, url
+from django.test import TestCase
+from mock import Mock, patch
+
+from roxy.tests.test_streaming import create_mock_connection, create_raw_response
+from roxy.upload import BodyReader, rewind, upload_body
+from roxy.views import proxy
+
+
+urlpatterns = patterns('',
+    url(r'', proxy('https://localhost:8009', upload_buffer_size=4)),
+)
+
+
+def create_mock_request(body, **meta):
+    request = Mock(spec=['META', 'environ', 'read', 'body'])
+    request.META = meta
+    request.environ = {'wsgi.input': StringIO(body)}
+    request.read.side_effect = request.environ['wsgi.input'].read
+    request.body = body
+    return request
+
+
+class TestUploadBody(TestCase):
+
+    def test_small_body_is_read_whole(self):
+        request = create_mock_request('data', CONTENT_LENGTH='4')
+        self.assertEqual(upload_body(request, {}, 4), 'data')
+
+    def test_large_body_is_read_while_sent(self):
+        request = create_mock_request('0123456789', CONTENT_LENGTH='10')
+        body = upload_body(request, {}, 4)
+        self.assertIsInstance(body, BodyReader)
+        self.assertEqual(len(body), 10)
+        self.assertEqual(body.read(4), '0123')
+        self.assertFalse(rewind(body))
+        self.assertEqual(body.read(), '456789')
+        self.assertEqual(body.read(4), '')
+
+    def test_chunked_body_is_spooled(self):
+        request = create_mock_request('0123456789', HTTP_TRANSFER_ENCODING='chunked')
+        headers = {}
+        body = upload_body(request, headers, 4)
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(body.read(), '0123456789')
+        self.assertTrue(rewind(body))
+        self.assertEqual(body.read(), '0123456789')
+
+    def test_body_already_read_by_django(self):
+        request = create_mock_request('0123456789', CONTENT_LENGTH='10')
+        request._body = 'already read'
+        self.assertEqual(upload_body(request, {}, 4), 'already read')
+
+    def test_no_body(self):
+        self.assertEqual(upload_body(create_mock_request('', CONTENT_LENGTH=''), {}, 4), '')
+
+
+class TestUploadView(TestCase):
+    urls = 'roxy.tests.test_upload'
+
+    @patch('roxy.streaming._connection')
+    def test_large_body_is_streamed_to_origin(self, mock_connection):
+        connection = create_mock_connection(create_raw_response('Uploaded'))
+        sent = []
+        connection.request.side_effect = lambda method, uri, body, headers: sent.append(body.read())
+        mock_connection.return_value = connection
+
+        response = self.client.post('/upload', '0123456789', content_type='application/octet-stream')
+
+        self.assertEqual(response.content, 'Uploaded')
+        self.assertEqual(sent, ['0123456789'])
+        self.assertEqual(connection.request.call_args[0][3]['Content-Length'], 10)
@@ -49,7 +49,7 @@ class TestRequest(TestCase):
             CONTENT_LENGTH = '',
         )
 
-        mock_request.assert_called_with(u'https://localhost:8009/some/path?some=data', 'GET', body=bytearray(b''),
+        mock_request.assert_called_with(u'https://localhost:8009/some/path?some=data', 'GET', body='',
             headers={
                 'Accept': 'text/plain',
                 'Cache-Control': 'no-cache',
@@ -69,7 +69,7 @@ class TestRequest(TestCase):
         Request checklist:
         1. URL. The domain should be replaced by end server domain. Path must stay the same.
         2. Method should be 'POST'.
-        3. Data should be in bytearray equivalence.
+        3. Data should be the raw request body.
         4. All headers are forwarded (including 'Content-Type').
 
         Response checklist:
@@ -89,7 +89,7 @@ class TestRequest(TestCase):
             HTTP_HOST = 'testserver'
         )
 
-        mock_request.assert_called_with(u'https://localhost:8009/some/path', 'POST', body=bytearray(b"{\'some\': \'data\'}"),
+        mock_request.assert_called_with(u'https://localhost:8009/some/path', 'POST', body="{\'some\': \'data\'}",
             headers={
                 'Accept': 'text/plain',
                 'Cache-Control': 'no-cache',
@@ -161,7 +161,7 @@ class TestHopHeaders(TestCase):
             HTTP_UPGRADE = 'Fake upgrade',
         )
 
-        mock_request.assert_called_with(u'https://localhost:8009/some/path?some=data', 'GET', body=bytearray(b''),
+        mock_request.assert_called_with(u'https://localhost:8009/some/path?some=data', 'GET', body='',
             headers={
                 'Accept': 'text/plain',
                 'Cache-Control': 'no-cache',
@@ -0,0 +1,182 @@
+"""
+Breakdown of the time proxied requests spend in each phase
+"""
+import bisect
+import httplib
+import threading
+import time
+
+import httplib2
+from django.http import HttpResponse
+
+# Phases of a proxied request, in the order they happen
+PHASES = ('headers', 'wait', 'connect', 'tls', 'ttfb', 'body', 'response')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_local = threading.local()
+
+
+class RequestTimer(object):
+    """
+    Time of each phase of one proxied request, measured in laps: a phase lasts from the end of the previous one.
+
+    Phases are 'headers', building the request to the origin; 'wait', in the cache, coalescing, limits and for a
+    pooled connection; 'connect' and 'tls', opening a new connection to the origin; 'ttfb', until the origin answers
+    with its status and headers; 'body', reading the body of the response unless it is streamed; and 'response',
+    building the Django response.
+    """
+
+    def __init__(self):
+        self.started = self._last = time.time()
+        self.phases = {}
+
+    def lap(self, phase):
+        """
+        Account the time since the end of the previous phase to phase
+        """
+        now = time.time()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        """
+        Seconds from the start of the request to the end of the last phase
+        """
+        return self._last - self.started
+
+    def __enter__(self):
+        _local.timer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.timer = None
+
+    def server_timing(self):
+        """
+        Value of a Server-Timing header giving the phases in milliseconds
+        """
+        return ', '.join('%s;dur=%.3f' % (phase, self.phases[phase] * 1000) for phase in PHASES
+                         if phase in self.phases)
+
+
+def current_timer():
+    """
+    Timer of the request the current thread is proxying, None when it is not timed
+    """
+    return getattr(_local, 'timer', None)
+
+
+def lap(phase):
+    """
+    End phase of the request the current thread is proxying, if it is timed
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.lap(phase)
+
+
+class TimingHistogram(object):
+    """
+    Histograms of the time proxied requests spent in each phase, and in total, over buckets upper bounds in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, timer):
+        """
+        Add the phases of a timed request
+        """
+        with self._lock:
+            for phase, seconds in timer.phases.items() + [('total', timer.total)]:
+                histogram = self._histograms.get(phase)
+                if histogram is None:
+                    histogram = self._histograms[phase] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+                histogram['counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+                histogram['sum'] += seconds
+
+    def stats(self):
+        """
+        Snapshot of the histograms, the count of each bucket being cumulative like in Prometheus
+        """
+        with self._lock:
+            stats = {}
+            for phase, histogram in self._histograms.items():
+                cumulative = []
+                for count in histogram['counts']:
+                    cumulative.append(count + (cumulative[-1] if cumulative else 0))
+                stats[phase] = {
+                    'buckets': zip(self.buckets + (float('inf'),), cumulative),
+                    'count': cumulative[-1],
+                    'sum': histogram['sum'],
+                }
+        return stats
+
+    def exposition(self, name='roxy_phase_seconds'):
+        """
+        The histograms in the Prometheus text format
+        """
+        lines = ['# TYPE %s histogram' % name]
+        for phase, histogram in sorted(self.stats().items()):
+            for bound, count in histogram['buckets']:
+                lines.append('%s_bucket{phase="%s",le="%s"} %d' % (name, phase, _bound(bound), count))
+            lines.append('%s_sum{phase="%s"} %r' % (name, phase, histogram['sum']))
+            lines.append('%s_count{phase="%s"} %d' % (name, phase, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def view(self, request):    # pylint: disable=W0613
+        """
+        Django view answering the histograms to a Prometheus scraper
+        """
+        return HttpResponse(self.exposition(), content_type='text/plain; version=0.0.4')
+
+
+def _bound(bound):
+    """
+    Upper bound of a bucket as Prometheus writes it
+    """
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def install_tls_timer():
+    """
+    Have httplib2 account the TLS handshakes of timed requests to their 'tls' phase
+    """
+    wrap_socket = getattr(httplib2, '_ssl_wrap_socket', None)
+    if wrap_socket is None or getattr(wrap_socket, 'roxy_timed', False):
+        return
+
+    def timed_wrap_socket(*args, **kwargs):
+        """
+        Wrap a socket in TLS the way httplib2 does, between the laps of the connect and tls phases
+        """
+        lap('connect')
+        sock = wrap_socket(*args, **kwargs)
+        lap('tls')
+        return sock
+    timed_wrap_socket.roxy_timed = True
+    httplib2._ssl_wrap_socket = timed_wrap_socket    # pylint: disable=W0212
+
+
+class _TimedResponse(httplib.HTTPResponse):
+    """
+    Response ending the ttfb phase once its status line and headers are read
+    """
+
+    def begin(self):
+        httplib.HTTPResponse.begin(self)
+        lap('ttfb')
+
+
+def install_response_timer():
+    """
+    Have the connections of httplib2 tell the time to the first byte of the responses of timed requests from the
+    rest of their body
+    """
+    for connection_class in set(httplib2.SCHEME_TO_CONNECTION.values()):
+        if connection_class.response_class is httplib.HTTPResponse:
+            connection_class.response_class = _TimedResponse
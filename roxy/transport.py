@@ -0,0 +1,152 @@
+"""
+Transports sending proxied requests to an origin, one per origin, interchangeable behind ``Transport``
+"""
+import httplib2
+
+from roxy import Http
+from roxy.pool import BasePool, ConnectionPool, dropped
+from roxy.streaming import UpstreamBody, body_decoder, new_connection, open_stream, send_request
+from roxy.timing import lap
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class Transport(object):
+    """
+    Interface of the transports of the origins of a proxied view, the ``pool`` of each ``Origin``
+    """
+
+    def send(self, uri, method, body, headers, chunk_size=None, keep_encodings=None):    # pylint: disable=R0913
+        """
+        Send a request to the origin, return (httplib2 response, content).
+
+        Content is read whole, or is an iterator over the body chunk_size bytes at a time when chunk_size is given.
+        body is a string or a file-like object read while it is sent. Bodies are decompressed unless their content
+        coding is one of keep_encodings, None when no body is ever relayed encoded.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Snapshot of the transport counters, in_use being the requests in flight
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Close the idle connections
+        """
+
+
+class Httplib2Transport(ConnectionPool, Transport):
+    """
+    Requests sent by pooled ``roxy.Http`` instances, see ``ConnectionPool``, the default.
+
+    httplib2 sends requests whose body is in memory and whose response is read whole. Roxy sends the others itself,
+    on the connections of the same Http instances: streamed responses, those that may be relayed encoded and bodies
+    read from the client while they are sent, as httplib2 would resend what it has partly read.
+    """
+
+    def send(self, uri, method, body, headers, chunk_size=None, keep_encodings=None):    # pylint: disable=R0913
+        """
+        Send a request through a pooled Http instance, see ``Transport.send()``
+        """
+        if chunk_size is not None or keep_encodings is not None or hasattr(body, 'read'):
+            response, content = open_stream(self, uri, method, body, headers, chunk_size or _CHUNK_SIZE,
+                                            keep_encodings)
+            if chunk_size is None:
+                content = ''.join(content)
+                lap('body')
+            return response, content
+        with self.connection() as http:
+            lap('wait')
+            response, content = http.request(uri, method, body=body, headers=headers)
+        lap('body')
+        return response, content
+
+
+class HttplibTransport(BasePool, Transport):
+    """
+    Requests sent on a pool of plain ``httplib`` connections, the way urllib3 pools them, without going through
+    httplib2 at all.
+
+    Up to size connections are kept, the most recently used handed out first, and more are opened when they are all
+    in use, to be closed once used. Connections idle for longer than idle_timeout seconds, or dropped by the origin
+    meanwhile, are closed. Of http_kwargs, the arguments of ``httplib2.Http``, timeout, proxy_info, ca_certs and
+    disable_ssl_certificate_validation are used.
+    """
+
+    def __init__(self, size=10, idle_timeout=60, http_kwargs=None):
+        super(HttplibTransport, self).__init__(size, idle_timeout)
+        # Only holds the connection settings
+        self._settings = Http(**(http_kwargs or {}))
+
+    def send(self, uri, method, body, headers, chunk_size=None, keep_encodings=None):    # pylint: disable=R0913
+        """
+        Send a request on a pooled connection, see ``Transport.send()``
+        """
+        scheme, authority, request_uri, _ = httplib2.urlnorm(httplib2.iri2uri(uri))
+        conn = self.acquire(scheme, authority)
+        lap('wait')
+        sock = conn.sock
+        response = None
+        try:
+            response = send_request(conn, method, request_uri, body, headers)
+        finally:
+            if response is None:
+                self.release(conn, broken=True)
+        if conn.sock is not sock and conn.sock is not None:
+            with self._condition:
+                self._handshakes += 1
+        info = httplib2.Response(response)
+        content = UpstreamBody(self, conn, response, chunk_size or _CHUNK_SIZE,
+                               body_decoder(info, method, keep_encodings))
+        if chunk_size is None:
+            content = ''.join(content)
+            lap('body')
+        return info, content
+
+    def acquire(self, scheme, authority):
+        """
+        Take a connection to authority out of the pool, blocking while all of them are in use
+        """
+        conn = self._checkout((scheme, authority))
+        if conn.sock is not None and dropped(conn.sock):
+            conn.close()
+        return conn
+
+    def release(self, conn, broken=False):
+        """
+        Give a connection back to the pool, closed first when ``broken`` as it may be half way through a message
+        """
+        if broken:
+            conn.close()
+        self._checkin(conn.roxy_key, conn)
+
+    def _take(self, key):
+        """
+        Most recently used idle connection to key, or a new one, taking the place of the least recently used idle
+        connection to another authority when the pool is full. Must be called with the condition held.
+        """
+        for index in xrange(len(self._idle) - 1, -1, -1):
+            if self._idle[index][1] == key:
+                return self._idle.pop(index)[2]
+        if self._created >= self.size and self._idle:
+            self._discard(self._idle.pop(0)[2])
+            self._created -= 1
+        self._created += 1
+        return self._create(key)
+
+    def _create(self, key):
+        """
+        Open a new connection to key, (scheme, authority)
+        """
+        conn = new_connection(self._settings, *key)
+        conn.roxy_key = key
+        return conn
+
+    def _discard(self, conn):
+        """
+        Close a connection
+        """
+        conn.close()
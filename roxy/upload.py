@@ -0,0 +1,95 @@
+"""
+Request bodies forwarded to the origin
+"""
+from tempfile import SpooledTemporaryFile
+
+_SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+def upload_body(request, headers, buffer_size):
+    """
+    Body of request to send to the origin, without copying it more than once.
+
+    A body Django has already read is sent as it is. Otherwise bodies of up to buffer_size bytes are read in one go,
+    and larger ones are returned as a file-like object read from the client while it is being sent to the origin.
+    A chunked body of unknown length is spooled to a temporary file, kept in memory up to buffer_size bytes, and
+    its Content-Length is added to headers.
+    """
+    for attribute in ('_body', '_raw_post_data'):
+        if hasattr(request, attribute):
+            return getattr(request, attribute)
+    content_length = _content_length(request.META)
+    if getattr(request, '_read_started', False) or (content_length is not None and content_length <= buffer_size):
+        # Let Django read the body, or complain if something has already read the stream without keeping it
+        if hasattr(request, 'body'):
+            return request.body
+        return request.raw_post_data
+    if content_length is not None:
+        return BodyReader(request, content_length)
+    if request.META.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+        spool, length = _spool(request.environ['wsgi.input'], buffer_size)
+        headers['Content-Length'] = str(length)
+        return spool
+    return ''
+
+
+def rewind(body):
+    """
+    Get body ready to be sent again after a failed attempt, return False if it cannot be
+    """
+    if not hasattr(body, 'read'):
+        return True
+    if hasattr(body, 'seek'):
+        body.seek(0)
+        return True
+    return not body.consumed
+
+
+class BodyReader(object):
+    """
+    File-like view of a request body of known length, httplib reads it block by block while sending it
+    """
+
+    def __init__(self, request, length):
+        self._request = request
+        self.length = length
+        self.consumed = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        """
+        Read at most size bytes, without going past the end of the body
+        """
+        remaining = self.length - self.consumed
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self._request.read(size) if size else ''
+        self.consumed += len(data)
+        return data
+
+
+def _spool(stream, max_size):
+    """
+    Copy stream into a spooled temporary file, return the file ready to be read from its start and its length
+    """
+    spool = SpooledTemporaryFile(max_size=max_size)
+    while True:
+        chunk = stream.read(_SPOOL_CHUNK_SIZE)
+        if not chunk:
+            break
+        spool.write(chunk)
+    length = spool.tell()
+    spool.seek(0)
+    return spool, length
+
+
+def _content_length(meta):
+    """
+    Content length of the request, None when unknown
+    """
+    try:
+        return int(meta.get('CONTENT_LENGTH'))
+    except (TypeError, ValueError):
+        return None
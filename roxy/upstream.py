@@ -0,0 +1,84 @@
+"""
+Sending of proxied requests to the origins of a view
+"""
+import time
+from functools import partial
+
+from roxy import UPSTREAM_ERRORS
+from roxy.encoding import accepted_encodings
+from roxy.limit import OriginOverloaded
+
+
+class Upstream(object):
+    """
+    Send requests to the origin the balancer chooses, within its concurrency limit, accounting for how they went.
+
+    Responses with a status among failure_statuses count as failures of the origin. Requests go through the
+    ``Transport`` of the origin. Bodies are read whole, or relayed chunk_size bytes at a time when stream is on.
+    With relay_encoded, gzip and deflate bodies are relayed with their content coding intact to clients that accept
+    it. Idempotent requests are sent again, to the same origin or another, as retry, a ``Retry``, allows.
+    """
+
+    def __init__(self, balancer, failure_statuses=(502, 503, 504), stream=False, chunk_size=64 * 1024,
+                 relay_encoded=False, retry=None):    # pylint: disable=R0913
+        self.balancer = balancer
+        self.failure_statuses = frozenset(failure_statuses)
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.relay_encoded = relay_encoded
+        self.retry = retry
+
+    def send(self, method, scheme, full_path, body, headers, key=None):    # pylint: disable=R0913
+        """
+        Send the request to an origin, return (httplib2 response, content). Content is an iterator when streaming.
+        key is the hash key of the request, for balancers that choose origins by consistent hashing.
+        """
+        if self.retry is None:
+            return self._attempt(method, scheme, full_path, body, headers, key)
+        return self.retry.send(method, body, partial(self._attempt, method, scheme, full_path, body, key=key), headers)
+
+    def _attempt(self, method, scheme, full_path, body, headers, key=None):    # pylint: disable=R0913
+        """
+        Send the request to the origin the balancer chooses, within its concurrency limit
+        """
+        origin = self.balancer.choose(key)
+        limiter = origin.limiter
+        if limiter is not None:
+            try:
+                limiter.acquire()
+            except OriginOverloaded:
+                self.balancer.cancel(origin)
+                raise
+        try:
+            response, content = self._send_to(origin, method, origin.target_url(scheme, full_path), body, headers)
+        except Exception:
+            if limiter is not None:
+                limiter.release()
+            raise
+        if limiter is not None:
+            content = limiter.limit(content)
+        return response, content
+
+    def _send_to(self, origin, method, target_url, body, headers):    # pylint: disable=R0913
+        """
+        Send the request to origin, accounting for how it went
+        """
+        # An HTTP/1.1 proxy MUST ensure that any request message it forwards does contain an appropriate
+        # Host header field that identifies the service being requested by the proxy.
+        if 'Host' in headers:
+            headers = dict(headers, Host=origin.host)
+        started = time.time()
+        keep_encodings = accepted_encodings(headers.get('Accept-Encoding')) if self.relay_encoded else None
+        try:
+            response, content = origin.pool.send(target_url, method, body, headers,
+                                                 self.chunk_size if self.stream else None, keep_encodings)
+        except UPSTREAM_ERRORS:
+            self.balancer.record(origin, time.time() - started, failed=True)
+            raise
+        except Exception:
+            # Not a failure of the origin, e.g. the client going away during an upload, but a probe of a half open
+            # circuit must still be given back
+            self.balancer.cancel(origin)
+            raise
+        self.balancer.record(origin, time.time() - started, failed=response.status in self.failure_statuses)
+        return response, content
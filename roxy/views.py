@@ -1,108 +1,294 @@
 """
 views that handle reverse proxy
 """
+from functools import partial
+
 from django.conf import settings
-from django.http import HttpResponse
 from django.conf.global_settings import DEFAULT_CONTENT_TYPE
-from urlobject import URLObject
-
-from roxy import Http
 
-# django 1.4 rename _hop_headers to _hoppish. so define here, these  Hop-by-hop Headers are defined in rfc2616,
-# not to be forwarded by proxies
-_hop_headers = {
-    'connection':1, 'keep-alive':1, 'proxy-authenticate':1,
-    'proxy-authorization':1, 'te':1, 'trailers':1, 'transfer-encoding':1,
-    'upgrade':1
-}
+from roxy import OriginUnavailable
+from roxy.hashring import request_key
+from roxy.headers import RequestHeaders, ResponseHeaders, update_messages_cookie, update_response_headers
+from roxy.options import option, check_no_options_left, build_balancer, build_cache, build_coalescer, \
+    build_compressor, build_mirror, build_negative_cache, build_rate_limiter, build_retry, transport_factory, \
+    view_scope
+from roxy.rewrite import REDIRECT_STATUSES, UrlRewriter
+from roxy.signals import request_timed
+from roxy.streaming import django_response
+from roxy.timing import DEFAULT_BUCKETS, RequestTimer, TimingHistogram, install_response_timer, install_tls_timer, \
+    lap
+from roxy.upload import upload_body
+from roxy.upstream import Upstream
 
 _httplib2_constructor_kwargs = getattr(settings, 'ROXY_HTTPLIB2_CONSTRUCTOR_KWARGS', {})
 
-def proxy(origin_server):
+def proxy(origin_server, **options):
     """
     Builder for the actual Django view. Use this in your urls.py.
+
+    origin_server is the origin to send requests to, or a list of origins, each of them a server or a
+    (server, weight) pair, to spread requests over.
+
+    Options, each of which falls back to the ``ROXY_<OPTION>`` setting when not given:
+
+    transport
+        How requests are sent to the origins, see ``Transport``: 'httplib2', 'httplib' for plain pooled httplib
+        connections, 'http2' to multiplex them over HTTP/2 connections, which needs h2, or a function taking the
+        arguments of ``httplib2.Http`` and returning a transport. Default 'httplib2'.
+    transport_options
+        Options of the transport of each origin, by server, overriding those of the view and updating the
+        ``ROXY_HTTPLIB2_CONSTRUCTOR_KWARGS`` setting, e.g. {'http://a.local': {'transport': 'http2', 'timeout': 5}}.
+    pool_size
+        Maximum number of keep-alive upstream connections kept for each origin, default 10. More are opened when
+        they are all in use, and closed once used.
+    pool_idle_timeout
+        Seconds an idle upstream connection is kept before it is closed, default 60. ``None`` keeps it forever.
+    http2_max_connections
+        HTTP/2 connections to each origin, default 2.
+    balance
+        How requests are spread over the origins, 'round_robin', 'least_outstanding', 'ewma' or 'consistent_hash',
+        see ``Balancer``. Default 'round_robin'.
+    balance_ewma_decay_time
+        Seconds over which the latency average of the 'ewma' strategy forgets past requests, default 10.
+    hash_key
+        What requests are hashed on by the 'consistent_hash' strategy, 'path', 'header:<name>', 'cookie:<name>' or
+        'query:<name>', default 'path'.
+    hash_virtual_nodes
+        Points of each origin on the hash ring per unit of weight, default 160.
+    hash_load_factor
+        Origins with more requests in flight than this times their share are passed over, default 1.25.
+    rate_limit
+        Requests per second each client may send, see ``RateLimiter``, default None for no limit. Requests past it
+        are answered 429 Too Many Requests.
+    rate_limit_burst
+        Requests a client may send at once, default the rate.
+    rate_limit_key
+        What tells clients apart, 'ip', 'header:<name>', 'cookie:<name>' or 'query:<name>', default 'ip'.
+    rate_limit_max_clients
+        Clients whose buckets each process keeps, the least recently seen forgotten first, default 10000.
+    rate_limit_backend
+        Alias of a Django cache, from the CACHES setting, counting requests across processes, default None.
+    rate_limit_scope
+        Views with the same scope share their counts in rate_limit_backend, default the origin servers and rewrite
+        rules of the view.
+    circuit_breaker
+        Stop sending requests to an origin that keeps failing, see ``CircuitBreaker``, default False. Requests go to
+        the other origins meanwhile, and are answered 503 Service Unavailable when none is left.
+    circuit_breaker_threshold
+        Consecutive failures that open the circuit of an origin, default 5.
+    circuit_breaker_reset_timeout
+        Seconds an open circuit waits before letting a probe request through, default 30.
+    circuit_breaker_statuses
+        Response statuses counted as failures of the origin, as well as connection errors and timeouts, default
+        (502, 503, 504).
+    max_in_flight
+        Most requests sent to each origin at the same time, default None for no limit. Requests past it wait in a
+        queue, and are answered 503 Service Unavailable when the queue is full or they wait for too long.
+    max_in_flight_queue
+        Most requests waiting for each origin, default 0.
+    max_in_flight_queue_timeout
+        Seconds a request waits in the queue, default 1.
+    retries
+        Times an idempotent request is sent again when it fails, see ``Retry``, default 0.
+    retry_statuses
+        Response statuses an idempotent request is sent again for, as well as connection errors, default
+        (502, 503, 504).
+    retry_budget_ratio
+        Retries and hedged requests allowed, as a ratio of the requests of the last 10 seconds, default 0.2.
+    retry_budget_min_per_second
+        Retries and hedged requests allowed per second whatever the traffic, default 10.
+    hedge
+        Send an idempotent request again when the origin has not answered it within the 95th percentile of the
+        recent latencies, and use the first answer, default False.
+    hedge_min_delay
+        Seconds a request always waits for before being hedged, default 0.
+    hedge_quantile
+        Quantile of the recent latencies a request waits for before being hedged, default 0.95.
+    rewrite
+        Rules rewriting the path and query of requests forwarded to the origin, and the Location of its redirects
+        back, an ``UrlRewriter`` or a dict of its arguments: strip_prefix, path_rewrites and pin_query.
+    request_headers
+        Changes to the headers of requests forwarded to the origin, a ``HeaderRules`` or a dict of its arguments:
+        remove, rename, add and override. Hop-by-hop headers are never forwarded.
+    response_headers
+        Changes to the headers of responses relayed to the client, as for request_headers.
+    timing
+        Time the phases of each request, see ``RequestTimer``, and send the ``request_timed`` signal, default False.
+    timing_header
+        Give the phases to the client in a Server-Timing header, default False.
+    timing_buckets
+        Upper bounds in seconds of the buckets of the phase histograms, see ``TimingHistogram``.
+    stream
+        Relay the origin response body to the client as it arrives instead of reading it whole first, default False.
+    stream_chunk_size
+        Size of the chunks a streamed body is relayed in, default 64 KiB.
+    relay_encoded
+        Relay gzip and deflate bodies of the origin as they are to clients that accept them, instead of
+        decompressing them, default False.
+    compress
+        Gzip uncompressed responses of compressible types for clients that accept it, see ``Compressor``,
+        default False.
+    compress_level
+        Compression level from 1, fastest, to 9, smallest, default 6.
+    compress_min_size
+        Smaller bodies are not compressed, default 1 KiB.
+    upload_buffer_size
+        Request bodies up to this size are read whole before being sent to the origin, larger ones are sent while
+        they are read from the client, default 1 MiB. Chunked bodies are spooled to a temporary file past this size.
+    cache
+        Keep the cacheable GET responses of the origin and serve them while they are fresh, default False.
+    cache_max_size
+        Bytes the cached responses may take in the memory of each process, default 32 MiB.
+    cache_max_entry_size
+        Larger responses are not cached, or cached on disk with cache_disk_dir, default 1 MiB.
+    cache_backend
+        Alias of a Django cache, from the CACHES setting, shared by all processes as a second cache tier, default None.
+    cache_stale_while_revalidate
+        Seconds a stale cached response is still served for while it is revalidated in the background, default 0.
+    cache_stale_if_error
+        Seconds a stale cached response is still served for when the origin fails, default 0.
+    cache_disk_dir
+        Directory where responses larger than cache_max_entry_size, streamed ones included, are cached, default None.
+    cache_disk_max_size
+        Bytes the responses cached on disk may take, default 1 GiB.
+    cache_disk_max_entry_size
+        Larger responses are not cached on disk, default 256 MiB.
+    cache_key_prefix
+        Prefix of the cache keys, default one made of the origin servers and rewrite rules of the view.
+    negative_cache
+        Answer GET and HEAD requests with the 404, 410 and 5xx response the origin gave to an identical request a
+        moment ago, see ``NegativeCache``, default False.
+    negative_cache_ttls
+        Seconds a response is kept for, by status, default {404: 10, 410: 60, 500: 1, 502: 1, 503: 1, 504: 1}.
+    negative_cache_max_entries
+        Responses kept by each process, the least recently used dropped first, default 10000.
+    coalesce
+        Let concurrent identical GET and HEAD requests share a single request to the origin, default False.
+    coalesce_timeout
+        Seconds a request waits for the response of an identical one before failing, default 30.
+    coalesce_key_headers
+        Request headers that must be equal for requests to share a response, default ('Authorization', 'Cookie').
+    mirror
+        Shadow origin server to send copies of requests to in the background, see ``Mirror``, default None. Its
+        responses are only counted.
+    mirror_sample
+        Fraction of the requests copied, from 0 to 1, default 1.
+    mirror_workers
+        Threads sending the copies, default 2.
+    mirror_queue_size
+        Copies waiting to be sent, more are dropped, default 100.
+
+    The origins of the view, with the state of their circuit breakers and concurrency limiters, are available as
+    ``view.balancer``, see ``Balancer.stats()``, the transport of its first origin as ``view.pool``, see
+    ``Transport.stats()``, its cache as ``view.cache``, see ``ResponseCache.stats()``, its negative cache as
+    ``view.negative_cache``, see ``NegativeCache.stats()``, its coalescer as ``view.coalescer``, see
+    ``Coalescer.stats()``, its mirror as ``view.mirror``, see ``Mirror.stats()``, its retries as ``view.retry``, see
+    ``Retry.stats()``, and its rate limiter as ``view.rate_limiter``, see ``RateLimiter.stats()``. With timing on,
+    the phase histograms are available as ``view.timings``, see ``TimingHistogram``. ``view.close()`` closes the
+    connections of a view that is no longer used.
     """
+    transport = transport_factory(options, _httplib2_constructor_kwargs)
+    balancer = build_balancer(options, origin_server, transport)
+    primary = balancer.origins[0]
+    hash_key = request_key(option(options, 'hash_key', 'path'))
+    rewriter = UrlRewriter.from_option(option(options, 'rewrite', None))
+    scope = view_scope(balancer, rewriter)
+    rate_limiter = build_rate_limiter(options, scope)
+    upload_buffer_size = option(options, 'upload_buffer_size', 1024 * 1024)
+    request_headers = RequestHeaders(option(options, 'request_headers', None))
+    response_headers = ResponseHeaders(option(options, 'response_headers', None))
+    cache = build_cache(options, scope)
+    coalescer = build_coalescer(options)
+    negative_cache = build_negative_cache(options)
+    timing = option(options, 'timing', False)
+    timing_header = option(options, 'timing_header', False)
+    timings = TimingHistogram(option(options, 'timing_buckets', DEFAULT_BUCKETS)) if timing else None
+    upstream = Upstream(
+        balancer,
+        failure_statuses=option(options, 'circuit_breaker_statuses', (502, 503, 504)),
+        stream=option(options, 'stream', False),
+        chunk_size=option(options, 'stream_chunk_size', 64 * 1024),
+        relay_encoded=option(options, 'relay_encoded', False),
+        retry=build_retry(options))
+    compressor = build_compressor(options)
+    mirror = build_mirror(options, transport)
+    check_no_options_left(options)
+    if timing:
+        install_tls_timer()
+        install_response_timer()
+
     def get_page(request):
         """
         reverse proxy Django view
         """
-        request_url = URLObject(request.build_absolute_uri())
-        origin_url = URLObject(origin_server)
-        # if origin server is not a url then assume it's netloc? to make it compat with previous version
-        target_url = request_url.with_netloc(origin_server)
-        if origin_url.scheme:
-            target_url = request_url.with_netloc(origin_url.netloc).with_scheme(origin_url.scheme)
-
-        # Construct headers
-        headers = {}
-        for header, value in request.META.items():
-            if header.startswith('HTTP_') or header in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
-                name = header.replace('HTTP_', '').replace('_', '-').title()
-
-                # Not forward empty content-length (esp in get), this causes weird response
-                if name.lower() == 'content-length' and value == '':
-                    continue
-
-                # An HTTP/1.1 proxy MUST ensure that any request message it forwards does contain an appropriate
-                # Host header field that identifies the service being requested by the proxy.
-                if name.lower() == 'host':
-                    if origin_url.scheme == '':
-                        value = origin_server
-                    else:
-                        value = str(URLObject(origin_server).netloc)
+        if not timing:
+            return proxy_request(request)
+        with RequestTimer() as timer:
+            response = proxy_request(request)
+            timer.lap('response')
+        timings.record(timer)
+        if timing_header:
+            response['Server-Timing'] = timer.server_timing()
+        request_timed.send(sender=get_page, request=request, response=response, timer=timer)
+        return response
 
-                # Assigning headers' values
-                if name.lower() not in _hop_headers.keys():
-                    headers[name] = value
+    def proxy_request(request):
+        """
+        Response of the origin to request
+        """
+        if rate_limiter is not None:
+            refused = rate_limiter.check(request)
+            if refused is not None:
+                return refused
+        headers = request_headers.translate(request.META)
 
         # Send request
-        http = Http(**_httplib2_constructor_kwargs)
-        http.follow_redirects = False
-        if hasattr(request, 'body'):
-            request_body = request.body
-        else:
-            request_body = request.raw_post_data
-        httplib2_response, content = http.request(
-            target_url, request.method,
-            body=bytearray(request_body),
-            headers=headers)
+        request_body = upload_body(request, headers, upload_buffer_size)
+        lap('headers')
+        scheme = 'https' if request.is_secure() else 'http'
+        full_path = rewriter.forward(request.get_full_path())
+        if mirror is not None:
+            mirror.copy(request.method, scheme, full_path, request_body, headers)
+        fetch = partial(upstream.send, request.method, scheme, full_path, request_body,
+                        key=hash_key(request) if balancer.ring is not None else None)
+        for layer in (coalescer, cache, negative_cache):
+            if layer is not None:
+                # Origins are interchangeable, so layers in front of them key requests on their path
+                fetch = partial(layer.fetch, request.method, request.get_full_path(), send=fetch)
+        try:
+            httplib2_response, content = fetch(headers)
+        except OriginUnavailable as error:
+            return error.response()
+        if compressor is not None:
+            httplib2_response, content = compressor.compress(request.method, headers, httplib2_response, content)
 
         # Construct Django HttpResponse
         content_type = httplib2_response.get('content-type', DEFAULT_CONTENT_TYPE)
-        response = HttpResponse(content, status=httplib2_response.status, content_type=content_type)
+        response = django_response(content, httplib2_response.status, content_type)
 
-        update_response_headers(response, httplib2_response)
+        update_response_headers(response, httplib2_response, response_headers)
         update_messages_cookie(request, headers, httplib2_response, response)
 
-        if httplib2_response.status in [301, 302]:
-            location_url = URLObject(httplib2_response['location'])
-            if origin_url.scheme == '':
-                response['location'] = location_url.with_netloc(request.get_host())
-            else:
-                response['location'] = location_url.with_netloc(request_url.netloc).with_scheme(request_url.scheme)
+        if httplib2_response.status in REDIRECT_STATUSES and 'location' in httplib2_response:
+            response['location'] = rewriter.location(
+                httplib2_response['location'], request.get_host(), scheme if primary.scheme else None)
         return response
-    return get_page
-
-
-def update_response_headers(response, headers):
-    """
-    update response header with given headers
-
-    ignore hop headers to avoid django hop-by-hop assertion error as
-    hop-by-hop should not be forwarded by proxy
-    """
-    ignored_keys = ['status', 'content-location'] + _hop_headers.keys()
-    for key, value in headers.items():
-        if key.lower() not in ignored_keys:
-            response[key] = value
-
-def update_messages_cookie(request, headers, httplib2_response, response):
-    """
-    If the request has messages cookie, and now the response from the backend says that it should be deleted,
-    we should delete the cookie
-    """
-    if request.method == 'GET' and headers.get('Cookie') and headers['Cookie'].find('messages='):
-        response_set_cookie = httplib2_response.get('set-cookie','')
-        if (response_set_cookie.find('messages=') == -1) or (response_set_cookie.find('messages=;') != -1):
-            response.delete_cookie('messages')
 
+    def close():
+        """
+        Close the connections of the view and stop its mirror, once it is no longer used
+        """
+        balancer.close()
+        if mirror is not None:
+            mirror.close()
+    get_page.close = close
+    get_page.balancer = balancer
+    get_page.pool = primary.pool
+    get_page.cache = cache
+    get_page.coalescer = coalescer
+    get_page.negative_cache = negative_cache
+    get_page.timings = timings
+    get_page.mirror = mirror
+    get_page.retry = upstream.retry
+    get_page.rate_limiter = rate_limiter
+    return get_page
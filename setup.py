@@ -22,6 +22,7 @@ setup(
         "License :: OSI Approved :: Boost Software License - Version 1.0 - August 17th, 2003",
     ],
     packages = ['roxy', 'roxy.tests'],
-    install_requires = ['httplib2', 'urlobject'],
+    install_requires = ['httplib2'],
+    extras_require = {'http2': ['h2>=3,<4']},
 )
 